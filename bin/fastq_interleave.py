@@ -2,44 +2,155 @@
 fastq_interleave.py
 
 Given two (possibly compressed) FASTQ files, print interleaved FASTQ
-to stdout.
+to stdout, or write it to a file with -o (BGZF-compressed if it ends in
+.gz).
+
+Each mate file is read, and decompressed, by its own thread, in large
+blocks of records; gzipped files are decompressed by a separate gzip
+(or pigz) process feeding the thread.  Pairs are assembled and written a
+block at a time.  With --strict, mate names (up to the first whitespace,
+ignoring any /1 or /2) must match.  Throughput is reported to stderr at
+the end.
+
+Usage:
+python fastq_interleave.py [-o out.fq[.gz]] [--threads N] [--strict] \
+                           [--quiet] <mate 1 FASTQ> <mate 2 FASTQ>
 '''
 
+from __future__ import print_function
 import sys
+import time
+import argparse
+import threading
+from fastx import open_input, open_output, fastq_blocks
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+
+def read_blocks(fn, q, stop):
+    """ Put blocks of FASTQ lines from fn on queue q, then None; put
+        exception instead if something goes wrong.  Give up early if stop
+        gets set. """
+    try:
+        with open_input(fn, threads=True) as fh:
+            for lines in fastq_blocks(fh):
+                if stop.is_set():
+                    return
+                q.put(lines)
+        q.put(None)
+    except Exception as e:
+        q.put(e)
+
+
+class Reader(object):
+    """ Thread reading blocks of records from a FASTQ file """
+
+    def __init__(self, fn, max_blocks=4):
+        self.q = Queue(max_blocks)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=read_blocks, args=(fn, self.q, self.stop))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        """ Stop thread, emptying queue so it isn't stuck putting """
+        self.stop.set()
+        while self.thread.is_alive():
+            while not self.q.empty():
+                self.q.get()
+            self.thread.join(0.1)
+
 
-def openex(fn, mode="rb"):
-    if fn.endswith(".gz"):
-        import gzip
-        return gzip.open(fn, mode)
-    elif fn.endswith(".bz2"):
-        import bz2
-        return bz2.BZ2File(fn, mode)
+def next_block(q):
+    lines = q.get()
+    if isinstance(lines, Exception):
+        raise lines
+    return lines
+
+
+def mate_name(ln):
+    """ Return read name up to first whitespace, less any /1 or /2 """
+    nm = ln.split(None, 1)[0]
+    if nm.endswith(b'/1') or nm.endswith(b'/2'):
+        nm = nm[:-2]
+    return nm
+
+
+def interleave_block(lines1, i1, lines2, i2, nrecs, strict):
+    """ Return list of output lines interleaving nrecs records starting
+        at line i1 of lines1 and line i2 of lines2 """
+    out = []
+    for j in range(0, 4 * nrecs, 4):
+        ln1_1 = lines1[i1+j].rstrip()
+        ln1_2 = lines2[i2+j].rstrip()
+        if strict and mate_name(ln1_1) != mate_name(ln1_2):
+            raise RuntimeError('Mate names don\'t match: "%s" and "%s"' %
+                               (ln1_1.decode(), ln1_2.decode()))
+        if not ln1_1.endswith(b'/1'):
+            ln1_1 += b'/1'
+        if not ln1_2.endswith(b'/2'):
+            ln1_2 += b'/2'
+        out.extend((ln1_1, b'\n', lines1[i1+j+1], lines1[i1+j+2], lines1[i1+j+3],
+                    ln1_2, b'\n', lines2[i2+j+1], lines2[i2+j+2], lines2[i2+j+3]))
+    return out
+
+
+def interleave(fn1, fn2, ofh, strict=False):
+    """ Write interleaved records from fn1 and fn2 to ofh; return (#
+        pairs, # bytes written) """
+    rd1, rd2 = Reader(fn1), Reader(fn2)
+    try:
+        q1, q2 = rd1.q, rd2.q
+        lines1, lines2 = next_block(q1), next_block(q2)
+        i1, i2 = 0, 0
+        npairs, nbytes = 0, 0
+        while lines1 is not None and lines2 is not None:
+            nrecs = min(len(lines1) - i1, len(lines2) - i2) // 4
+            out = b''.join(interleave_block(lines1, i1, lines2, i2, nrecs, strict))
+            ofh.write(out)
+            nbytes += len(out)
+            npairs += nrecs
+            i1 += 4 * nrecs
+            i2 += 4 * nrecs
+            if i1 == len(lines1):
+                lines1, i1 = next_block(q1), 0
+            if i2 == len(lines2):
+                lines2, i2 = next_block(q2), 0
+        if lines1 is not None or lines2 is not None:
+            raise RuntimeError('%s has more records than %s' % ((fn1, fn2) if lines1 is not None else (fn2, fn1)))
+    finally:
+        rd1.close()
+        rd2.close()
+    return npairs, nbytes
+
+
+def go(args):
+    t0 = time.time()
+    if args.output is None:
+        npairs, nbytes = interleave(args.mate1, args.mate2, getattr(sys.stdout, 'buffer', sys.stdout), args.strict)
+        sys.stdout.flush()
     else:
-        return open(fn, mode)
-
-if len(sys.argv) != 3:
-    raise RuntimeError('Must specify 2 input FASTQ files')
-
-ofh = sys.stdout
-with openex(sys.argv[1], 'r') as fh1:
-    with openex(sys.argv[2], 'r') as fh2:
-        while True:
-            ln1_1 = fh1.readline().rstrip()
-            ln1_2 = fh2.readline().rstrip()
-            ln2_1 = fh1.readline()
-            ln2_2 = fh2.readline()
-            ln3_1 = fh1.readline()
-            ln3_2 = fh2.readline()
-            ln4_1 = fh1.readline()
-            ln4_2 = fh2.readline()
-            if len(ln4_1) == 0:
-                assert len(ln4_2) == 0
-                assert len(ln2_1) == 0
-                assert len(ln2_2) == 0
-                break
-            if not ln1_1.endswith('/1'):
-                ln1_1 += '/1'
-            if not ln1_2.endswith('/2'):
-                ln1_2 += '/2'
-            ofh.write(''.join([ln1_1, '\n', ln2_1, ln3_1, ln4_1,
-                               ln1_2, '\n', ln2_2, ln3_2, ln4_2]))
+        with open_output(args.output, args.threads) as ofh:
+            npairs, nbytes = interleave(args.mate1, args.mate2, ofh, args.strict)
+    elapsed = max(time.time() - t0, 1e-9)
+    if not args.quiet:
+        print('Interleaved %d pairs in %0.2fs: %0.0f pairs/s, %0.1f MB/s' %
+              (npairs, elapsed, npairs / elapsed, nbytes / elapsed / 1e6), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Interleave two paired-end FASTQ files')
+    parser.add_argument('mate1', metavar='path', type=str, help='Mate #1 FASTQ (may be .gz or .bz2).')
+    parser.add_argument('mate2', metavar='path', type=str, help='Mate #2 FASTQ (may be .gz or .bz2).')
+    parser.add_argument('-o', '--output', metavar='path', type=str,
+                        help='Write here instead of stdout; BGZF-compressed if it ends in .gz.')
+    parser.add_argument('--threads', metavar='int', type=int, default=1,
+                        help='Threads for compressing .gz output.')
+    parser.add_argument('--strict', action='store_const', const=True, default=False,
+                        help='Check that mate names match.')
+    parser.add_argument('--quiet', action='store_const', const=True, default=False,
+                        help='Don\'t report throughput.')
+    go(parser.parse_args())
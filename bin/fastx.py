@@ -0,0 +1,307 @@
+"""
+fastx.py
+
+Buffered FASTQ/SAM reading and writing shared by art_convert.py and
+mason_convert.py.  Input is read in large blocks of whole lines rather
+than a line at a time, records are handed out in batches, and output is
+accumulated and written with writelines.  Everything is bytes, so the
+same code runs under Python 2 and 3.
+
+Gzipped input can optionally be decompressed by a separate gzip (or
+pigz) process, so decompression overlaps with parsing.  Gzipped output
+is written as BGZF: a series of independently compressed gzip members
+of at most 64 KB each, as written by bgzip and htslib.  Any gzip reader
+can read it, it can be indexed, and the blocks can be compressed by a
+pool of threads.
+"""
+
+import os
+import bz2
+import gzip
+import zlib
+import struct
+import subprocess
+from collections import deque
+from itertools import chain
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+try:
+    from itertools import izip
+except ImportError:
+    izip = zip
+
+block_size = 4 * 1024 * 1024
+
+# Input bytes per BGZF block; same as htslib, so that even incompressible
+# data fits in the 64 KB a block can hold
+bgzf_block_size = 0xff00
+bgzf_eof = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+
+def _close_proc(proc, what):
+    if proc.wait() != 0:
+        raise RuntimeError('%s exited with status %d' % (what, proc.returncode))
+
+
+@contextmanager
+def open_input(fn, threads=False):
+    """ Open FASTQ or SAM file for reading in binary mode.  If threads and
+        fn is gzipped, decompress in a separate process.  Files ending in
+        .bz2 are decompressed with the bz2 module. """
+    if fn.endswith('.gz') and threads:
+        prog = 'pigz' if which('pigz') is not None else 'gzip'
+        proc = subprocess.Popen([prog, '-dc', fn], stdout=subprocess.PIPE, bufsize=block_size)
+        stopped_early = True
+        try:
+            yield proc.stdout
+            stopped_early = len(proc.stdout.read(1)) > 0
+        finally:
+            if stopped_early:
+                proc.terminate()  # reader doesn't want the rest
+            proc.stdout.close()
+        if stopped_early:
+            proc.wait()
+        else:
+            _close_proc(proc, prog)
+    elif fn.endswith('.gz'):
+        with gzip.open(fn, 'rb') as fh:
+            yield fh
+    elif fn.endswith('.bz2'):
+        fh = bz2.BZ2File(fn, 'rb')
+        try:
+            yield fh
+        finally:
+            fh.close()
+    else:
+        with open(fn, 'rb', block_size) as fh:
+            yield fh
+
+
+def bgzf_block(data, level=6):
+    """ Return BGZF block (a gzip member with a BC extra field giving its
+        size) holding data, which must be at most bgzf_block_size bytes """
+    comp = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = comp.compress(data) + comp.flush()
+    if len(cdata) > 65536 - 26:
+        comp = zlib.compressobj(0, zlib.DEFLATED, -15)
+        cdata = comp.compress(data) + comp.flush()
+    header = struct.pack('<BBBBIBBHBBHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25)
+    return header + cdata + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+
+class BgzfWriter(object):
+    """ Binary file-like object that writes BGZF.  With threads > 1,
+        blocks are compressed by a pool of threads while the caller keeps
+        writing; blocks are always written in order. """
+
+    def __init__(self, fn, threads=1, level=6):
+        self.fh = open(fn, 'wb')
+        self.level = level
+        self.pool = ThreadPool(threads) if threads > 1 else None
+        self.max_pending = 4 * threads
+        self.pending = deque()
+        self.buf, self.nbuf = [], 0
+
+    def write(self, data):
+        self.buf.append(data)
+        self.nbuf += len(data)
+        if self.nbuf >= self.max_pending * bgzf_block_size:
+            self._compress()
+
+    def writelines(self, lines):
+        self.buf.extend(lines)
+        self.nbuf += sum(map(len, lines))
+        if self.nbuf >= self.max_pending * bgzf_block_size:
+            self._compress()
+
+    def _compress(self, final=False):
+        """ Compress buffered data, keeping back a partial block unless
+            final """
+        data = b''.join(self.buf)
+        nfull = len(data) - len(data) % bgzf_block_size
+        end = len(data) if final else nfull
+        for i in range(0, end, bgzf_block_size):
+            block = data[i:i+bgzf_block_size]
+            if self.pool is None:
+                self.fh.write(bgzf_block(block, self.level))
+                continue
+            self.pending.append(self.pool.apply_async(bgzf_block, (block, self.level)))
+            while len(self.pending) > self.max_pending:
+                self.fh.write(self.pending.popleft().get())
+        self.buf = [] if end == len(data) else [data[end:]]
+        self.nbuf = len(data) - end
+
+    def close(self):
+        if self.fh.closed:
+            return
+        self._compress(final=True)
+        while len(self.pending) > 0:
+            self.fh.write(self.pending.popleft().get())
+        self.fh.write(bgzf_eof)
+        self.fh.close()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # leave off the EOF block, so readers can tell output is truncated
+            if self.pool is not None:
+                self.pool.terminate()
+            self.fh.close()
+
+
+@contextmanager
+def open_output(fn, threads=1):
+    """ Open file for writing in binary mode, writing BGZF with the given
+        number of compression threads if fn ends in .gz """
+    if fn.endswith('.gz'):
+        with BgzfWriter(fn, threads) as fh:
+            yield fh
+    else:
+        with open(fn, 'wb', block_size) as fh:
+            yield fh
+
+
+def concat_outputs(part_fns, fn):
+    """ Concatenate files written by open_output into fn, in order, and
+        remove them.  For BGZF, only the last EOF block is kept. """
+    bgzf = fn.endswith('.gz')
+    with open(fn, 'wb') as ofh:
+        for part_fn in part_fns:
+            nbytes = os.path.getsize(part_fn)
+            with open(part_fn, 'rb') as fh:
+                if bgzf and nbytes >= len(bgzf_eof):
+                    fh.seek(nbytes - len(bgzf_eof))
+                    if fh.read() == bgzf_eof:
+                        nbytes -= len(bgzf_eof)
+                    fh.seek(0)
+                while nbytes > 0:
+                    buf = fh.read(min(nbytes, block_size))
+                    if len(buf) == 0:
+                        break
+                    ofh.write(buf)
+                    nbytes -= len(buf)
+            os.remove(part_fn)
+        if bgzf:
+            ofh.write(bgzf_eof)
+
+
+def count_records(fn, threads=False, lines_per_record=4):
+    """ Count records in a FASTQ file by counting newlines """
+    nlines, last = 0, b'\n'
+    with open_input(fn, threads) as fh:
+        while True:
+            buf = fh.read(block_size)
+            if len(buf) == 0:
+                break
+            nlines += buf.count(b'\n')
+            last = buf[-1:]
+    if last != b'\n':
+        nlines += 1  # final line has no newline
+    return nlines // lines_per_record
+
+
+def line_blocks(fh, multiple=1):
+    """ Yield lists of lines (with newlines) read from fh in large
+        blocks.  Each list's length is a multiple of "multiple"; a
+        trailing partial group of lines is dropped. """
+    leftover = []
+    while True:
+        lines = fh.readlines(block_size)
+        if len(lines) == 0:
+            break
+        if len(leftover) > 0:
+            lines = leftover + lines
+        n = len(lines) - len(lines) % multiple
+        leftover = lines[n:]
+        if n > 0:
+            yield lines if n == len(lines) else lines[:n]
+
+
+def fastq_blocks(fh):
+    """ Yield lists of FASTQ lines; every 4 lines is a record """
+    return line_blocks(fh, 4)
+
+
+def fastq_records(fh):
+    """ Yield (name line, sequence line, + line, quality line) tuples """
+    for lines in fastq_blocks(fh):
+        for i in range(0, len(lines), 4):
+            yield lines[i], lines[i+1], lines[i+2], lines[i+3]
+
+
+def fastq_pairs(fh1, fh2):
+    """ Yield (mate 1 record, mate 2 record) tuples; stop at the end of
+        the shorter file """
+    return izip(fastq_records(fh1), fastq_records(fh2))
+
+
+def _sam_blocks(fh):
+    for lines in line_blocks(fh):
+        # header lines all come first
+        if lines[0].startswith(b'@'):
+            lines = [ln for ln in lines if not ln.startswith(b'@')]
+        yield lines
+
+
+def sam_records(fh):
+    """ Return iterator over non-header SAM lines, read in blocks.  Per
+        line, it runs in C, so take batches of lines with islice. """
+    return chain.from_iterable(_sam_blocks(fh))
+
+
+def _parse_mason_fields(toks):
+    beg, end, refid, strand = None, None, None, None
+    for tok in toks:
+        if tok.startswith(b'orig_begin='):
+            beg = tok[11:]
+        elif tok.startswith(b'orig_end='):
+            end = tok[9:]
+        elif tok.startswith(b'contig='):
+            refid = tok[7:]
+        elif tok.startswith(b'strand='):
+            strand = tok[7:]
+    return beg, end, refid, strand
+
+
+def parse_mason(nm):
+    """ Parse a Mason read name.  Return 1-based leftmost and rightmost
+        positions, reference id and whether read is from forward strand.
+
+        Mason writes contig=, haplotype=, length=, orig_begin= and
+        orig_end= first and strand= last, so normally only the first few
+        fields are split off and strand= is found from the end, without
+        splitting the long haplotype_infix= and edit_string= fields.
+        Names laid out any other way get a full scan of their fields. """
+    toks = nm.split(None, 6)
+    if len(toks) == 7 and toks[1].startswith(b'contig=') and toks[4].startswith(b'orig_begin=') and \
+            toks[5].startswith(b'orig_end='):
+        refid, beg, end = toks[1][7:], toks[4][11:], toks[5][9:]
+        rest = toks[6]
+        i = rest.rfind(b'strand=')
+        strand = rest[i+7:].split(None, 1)[0] if i >= 0 else None
+    else:
+        beg, end, refid, strand = _parse_mason_fields(nm.split())
+    assert beg is not None and end is not None, nm
+    assert refid is not None
+    assert strand is not None
+    # Convert from 0-based to 1-based
+    return int(beg) + 1, int(end), refid, strand == b'forward'
+
+
+def make_wgsim(refid, posl, posr, len1, len2, flipped, idx, mate):
+    """ Return bytes read name in our modified wgsim-like encoding """
+    # no bytes %-formatting before Python 3.5
+    return refid + ('_%d_%d_0:0:0_0:0:0_%d_%d_%d_%d/%d' % (posl, posr, len1, len2, flipped, idx, mate)).encode()
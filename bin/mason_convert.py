@@ -6,16 +6,29 @@ modified wgsim-like read name encoding.  Pairs may be omitted from the
 output if they seem to clearly violate paired-end constraints, e.g.
 references don't match, strands don't match.
 
+Multiple inputs (or input pairs) are converted in order into a single
+output, with read ids numbered consecutively across inputs.  With
+--processes N, inputs are converted in parallel, one per process, into
+temporary part files that are then concatenated.  For unpaired inputs,
+each process's first read id comes from a first parallel pass that just
+counts lines.  Which pairs survive the filters above isn't known without
+parsing them, so paired inputs are instead converted with ids numbered
+from 1 into uncompressed part files, and a second parallel pass adds
+each input's offset to its ids as it writes the final part files.
+
 Usage:
 python mason_convert.py --in1 *.fastq [--in2 *.fastq] \
-                        --out1 out1.fastq [--out2 out2.fastq]
+                        --out1 out1.fastq [--out2 out2.fastq] [--threads N] \
+                        [--processes N]
 """
 
 from __future__ import print_function
-import re
-import gzip
+import os
 import sys
 import argparse
+from multiprocessing import Pool
+from fastx import open_input, open_output, fastq_blocks, fastq_pairs, parse_mason, make_wgsim, \
+    count_records, concat_outputs
 
 parser = argparse.ArgumentParser(description='Convert Mason FASTQ files to our modified wgsim-like encoding')
 parser.add_argument(
@@ -26,105 +39,162 @@ parser.add_argument(
     '--out1', metavar='path', type=str, required=True, help='Output for mate #1s or unpaired reads.')
 parser.add_argument(
     '--out2', metavar='path', type=str, required=False, help='Output for mate #2s.')
+parser.add_argument(
+    '--threads', metavar='int', type=int, default=1,
+    help='Decompress gzipped inputs in a separate process, and compress .gz outputs (as BGZF) with this many threads.')
+parser.add_argument(
+    '--processes', metavar='int', type=int, default=1,
+    help='Convert this many inputs (or input pairs) at once, each in its own process.  Paired inputs are '
+         'converted to uncompressed temporary files first, then renumbered and compressed in a second pass.')
 args = parser.parse_args()
 
-_mason_orig_beg = re.compile('orig_begin=([0-9]*)')
-_mason_orig_end = re.compile('orig_end=([0-9]*)')
-_mason_contig = re.compile('contig=([^\s]*)')
-_mason_strand = re.compile('strand=([^\s]*)')
-
-
-def parse_mason(nm):
-    be = _mason_orig_beg.search(nm)
-    en = _mason_orig_end.search(nm)
-    assert be is not None and en is not None, nm
-    
-    # Mason's offsets are 0-based
-    left, right = int(be.group(1)), int(en.group(1))
-    
-    rr = _mason_contig.search(nm)
-    assert rr is not None
-    refid = rr.group(1)
-    
-    sr = _mason_strand.search(nm)
-    assert sr is not None
-    strand = sr.group(1)
-    
-    # Convert from 0-based to 1-based
-    return left+1, right, refid, strand == 'forward'
-
-
-def make_wgsim(refid, posl, posr, len1, len2, flipped, idx, mate):
-    return '%s_%d_%d_%d:%d:%d_%d:%d:%d_%d_%d_%d_%d/%d' %\
-           (refid, posl, posr, 0, 0, 0, 0, 0, 0, len1, len2, flipped, idx, mate)
+
+def convert_paired(infn1, infn2, ofh1, ofh2, idx, threads=1):
+    """ Convert pairs from infn1/infn2, numbering them from idx, and write
+        them to ofh1/ofh2.  Return (next idx, [# pairs, # ref id mismatch,
+        # strands match, # strands not compatible]). """
+    n_tot, n_ref_id_mismatch, n_strands_match, n_strands_not_compat = 0, 0, 0, 0
+    with open_input(infn1, threads > 1) as infh1, open_input(infn2, threads > 1) as infh2:
+        out1, out2 = [], []
+        for rec_1, rec_2 in fastq_pairs(infh1, infh2):
+            posl_1, posr_1, refid_1, strand_1 = parse_mason(rec_1[0])
+            posl_2, posr_2, refid_2, strand_2 = parse_mason(rec_2[0])
+            n_tot += 1
+            if refid_1 != refid_2:
+                n_ref_id_mismatch += 1
+                continue
+            elif strand_1 == strand_2:
+                n_strands_match += 1
+                continue
+            elif (posl_1 < posl_2) and strand_2 or (posr_2 < posr_1) and strand_1:
+                n_strands_not_compat += 1
+                continue
+            len_1, len_2 = len(rec_1[1]) - 1, len(rec_2[1]) - 1
+            posl, posr = min(posl_1, posl_2), max(posr_1, posr_2)
+            out1.extend((b'@' + make_wgsim(refid_1, posl, posr, len_1, len_2, strand_2, idx, 1) + b'\n',
+                         rec_1[1], rec_1[2], rec_1[3]))
+            out2.extend((b'@' + make_wgsim(refid_1, posl, posr, len_1, len_2, strand_2, idx, 2) + b'\n',
+                         rec_2[1], rec_2[2], rec_2[3]))
+            idx += 1
+            if len(out1) >= 65536:
+                ofh1.writelines(out1)
+                ofh2.writelines(out2)
+                out1, out2 = [], []
+        ofh1.writelines(out1)
+        ofh2.writelines(out2)
+    return idx, [n_tot, n_ref_id_mismatch, n_strands_match, n_strands_not_compat]
+
+
+def convert_unpaired(infn1, ofh1, idx, threads=1):
+    """ Convert reads from infn1, numbering them from idx, and write them
+        to ofh1.  Return (next idx, [# reads, 0, 0, 0]). """
+    n_tot = 0
+    with open_input(infn1, threads > 1) as infh1:
+        for lines in fastq_blocks(infh1):
+            out = []
+            for i in range(0, len(lines), 4):
+                posl, posr, refid, strand = parse_mason(lines[i])
+                seq = lines[i+1]
+                out.extend((b'@' + make_wgsim(refid, posl, posr, len(seq) - 1, len(seq) - 1,
+                                              not strand, idx, 1) + b'\n',
+                            seq, lines[i+2], lines[i+3]))
+                idx += 1
+            n_tot += len(lines) // 4
+            ofh1.writelines(out)
+    return idx, [n_tot, 0, 0, 0]
+
+
+def count_shard(shard):
+    """ Return # reads in an unpaired input shard """
+    infn1, threads = shard
+    return count_records(infn1, threads > 1)
+
+
+def convert_shard(shard):
+    """ Convert one input shard into its own part files; return (# reads
+        or pairs written, stats) """
+    infn1, infn2, threads, idx, part1, part2 = shard
+    with open_output(part1, threads) as ofh1:
+        if infn2 is None:
+            next_idx, stats = convert_unpaired(infn1, ofh1, idx, threads)
+        else:
+            with open_output(part2, threads) as ofh2:
+                next_idx, stats = convert_paired(infn1, infn2, ofh1, ofh2, idx, threads)
+    return next_idx - idx, stats
+
+
+def renumber_part(job):
+    """ Copy part file written with ids from 1 to its final name, adding
+        offset to each id, and remove it """
+    infn, outfn, offset, threads = job
+    with open_input(infn) as ifh, open_output(outfn, threads) as ofh:
+        for lines in fastq_blocks(ifh):
+            for i in range(0, len(lines), 4):
+                # names end in _<idx>/<mate>
+                prefix, suffix = lines[i].rsplit(b'_', 1)
+                idx, mate = suffix.split(b'/', 1)
+                lines[i] = prefix + ('_%d/' % (int(idx) + offset)).encode() + mate
+            ofh.writelines(lines)
+    os.remove(infn)
+
+
+def part_fn(fn, i):
+    """ Name of i-th part file for output fn; keeps .gz extension """
+    if fn.endswith('.gz'):
+        return '%s.part%d.gz' % (fn[:-3], i)
+    return '%s.part%d' % (fn, i)
+
+
+def convert_parallel(in1, in2, out1, out2, processes, threads):
+    """ Convert input shards in parallel and concatenate the results;
+        return summed stats """
+    pool = Pool(processes)
+    try:
+        if in2 is None:
+            counts = pool.map(count_shard, [(fn1, threads) for fn1 in in1])
+            shards, idx = [], 1
+            for i, fn1 in enumerate(in1):
+                shards.append((fn1, None, threads, idx, part_fn(out1, i), None))
+                idx += counts[i]
+            stats = [st for _, st in pool.map(convert_shard, shards)]
+        else:
+            # number each shard's pairs from 1, uncompressed, then renumber
+            shards = [(fn1, fn2, threads, 1, part_fn(out1, i) + '.unnumbered', part_fn(out2, i) + '.unnumbered')
+                      for i, (fn1, fn2) in enumerate(zip(in1, in2))]
+            results = pool.map(convert_shard, shards)
+            jobs, offset = [], 0
+            for i, (count, _) in enumerate(results):
+                jobs.append((shards[i][4], part_fn(out1, i), offset, threads))
+                jobs.append((shards[i][5], part_fn(out2, i), offset, threads))
+                offset += count
+            pool.map(renumber_part, jobs)
+            stats = [st for _, st in results]
+    finally:
+        pool.close()
+        pool.join()
+    concat_outputs([part_fn(out1, i) for i in range(len(in1))], out1)
+    if in2 is not None:
+        concat_outputs([part_fn(out2, i) for i in range(len(in1))], out2)
+    return [sum(col) for col in zip(*stats)]
 
 
 def go():
     idx = 1
-    n_tot, n_ref_id_mismatch, n_strands_match, n_strands_not_compat = 0, 0, 0, 0
-    n_discarded = 0
-    if args.in2 is not None:
-        for infn1, infn2 in zip(args.in1, args.in2):
-            with gzip.open(infn1) if infn1.endswith('.gz') else open(infn1) as infh1:
-                with gzip.open(infn2) if infn2.endswith('.gz') else open(infn2) as infh2:
-                    with open(args.out1, 'w') as ofh1:
-                        with open(args.out2, 'w') as ofh2:
-                            while True:
-                                ln_1 = infh1.readline().rstrip()[1:]
-                                seq_1 = infh1.readline()
-                                ln3_1 = infh1.readline()
-                                ln4_1 = infh1.readline()
-                                if len(ln4_1) == 0:
-                                    break
-                                ln_2 = infh2.readline().rstrip()[1:]
-                                seq_2 = infh2.readline()
-                                ln3_2 = infh2.readline()
-                                ln4_2 = infh2.readline()
-                                posl_1, posr_1, refid_1, strand_1 = parse_mason(ln_1)
-                                posl_2, posr_2, refid_2, strand_2 = parse_mason(ln_2)
-                                n_tot += 1
-                                if refid_1 != refid_2:
-                                    n_ref_id_mismatch += 1
-                                    n_discarded += 1
-                                    continue
-                                elif strand_1 == strand_2:
-                                    n_strands_match += 1
-                                    n_discarded += 1
-                                    continue
-                                elif (posl_1 < posl_2) and strand_2 or (posr_2 < posr_1) and strand_1:
-                                    n_strands_not_compat += 1
-                                    n_discarded += 1
-                                    continue
-                                assert refid_1 == refid_2
-                                nm_1 = make_wgsim(refid_1, min(posl_1, posl_2), max(posr_1, posr_2), len(seq_1) - 1,
-                                                  len(seq_2) - 1, strand_2, idx, 1)
-                                nm_2 = make_wgsim(refid_1, min(posl_1, posl_2), max(posr_1, posr_2), len(seq_1) - 1,
-                                                  len(seq_2) - 1, strand_2, idx, 2)
-                                ofh1.write("@%s\n" % nm_1)
-                                ofh2.write("@%s\n" % nm_2)
-                                for ln in [seq_1, ln3_1, ln4_1]:
-                                    ofh1.write(ln)
-                                for ln in [seq_2, ln3_2, ln4_2]:
-                                    ofh2.write(ln)
-                                idx += 1
+    stats = [0, 0, 0, 0]
+    if args.processes > 1 and len(args.in1) > 1:
+        stats = convert_parallel(args.in1, args.in2, args.out1, args.out2, args.processes, args.threads)
+    elif args.in2 is not None:
+        with open_output(args.out1, args.threads) as ofh1, open_output(args.out2, args.threads) as ofh2:
+            for infn1, infn2 in zip(args.in1, args.in2):
+                idx, st = convert_paired(infn1, infn2, ofh1, ofh2, idx, args.threads)
+                stats = [x + y for x, y in zip(stats, st)]
     else:
-        for infn1 in args.in1:
-            with gzip.open(infn1) if infn1.endswith('.gz') else open(infn1) as infh1:
-                with open(args.out1, 'w') as ofh1:
-                    while True:
-                        ln = infh1.readline().rstrip()[1:]
-                        seq = infh1.readline()
-                        ln3 = infh1.readline()
-                        ln4 = infh1.readline()
-                        if len(ln4) == 0:
-                            break
-                        n_tot += 1
-                        posl, posr, refid, strand = parse_mason(ln)
-                        nm = make_wgsim(refid, posl, posr, len(seq) - 1, len(seq) - 1, not strand, idx, 1)
-                        ofh1.write("@%s\n" % nm)
-                        for ln in [seq, ln3, ln4]:
-                            ofh1.write(ln)
-                        idx += 1
+        with open_output(args.out1, args.threads) as ofh1:
+            for infn1 in args.in1:
+                idx, st = convert_unpaired(infn1, ofh1, idx, args.threads)
+                stats = [x + y for x, y in zip(stats, st)]
+    n_tot, n_ref_id_mismatch, n_strands_match, n_strands_not_compat = stats
+    n_discarded = n_ref_id_mismatch + n_strands_match + n_strands_not_compat
     print('ref id mismatch: %d (%0.4f%%)' % (n_ref_id_mismatch,
                                              100.0 * n_ref_id_mismatch / n_tot), file=sys.stderr)
     print('strands match: %d (%0.4f%%)' % (n_strands_match,
@@ -134,4 +204,5 @@ def go():
     print('reads converted: %d (%0.4f%%)' % (n_tot - n_discarded,
                                              100.0 * (n_tot - n_discarded) / n_tot), file=sys.stderr)
 
-go()
+if __name__ == '__main__':
+    go()
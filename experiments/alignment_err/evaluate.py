@@ -1,180 +1,238 @@
 """
-cat sam_file.sam | evaluate.py {human|mouse}
+evaluate.py <species> [<alignments.sam|.sam.gz|.bam>] [--config species.json] \
+            [--threads N] [--processes N]
 
-Iterate through a SAM file produced by the Makefile and count:
+Iterate through a SAM or BAM file produced by the Makefile (or SAM on
+stdin, if no file is given) and count:
 
 - # category-1a errors (contaminant aligned to primary reference)
 - # category-1b errors (same-species non-reference sequence aligned to primary reference)
 - # category-2 errors (reference-derived reads that failed to align)
 - # category-3 errors (aligned to reference but not to point of origin)
 - correct alignments of both kinds (target and contamination)
+
+Species are defined in a JSON config (species.json by default): for
+each, the contigs of its primary reference and the prefixes of its
+unplaced/unlocalized contigs.  The config also gives the read-name
+prefixes marking reads from contaminants (category 1a) and from
+same-species non-reference sequence (category 1b).
+
+Alignments are read in blocks of whole lines and each block is
+classified in one go: flags are tested and categories counted with
+numpy, and category-3 checks use the vectorized is_correct_batch from
+../wasp/correct.py.  BAM is decoded by "samtools view" and gzipped SAM
+by pigz (or gzip), each in a separate process; with --processes N,
+blocks are classified by N worker processes.  If samtools isn't on the
+PATH, BAM is decoded by the native reader in ../wasp/bam.py instead,
+which is slower but needs nothing else.
 """
 
 from __future__ import print_function
+import os
 import sys
-import re
-
-
-"""
-Example: 10_26049747_26049846_0:0:0_0:0:0_100_100_0_3999999
-offset is 0-based?
-"""
-_wgsimex_re = re.compile('(.+)_([^_]+)_([^_]+)_([^:]+):([^:]+):([^_]+)_([^:]+):([^:]+):([^_]+)_([^_]+)_([^_]+)_([^_]+)_([^/]+).*')
-#                           1   2       3       4       5       6       7       8       9       10      11      12      13
-
-
-def name_is_extended_wgsim(nm):
-    return _wgsimex_re.match(nm) is not None
-
-
-def pos_from_extended_wgsim(name, mate2=False):
-    res = _wgsimex_re.match(name)
-    refid, fragst1, fragen1 = res.group(1), int(res.group(2))-1, int(res.group(3))-1
-    len1, len2 = int(res.group(10)), int(res.group(11))
-    flip = res.group(12) == '1'
-    ln = len2 if mate2 else len1
-    if flip == mate2:
-        return refid, fragst1, True
-    else:
-        return refid, fragen1 - (ln-1), False
-
-
-"""
-Example: qsim!:GL000229.1:+:6005:100:u
-pretty sure offset is 0-based
-"""
-_qsim_re = re.compile('qsim!:([^:]+):([+-]):([^:]+):.*')
-
-
-def name_is_qsim(nm):
-    return _qsim_re.match(nm) is not None
-
-
-def pos_from_qsim(name):
-    res = _qsim_re.match(name)
-    return res.group(1), int(res.group(3)), res.group(2) == '+'
-
-
-"""
-Example: !h!chr9!118085975!+!50!0
-offset is 0-based
-"""
-_hint_re = re.compile('!h!([^!]+)!([0-9]+)!([+-])!([0-9]+)!([0-9]+)')
-
-
-def name_is_hint(name):
-    return _hint_re.match(name) is not None
-
-
-def pos_from_hint(name):
-    res = _hint_re.match(name)
-    return res.group(1), int(res.group(2)), res.group(3) == '+'
-
-
-"""
-Example:
-hg38_50nt_mason1_unp.fastq.000999999 contig=chr9 haplotype=1 length=50 orig_begin=118085976 orig_end=118086026 snps=0 indels=0 haplotype_infix=ATGACTCTTGAAGCTGGGCGCAGTGGCTCATGCCTGTAATCCTAGCACTT edit_string=MMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMM strand=forward
-"""
-_mason_re = re.compile('[^ ]+ contig=([^ ]+) .* orig_begin=([^ ]+) .* strand=([fr]).*')
-
-
-def name_is_mason1(name):
-    return _mason_re.match(name) is not None
-
-
-def pos_from_mason1(name):
-    res = _hint_re.match(name)
-    return res.group(1), int(res.group(2)), res.group(3) == 'f'
-
-
-def same_pos(pos1, pos2, wiggle=30):
-    """ Returns true when the two positions are basically the same """
-    refid1, pos1, strand1 = pos1
-    refid2, pos2, strand2 = pos2
-    if refid1 != refid2 or strand1 != strand2:
-        return False
-    return abs(pos1 - pos2) < wiggle
-
-
-def is_correct(toks, wiggle=30):
-    """ Checks whether alignment, tokenized in toks, is correct """
-    flags = int(toks[1])
-    aligned_pos = (toks[2], int(toks[3])-1, (flags & 16) == 0)
-    paired = (flags & 1) != 0
-    mate2 = paired and (flags & 128) != 0
-    if name_is_extended_wgsim(toks[0]):
-        true_pos = pos_from_extended_wgsim(toks[0], mate2)
-    elif name_is_qsim(toks[0]):
-        true_pos = pos_from_qsim(toks[0])
-    elif name_is_mason1(toks[0]):
-        true_pos = pos_from_mason1(toks[0])
-    elif name_is_hint(toks[0]):
-        true_pos = pos_from_hint(toks[0])
-    else:
-        raise RuntimeError('Name was not formatted as expected: "%s"' % toks[0])
-    return same_pos(true_pos, aligned_pos, wiggle=wiggle)
-
-
-if len(sys.argv) <= 1:
-    raise RuntimeError('Specify either "human" or "mouse" as argument')
-
-
-human_chrs = {'1', '2', '3', '4', '5', '6', '7', '8', '9',
-              '10', '11', '12', '13', '14', '15', '16', '17', '18', '19',
-              '20', '21', '22', 'MT', 'X', 'Y'}
-
-
-mouse_chrs = {'1', '2', '3', '4', '5', '6', '7', '8', '9',
-              '10', '11', '12', '13', '14', '15', '16', '17', '18', '19',
-              'MT', 'X', 'Y'}
-
-
-def is_human_chr(st):
-    return st in human_chrs or st[:2] == 'KI' or st[:2] == 'GL'
-
-
-def is_mouse_chr(st):
-    return st in mouse_chrs or st[:2] == 'JH' or st[:2] == 'GL'
-
-
+import json
+import argparse
+import subprocess
+from contextlib import contextmanager
+from multiprocessing import Pool
+import numpy as np
+
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'wasp'))
+import bam
+from correct import is_correct_batch
+
+block_size = 4 * 1024 * 1024
 wiggle = 30
-cat1a, cat1b, cat2, cat3 = 0, 0, 0, 0
-cor_target = 0  # # target reads correctly aligned to target
-cor_contam = 0
-for ln in sys.stdin:
-    if ln[0] == '@':
-        continue
-    toks = ln.split('\t')
-    from_contaminant = toks[0][0] == 'r'
-    from_chm = toks[0].startswith('utg718000') or toks[0].startswith('JSAF020')
-    assert not from_contaminant or not from_chm
-    unal = (int(toks[1]) & 4) != 0
-    if unal and not from_contaminant and not from_chm:
-        cat2 += 1  # incorrectly failed to align to target
-    elif unal:
-        cor_contam += 1  # correctly failed to align to target
+default_config = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'species.json')
+
+
+class Config(object):
+    """ Read-name prefixes and target-species contigs, from JSON config """
+
+    def __init__(self, fn, species):
+        with open(fn) as fh:
+            js = json.load(fh)
+        if species not in js['species']:
+            raise RuntimeError('Species "%s" not in %s; choose from: %s' %
+                               (species, fn, ', '.join(sorted(js['species']))))
+        self.species = species
+        self.contaminant_prefixes = tuple(js['contaminant_prefixes'])
+        self.nonref_prefixes = tuple(js['nonref_prefixes'])
+        self.contigs = set(js['species'][species]['contigs'])
+        self.contig_prefixes = tuple(js['species'][species].get('contig_prefixes', []))
+
+    def is_target_contig(self, st):
+        return st in self.contigs or st.startswith(self.contig_prefixes)
+
+
+@contextmanager
+def open_alignments(fn, threads=1):
+    """ Open SAM/BAM file (or stdin if fn is None) for reading in binary
+        mode.  BAM and gzipped SAM are decoded in a separate process. """
+    if fn is None:
+        yield getattr(sys.stdin, 'buffer', sys.stdin)
+        return
+    if fn.endswith('.bam'):
+        cmd = ['samtools', 'view', '-@', str(max(threads - 1, 0)), fn]
+    elif fn.endswith('.gz'):
+        prog = 'pigz' if which('pigz') is not None else 'gzip'
+        cmd = [prog, '-dc', fn] + (['-p', str(threads)] if prog == 'pigz' else [])
     else:
-        assert sys.argv[1] != 'human' or is_human_chr(toks[2])
-        assert sys.argv[1] != 'mouse' or is_mouse_chr(toks[2])
-        if from_contaminant:
-            cat1a += 1  # incorrectly aligned to target
-        elif from_chm:
-            cat1b += 1  # incorrectly aligned to target
-        elif not is_correct(toks, wiggle):
-            cat3 += 1  # correctly aligned to target, but to wrong locus
-        else:
-            cor_target += 1  # correct
-
-cat1 = cat1a + cat1b
-err = cat1 + cat2 + cat3
-tot = err + cor_target + cor_contam
-
-print('total=%d' % tot, file=sys.stderr)
-print('error=%d, %0.04f%%' % (err, float(100*err)/tot), file=sys.stderr)
-
-print('type,count,pct_total,pct_error')
-print('1,%d,%0.04f,%0.04f' % (cat1, float(100*cat1)/tot, float(100*cat1)/err))
-print('1a,%d,%0.04f,%0.04f' % (cat1a, float(100*cat1a)/tot, float(100*cat1a)/err))
-print('1b,%d,%0.04f,%0.04f' % (cat1b, float(100*cat1b)/tot, float(100*cat1b)/err))
-print('2,%d,%0.04f,%0.04f' % (cat2, float(100*cat2)/tot, float(100*cat2)/err))
-print('3,%d,%0.04f,%0.04f' % (cat3, float(100*cat3)/tot, float(100*cat3)/err))
+        with open(fn, 'rb', block_size) as fh:
+            yield fh
+        return
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=block_size)
+    try:
+        yield proc.stdout
+    finally:
+        proc.stdout.close()
+    if proc.wait() != 0:
+        raise RuntimeError('%s exited with status %d' % (cmd[0], proc.returncode))
+
+
+def read_blocks(fh):
+    """ Yield blocks of whole lines, as bytes, from binary file fh """
+    while True:
+        block = fh.read(block_size)
+        if len(block) == 0:
+            break
+        if not block.endswith(b'\n'):
+            block += fh.readline()
+        yield block
+
+
+def bam_blocks(fn, threads=1, recs_per_block=65536):
+    """ Yield blocks of SAM lines, as bytes, decoded from BAM file fn by
+        the native reader.  Lines have just the QNAME, FLAG, RNAME and POS
+        fields, which is all classify_block looks at. """
+    lines = []
+    for qname, flag, rname, pos, _, _ in bam.BamReader(fn, threads=threads).records():
+        lines.append('%s\t%d\t%s\t%d\n' % (qname, flag, rname, pos))
+        if len(lines) >= recs_per_block:
+            yield ''.join(lines).encode()
+            lines = []
+    if len(lines) > 0:
+        yield ''.join(lines).encode()
+
+
+@contextmanager
+def alignment_blocks(fn, threads=1):
+    """ Yield iterator over blocks of SAM lines from fn (or stdin if fn
+        is None).  BAM is decoded natively if samtools isn't on the PATH. """
+    if fn is not None and fn.endswith('.bam') and which('samtools') is None:
+        yield bam_blocks(fn, threads)
+        return
+    with open_alignments(fn, threads) as fh:
+        yield read_blocks(fh)
+
+
+# Index of each count in the arrays returned by classify_block
+CAT1A, CAT1B, CAT2, CAT3, COR_TARGET, COR_CONTAM = range(6)
+
+
+def classify_block(block, config):
+    """ Classify the alignments in a block of SAM text.  Returns array of
+        counts, indexed by CAT1A, ..., COR_CONTAM. """
+    counts = np.zeros(6, dtype=np.int64)
+    recs = [ln.split('\t', 4) for ln in block.decode().split('\n') if ln and ln[0] != '@']
+    if len(recs) == 0:
+        return counts
+    names = [rec[0] for rec in recs]
+    flags = np.array([int(rec[1]) for rec in recs], dtype=np.int64)
+    from_contaminant = np.array([nm.startswith(config.contaminant_prefixes) for nm in names], dtype=bool)
+    from_nonref = np.array([nm.startswith(config.nonref_prefixes) for nm in names], dtype=bool)
+    both = np.flatnonzero(from_contaminant & from_nonref)
+    if len(both) > 0:
+        raise RuntimeError('Read "%s" matches both contaminant and non-reference prefixes' % names[both[0]])
+    from_target = ~from_contaminant & ~from_nonref
+    unal = (flags & 4) != 0
+    aligned = np.flatnonzero(~unal)
+    for rname in set(recs[i][2] for i in aligned):
+        if not config.is_target_contig(rname):
+            raise RuntimeError('Read aligned to "%s", which is not a %s contig' % (rname, config.species))
+    counts[CAT2] = np.count_nonzero(unal & from_target)  # incorrectly failed to align to target
+    counts[COR_CONTAM] = np.count_nonzero(unal & ~from_target)  # correctly failed to align to target
+    counts[CAT1A] = np.count_nonzero(~unal & from_contaminant)  # incorrectly aligned to target
+    counts[CAT1B] = np.count_nonzero(~unal & from_nonref)  # incorrectly aligned to target
+    target = np.flatnonzero(~unal & from_target)
+    if len(target) > 0:
+        cor = is_correct_batch([names[i] for i in target], flags[target],
+                               [recs[i][2] for i in target], [int(recs[i][3]) for i in target], wiggle=wiggle)
+        counts[COR_TARGET] = np.count_nonzero(cor)  # correct
+        counts[CAT3] = len(target) - counts[COR_TARGET]  # aligned to target, but to wrong locus
+    return counts
+
+
+_worker_config = None
+
+
+def _init_worker(config):
+    global _worker_config
+    _worker_config = config
+
+
+def _classify_block_worker(block):
+    return classify_block(block, _worker_config)
+
+
+def evaluate(fn, config, threads=1, processes=1):
+    """ Return array of counts, indexed by CAT1A, ..., COR_CONTAM, for the
+        alignments in fn """
+    counts = np.zeros(6, dtype=np.int64)
+    with alignment_blocks(fn, threads) as blocks:
+        if processes <= 1:
+            for block in blocks:
+                counts += classify_block(block, config)
+            return counts
+        pool = Pool(processes, _init_worker, (config,))
+        try:
+            for block_counts in pool.imap_unordered(_classify_block_worker, blocks):
+                counts += block_counts
+        finally:
+            pool.close()
+            pool.join()
+    return counts
+
+
+def corstats(counts):
+    """ Return (summary lines, .corstats CSV lines) for array of counts """
+    cat1a, cat1b, cat2, cat3, cor_target, cor_contam = map(int, counts)
+
+    cat1 = cat1a + cat1b
+    err = cat1 + cat2 + cat3
+    tot = err + cor_target + cor_contam
+
+    summary = ['total=%d' % tot,
+               'error=%d, %0.04f%%' % (err, float(100*err)/tot)]
+    lines = ['type,count,pct_total,pct_error']
+    for typ, count in [('1', cat1), ('1a', cat1a), ('1b', cat1b), ('2', cat2), ('3', cat3)]:
+        lines.append('%s,%d,%0.04f,%0.04f' % (typ, count, float(100*count)/tot, float(100*count)/err))
+    return summary, lines
+
+
+def go(args):
+    config = Config(args.config, args.species)
+    summary, lines = corstats(evaluate(args.input, config, args.threads, args.processes))
+    for ln in summary:
+        print(ln, file=sys.stderr)
+    for ln in lines:
+        print(ln)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Count category 1-3 alignment errors')
+    parser.add_argument('species', metavar='name', type=str, help='Target species, as named in --config.')
+    parser.add_argument('input', metavar='path', type=str, nargs='?',
+                        help='SAM, gzipped SAM or BAM alignments; default: SAM on stdin.')
+    parser.add_argument('--config', metavar='path', type=str, default=default_config,
+                        help='JSON file defining species and read-name prefixes.')
+    parser.add_argument('--threads', metavar='int', type=int, default=1,
+                        help='Threads for decoding BAM or gzipped SAM.')
+    parser.add_argument('--processes', metavar='int', type=int, default=1,
+                        help='Classify blocks of alignments in this many processes.')
+    go(parser.parse_args())
@@ -1,7 +1,33 @@
 #!/usr/bin/env python
 
+"""
+tabulate.py [-o results.csv] [--processes N] [--threads N] [--config species.json] \
+            [<alignments.sam|.bam> ...]
+
+Evaluate the given mixture alignments (named like
+r1_mason_hg38_mixture_100.sam) and write one CSV table of all their
+error categories, with the species, read length and pairedness taken
+from each name.  With no alignments given, looks for the usual 12
+species/read-length/pairedness combinations.
+
+Inputs are evaluated concurrently, one per process (by default, one
+process per CPU), and each one's counts are saved next to it in a
+.corstats file, as "evaluate.py" writes them.  Inputs whose .corstats
+file is newer than they are aren't evaluated again, and if an input is
+missing but its .corstats file is there, that's used instead.  Which
+species to evaluate each assembly against comes from the "assemblies"
+section of the config.
+"""
+
 from __future__ import print_function
+import os
+import re
+import sys
+import json
+import argparse
 from itertools import product
+from multiprocessing import Pool, cpu_count
+from evaluate import Config, evaluate, corstats, default_config
 
 
 species_list = ['hg38', 'hg38chm1', 'mouse']
@@ -10,11 +36,90 @@ paired_prefix_list = ['r0', 'r1']
 
 headers = ['species', 'rdlen', 'paired', 'type', 'count', 'pct_total', 'pct_error']
 
-print(','.join(headers))
-for s, r, p in product(species_list, rdlen_list, paired_prefix_list):
-    fn = '_'.join([p, 'mason', s, 'mixture', r]) + '.corstats'
-    with open(fn) as fh:
-        for ln in fh:
-            if ln.startswith('type'):
-                continue
-            print(','.join([s, r, 'T' if p == 'r1' else 'F', ln.rstrip()]))
+_name_re = re.compile('(r[01])_mason_(.+)_mixture_([0-9]+)$')
+
+
+def corstats_fn(fn):
+    """ Name of .corstats file for alignment file fn """
+    base = os.path.basename(fn)
+    for ext in ('.gz', '.sam', '.bam'):
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    return os.path.join(os.path.dirname(fn), base + '.corstats')
+
+
+def parse_name(fn):
+    """ Return (species, read length, paired prefix) from alignment or
+        .corstats file name """
+    res = _name_re.match(os.path.basename(corstats_fn(fn))[:-len('.corstats')])
+    if res is None:
+        raise RuntimeError('Can\'t get species, read length and pairedness from name "%s"' % fn)
+    return res.group(2), res.group(3), res.group(1)
+
+
+def up_to_date(fn):
+    cfn = corstats_fn(fn)
+    return os.path.exists(cfn) and (not os.path.exists(fn) or os.path.getmtime(cfn) > os.path.getmtime(fn))
+
+
+def evaluate_one(job):
+    """ Evaluate one alignment file and write its .corstats file """
+    fn, species, config_fn, threads = job
+    summary, lines = corstats(evaluate(fn, Config(config_fn, species), threads))
+    cfn = corstats_fn(fn)
+    with open(cfn + '.tmp', 'w') as fh:
+        fh.write(''.join(ln + '\n' for ln in lines))
+    os.rename(cfn + '.tmp', cfn)
+    return fn, summary
+
+
+def go(args):
+    fns = args.alignments
+    if len(fns) == 0:
+        fns = ['_'.join([p, 'mason', s, 'mixture', r]) + '.sam'
+               for s, r, p in product(species_list, rdlen_list, paired_prefix_list)]
+    with open(args.config) as fh:
+        assemblies = json.load(fh)['assemblies']
+    jobs = []
+    for fn in fns:
+        asm = parse_name(fn)[0]
+        if asm not in assemblies:
+            raise RuntimeError('Assembly "%s" of "%s" not in "assemblies" of %s' % (asm, fn, args.config))
+        if not up_to_date(fn):
+            jobs.append((fn, assemblies[asm], args.config, args.threads))
+        else:
+            print('%s is up to date' % corstats_fn(fn), file=sys.stderr)
+
+    if len(jobs) > 0:
+        pool = Pool(min(args.processes, len(jobs)))
+        try:
+            for fn, summary in pool.imap_unordered(evaluate_one, jobs):
+                print('%s: %s' % (fn, ', '.join(summary)), file=sys.stderr)
+        finally:
+            pool.close()
+            pool.join()
+
+    with open(args.output, 'w') as ofh:
+        ofh.write(','.join(headers) + '\n')
+        for fn in fns:
+            s, r, p = parse_name(fn)
+            with open(corstats_fn(fn)) as fh:
+                for ln in fh:
+                    if ln.startswith('type'):
+                        continue
+                    ofh.write(','.join([s, r, 'T' if p == 'r1' else 'F', ln.rstrip()]) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate mixture alignments and tabulate error categories')
+    parser.add_argument('alignments', metavar='path', type=str, nargs='*',
+                        help='SAM, gzipped SAM or BAM alignments; default: the 12 mixture .sam files.')
+    parser.add_argument('-o', '--output', metavar='path', type=str, default='results.csv',
+                        help='Write table here.')
+    parser.add_argument('--processes', metavar='int', type=int, default=cpu_count(),
+                        help='Evaluate this many inputs at once.')
+    parser.add_argument('--threads', metavar='int', type=int, default=1,
+                        help='Threads for decoding each BAM or gzipped SAM.')
+    parser.add_argument('--config', metavar='path', type=str, default=default_config,
+                        help='JSON file defining species, assemblies and read-name prefixes.')
+    go(parser.parse_args())
@@ -1,59 +1,322 @@
+"""
+Sample reads from a FASTQ file, writing one or more samples (-s) to
+<output>.0, <output>.1, ...  Input may be gzipped.
+
+All samples are drawn in a single scan of the input.  With -f, each read
+is kept with the given probability; rather than drawing a random number
+per read, the sampler draws the gap until its next kept read.  With -n,
+each sample is a reservoir of exactly that many reads (or all of them,
+if there are fewer), filled using Algorithm L, which likewise skips
+ahead over reads it won't take.  Either way, reads are written in input
+order.
+
+For -n, the reservoir holds only the offsets of the chosen reads when the
+input can be read from an arbitrary offset: uncompressed files, and BGZF
+files (e.g. from bgzip), for which the scan notes where each block
+starts.  The chosen reads are then read, in input order, by seeking
+to them, decompressing each BGZF block at most once.
+For plain gzip input, the reservoir holds the reads themselves.
+"""
+
+from __future__ import print_function
 from __future__ import division
+import sys
+import math
+import zlib
+import gzip
+import struct
 import random
 import argparse
-import sys
+from bisect import bisect_right
+
+try:
+    from itertools import accumulate
+except ImportError:
+    def accumulate(xs):
+        tot = 0
+        for x in xs:
+            tot += x
+            yield tot
+
+block_size = 4 * 1024 * 1024
+
+
+def is_bgzf(fn):
+    """ Return true iff fn starts with a BGZF block header """
+    with open(fn, 'rb') as fh:
+        hdr = fh.read(16)
+    return len(hdr) == 16 and hdr[:4] == b'\x1f\x8b\x08\x04' and hdr[12:14] == b'BC'
+
+
+class BgzfReader(object):
+    """ Reads a BGZF file block by block, noting the file offset and
+        uncompressed offset of each block so that uncompressed offsets can
+        later be sought to """
+
+    def __init__(self, fn):
+        self.fh = open(fn, 'rb')
+        self.ustarts, self.cstarts = [], []
+        self.upos, self.partial = 0, b''
+        self.last = None  # (block index, data) of last block read_at decompressed
+
+    def _read_block(self):
+        """ Read and decompress next block; return (file offset, data),
+            or None at EOF """
+        coff = self.fh.tell()
+        hdr = self.fh.read(12)
+        if len(hdr) < 12:
+            return None
+        xlen = struct.unpack('<H', hdr[10:12])[0]
+        extra = self.fh.read(xlen)
+        i, bsize = 0, None
+        while i + 4 <= xlen:
+            slen = struct.unpack('<H', extra[i+2:i+4])[0]
+            if extra[i:i+2] == b'BC':
+                bsize = struct.unpack('<H', extra[i+4:i+6])[0] + 1
+            i += 4 + slen
+        if bsize is None:
+            raise RuntimeError('Block at offset %d of %s is not BGZF' % (coff, self.fh.name))
+        cdata = self.fh.read(bsize - 12 - xlen - 8)
+        self.fh.read(8)  # CRC32 and ISIZE
+        return coff, zlib.decompress(cdata, -15)
+
+    def readlines(self, hint):
+        """ Return list of whole lines totalling about hint bytes """
+        bufs, n = [self.partial], len(self.partial)
+        while n < hint:
+            block = self._read_block()
+            if block is None:
+                break
+            self.ustarts.append(self.upos)
+            self.cstarts.append(block[0])
+            self.upos += len(block[1])
+            bufs.append(block[1])
+            n += len(block[1])
+        buf = b''.join(bufs)
+        end = buf.rfind(b'\n') + 1
+        if n < hint:
+            end = len(buf)  # at EOF; keep final line even without newline
+        self.partial = buf[end:]
+        return buf[:end].splitlines(True)
+
+    def _block_at(self, i):
+        """ Return decompressed data of i-th block; the last block
+            decompressed is kept, since sorted offsets often share one """
+        if self.last is None or self.last[0] != i:
+            self.fh.seek(self.cstarts[i])
+            self.last = (i, self._read_block()[1])
+        return self.last[1]
+
+    def read_at(self, uoff, nlines):
+        """ Return nlines lines starting at uncompressed offset uoff """
+        i = bisect_right(self.ustarts, uoff) - 1
+        data, pos = self._block_at(i), uoff - self.ustarts[i]
+        lines, partial = [], b''
+        while len(lines) < nlines:
+            nl = data.find(b'\n', pos)
+            if nl < 0:
+                partial += data[pos:]  # line continues in next block
+                i += 1
+                if i == len(self.ustarts):
+                    break
+                data, pos = self._block_at(i), 0
+                continue
+            lines.append(partial + data[pos:nl+1])
+            partial, pos = b'', nl + 1
+        if len(partial) > 0 and len(lines) < nlines:
+            lines.append(partial)
+        return lines
+
+    def close(self):
+        self.fh.close()
+
+
+class PlainReader(object):
+    """ Uncompressed input, which can be sought to directly """
+
+    def __init__(self, fn):
+        self.fh = open(fn, 'rb', block_size)
+        self.seek_fh = None
+
+    def readlines(self, hint):
+        return self.fh.readlines(hint)
+
+    def read_at(self, uoff, nlines):
+        if self.seek_fh is None:
+            self.seek_fh = open(self.fh.name, 'rb')  # small buffer for short reads
+        self.seek_fh.seek(uoff)
+        return [self.seek_fh.readline() for _ in range(nlines)]
+
+    def close(self):
+        self.fh.close()
+        if self.seek_fh is not None:
+            self.seek_fh.close()
+
+
+class GzipReader(PlainReader):
+    """ Plain gzip input, which can only be read front to back """
+
+    def __init__(self, fn):
+        self.fh = gzip.open(fn, 'rb')
+        self.seek_fh = None
+
+    def read_at(self, uoff, nlines):
+        raise RuntimeError('Cannot seek in plain gzip input')
+
+
+def open_reader(fn):
+    if is_bgzf(fn):
+        return BgzfReader(fn)
+    if fn.endswith('.gz'):
+        return GzipReader(fn)
+    return PlainReader(fn)
+
+
+def record_blocks(reader):
+    """ Yield (lines, uncompressed offset of first line) for blocks of
+        whole FASTQ records """
+    leftover, upos = [], 0
+    while True:
+        lines = reader.readlines(block_size)
+        if len(lines) == 0:
+            break
+        if len(leftover) > 0:
+            lines = leftover + lines
+        n = len(lines) - len(lines) % 4
+        leftover = lines[n:]
+        if n > 0:
+            yield lines[:n], upos
+            upos += sum(map(len, lines[:n]))
+
+
+class BernoulliSampler(object):
+    """ Keeps each record with probability frac """
+
+    def __init__(self, frac, rnd):
+        self.frac = frac
+        self.rnd = rnd
+        self.next = self._gap()
+
+    def _gap(self):
+        if self.frac >= 1.0:
+            return 0
+        if self.frac <= 0.0:
+            return float('inf')
+        return int(math.log(1.0 - self.rnd.random()) / math.log(1.0 - self.frac))
+
+    def take(self, lo, hi):
+        """ Return indexes of kept records among lo, ..., hi-1 """
+        kept = []
+        while self.next < hi:
+            kept.append(self.next)
+            self.next += 1 + self._gap()
+        return kept
+
+
+class ReservoirSampler(object):
+    """ Keeps a uniform random sample of k records (Algorithm L) """
+
+    def __init__(self, k, rnd):
+        self.k = k
+        self.rnd = rnd
+        self.items = []
+        self.w = math.exp(math.log(self._u()) / k)
+        self.next = k + self._gap()
+
+    def _u(self):
+        return 1.0 - self.rnd.random()  # in (0, 1]
+
+    def _gap(self):
+        if self.w >= 1.0:
+            return 0
+        return int(math.log(self._u()) / math.log(1.0 - self.w))
+
+    def take(self, lo, hi):
+        """ Return list of (index, reservoir slot) for records among lo,
+            ..., hi-1 that enter the reservoir """
+        taken = [(i, i) for i in range(lo, min(hi, self.k))]
+        while self.next < hi:
+            taken.append((self.next, self.rnd.randrange(self.k)))
+            self.w *= math.exp(math.log(self._u()) / self.k)
+            self.next += 1 + self._gap()
+        return taken
+
+    def put(self, slot, item):
+        if slot == len(self.items):
+            self.items.append(item)
+        else:
+            self.items[slot] = item
+
+
+def _line_ends(lines):
+    """ Return offsets, relative to start of block, just past each line """
+    return list(accumulate(map(len, lines)))
+
+
+def go(args):
+    rnds = [random.Random(args.random_seed + i) for i in range(args.sample)]
+    output_files = [open(args.output + "." + str(i), "wb") for i in range(args.sample)]
+    reader = open_reader(args.input)
+    seekable = not isinstance(reader, GzipReader)
+    if args.fraction:
+        print("sampling each record with probability %f" % args.fraction)
+        samplers = [BernoulliSampler(args.fraction, rnd) for rnd in rnds]
+    else:
+        print("sampling %d records%s" % (args.number, '' if seekable else ' (holding them in memory)'))
+        samplers = [ReservoirSampler(args.number, rnd) for rnd in rnds]
+
+    nrecs = 0
+    for lines, upos in record_blocks(reader):
+        lo, hi = nrecs, nrecs + len(lines) // 4
+        ends = None
+        for sampler, output in zip(samplers, output_files):
+            if args.fraction:
+                out = []
+                for idx in sampler.take(lo, hi):
+                    j = 4 * (idx - lo)
+                    out.extend(lines[j:j+4])
+                output.writelines(out)
+                continue
+            for idx, slot in sampler.take(lo, hi):
+                j = 4 * (idx - lo)
+                if seekable:
+                    if ends is None:
+                        ends = _line_ends(lines)
+                    sampler.put(slot, (idx, upos + ends[j-1] if j > 0 else upos))
+                else:
+                    sampler.put(slot, (idx, b''.join(lines[j:j+4])))
+        nrecs = hi
+        if nrecs // 1000000 != lo // 1000000:
+            print("%d records processed" % nrecs)
+
+    if not args.fraction:
+        for sampler, output in zip(samplers, output_files):
+            if seekable:
+                for _, off in sorted(sampler.items):
+                    output.writelines(reader.read_at(off, 4))
+            else:
+                output.writelines(rec for _, rec in sorted(sampler.items))
+    reader.close()
+    for output in output_files:
+        output.close()
+    print("sampled from %d records" % nrecs)
+    print("done!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="input FASTQ filename (may be gzipped)")
+    parser.add_argument("output", help="output FASTQ filename")
+    parser.add_argument("-f", "--fraction", type=float, help="fraction of reads to sample")
+    parser.add_argument("-n", "--number", type=int, help="number of reads to sample")
+    parser.add_argument("-s", "--sample", type=int, help="number of output files to write", default=1)
+    parser.add_argument("-r", "--random-seed", type=int, help="seed for pseudo-random generator", default=3452)
+    _args = parser.parse_args()
+
+    if _args.fraction and _args.number:
+        sys.exit("give either a fraction or a number, not both")
+
+    if not _args.fraction and not _args.number:
+        sys.exit("you must give either a fraction or a number")
 
-# Based on: http://pythonforbiologists.com/books
-
-parser = argparse.ArgumentParser()
-parser.add_argument("input", help="input FASTQ filename")
-parser.add_argument("output", help="output FASTQ filename")
-parser.add_argument("-f", "--fraction", type=float, help="fraction of reads to sample")
-parser.add_argument("-n", "--number", type=int, help="number of reads to sample")
-parser.add_argument("-s", "--sample", type=int, help="number of output files to write", default=1)
-parser.add_argument("-r", "--random-seed", type=int, help="seed for pseudo-random generator", default=3452)
-args = parser.parse_args()
-
-if args.fraction and args.number:
-    sys.exit("give either a fraction or a number, not both")
-
-if not args.fraction and not args.number:
-    sys.exit("you must give either a fraction or a number")
-
-print("counting records....")
-with open(args.input) as input:
-    num_lines = sum([1 for line in input])
-total_records = int(num_lines / 4)
-
-if args.fraction:
-    args.number = int(total_records * args.fraction)
-
-print("sampling " + str(args.number) + " out of " + str(total_records) + " records")
-
-random.seed(args.random_seed)
-output_files = []
-output_sequence_sets = []
-for i in range(args.sample):
-    output_files.append(open(args.output + "." + str(i), "w"))
-    output_sequence_sets.append(set(random.sample(xrange(total_records + 1), args.number)))
-
-record_number = 0
-with open(args.input) as input:
-    for line1 in input:
-        line2 = input.next()
-        line3 = input.next()
-        line4 = input.next()
-        for i, output in enumerate(output_files):
-            if record_number in output_sequence_sets[i]:
-                output.write(line1)
-                output.write(line2)
-                output.write(line3)
-                output.write(line4)
-        record_number += 1
-        if record_number % 100000 == 0:
-            print(str((record_number / total_records) * 100) + " % done")
-
-for output in output_files:
-    output.close()
-print("done!")
-print("want to learn how to write useful tools like this? Go to http://pythonforbiologists.com/books")
+    go(_args)
@@ -18,8 +18,8 @@ get() {
     if [ ! -f "${1}" ] ; then
         rm -f "${1}.gz"
         wget "${2}"
-        gzip -dc "${1}.gz" | pypy remove_short.py "${1}.short" > "${1}" 2> "${1}.lengths"
-        samtools faidx "${1}"
+        gzip -dc "${1}.gz" | pypy remove_short.py --verbose --fai "${1}.fai" "${1}.short" > "${1}" 2> "${1}.lengths"
+        [ -f "${1}.fai" ] || samtools faidx "${1}"
     fi
     ln -s -f "${1}" "${3}.fa"
     ln -s -f "${1}.fai" "${3}.fa.fai"
@@ -15,17 +15,20 @@ ZM_URL=ftp://ftp.ensemblgenomes.org/pub/plants/release-21/fasta/zea_mays/dna/$ZM
 ZM4_FA=Zea_mays.AGPv4.dna.toplevel.fa
 ZM4_URL=ftp://ftp.ensemblgenomes.org/pub/plants/release-32/fasta/zea_mays/dna/$ZM4_FA.gz
 
-#curl $GRCh37_URL | gzip -dc | grep -v '^>' | tee >(tr -cd acgtACGT | wc -c | tee grch37_acgt_length.txt | xargs echo "GRCh37 ACGT len") | \
-#                                                   tr -cd acgtnACGTN | wc -c | tee grch37_acgtn_length.txt | xargs echo "GRCh37 ACGTN len"
+# Downloads are kept so that ref_stats.py's cache, which is keyed on each
+# file's path, size and mtime, recognizes them next time; then nothing is
+# downloaded or counted again
 
-curl $GRCh38_URL | gzip -dc | grep -v '^>' | tee >(tr -cd acgtACGT | wc -c | tee grch38_acgt_length.txt | xargs echo "GRCh38 ACGT len") | \
-                                                   tr -cd acgtnACGTN | wc -c | tee grch38_acgtn_length.txt | xargs echo "GRCh38 ACGTN len"
+fetch() {
+    [ -f "$1" ] || (curl -o "$1.tmp" "$2" && mv "$1.tmp" "$1")
+}
 
-curl $GRCm38_URL | gzip -dc | grep -v '^>' | tee >(tr -cd acgtACGT | wc -c | tee grcm38_acgt_length.txt | xargs echo "GRCm38 ACGT len") | \
-                                                   tr -cd acgtnACGTN | wc -c | tee grcm38_acgtn_length.txt | xargs echo "GRCm38 ACGTN len"
+#fetch $GRCh37_FA.gz $GRCh37_URL && python ref_stats.py --prefix grch37 $GRCh37_FA.gz
 
-#curl $ZM_URL     | gzip -dc | grep -v '^>' | tee >(tr -cd acgtACGT | wc -c | tee zm_acgt_length.txt | xargs echo "ZM ACGT len") | \
-#                                                   tr -cd acgtnACGTN | wc -c | tee zm_acgtn_length.txt | xargs echo "ZM ACGTN len"
+fetch $GRCh38_FA.gz $GRCh38_URL && python ref_stats.py --prefix grch38 $GRCh38_FA.gz
 
-curl $ZM4_URL    | gzip -dc | grep -v '^>' | tee >(tr -cd acgtACGT | wc -c | tee zm4_acgt_length.txt | xargs echo "ZM4 ACGT len") | \
-                                                   tr -cd acgtnACGTN | wc -c | tee zm4_acgtn_length.txt | xargs echo "ZM4 ACGTN len"
+fetch $GRCm38_FA.gz $GRCm38_URL && python ref_stats.py --prefix grcm38 $GRCm38_FA.gz
+
+#fetch $ZM_FA.gz $ZM_URL && python ref_stats.py --prefix zm $ZM_FA.gz
+
+fetch $ZM4_FA.gz $ZM4_URL && python ref_stats.py --prefix zm4 $ZM4_FA.gz
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""
+ref_stats.py
+
+Base-composition statistics for FASTA references, all from one pass:
+per contig and overall, the number of upper-case ACGTN, lower-case
+acgtn (i.e. soft-masked) and ACGT/acgt and ACGTN/acgtn characters.  These
+are the numbers repetitiveness.sh and lengths.sh used to get from
+separate "grep | tr | wc" passes.
+
+Inputs (which may be gzipped) are read in chunks of whole lines, and
+chunks are counted in parallel, each with one numpy bincount per contig
+piece.  Chunks split long contigs, so one big chromosome doesn't leave
+the other processes idle.
+
+Results are cached in .ref_stats_cache.json (--cache), keyed by the
+inputs' SHA-1, which is computed during the same pass.  A second map from
+path, size, modification time and inode to SHA-1 lets an unchanged
+reference be looked up without reading it at all, so callers should keep
+the files they've characterized rather than fetch them again.
+
+python ref_stats.py [--prefix NAME] [--per-contig TSV] [--processes N] \\
+                    [--cache FN] <FASTA> [<FASTA> ...]
+
+Prints overall counts; --prefix NAME writes NAME_upper.txt,
+NAME_lower.txt, NAME_acgt_length.txt and NAME_acgtn_length.txt.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import gzip
+import hashlib
+import argparse
+import multiprocessing
+import numpy as np
+
+chunk_size = 16 * 1024 * 1024
+stat_names = ['length', 'upper', 'lower', 'acgt_length', 'acgtn_length']
+
+
+def _mask(chars):
+    mask = np.zeros(256, dtype=bool)
+    mask[np.frombuffer(chars, dtype=np.uint8)] = True
+    return mask
+
+_masks = {'upper': _mask(b'ACGTN'),
+          'lower': _mask(b'acgtn'),
+          'acgt_length': _mask(b'ACGTacgt'),
+          'acgtn_length': _mask(b'ACGTNacgtn')}
+_not_newline = ~_mask(b'\r\n')
+
+
+def stats_from_counts(counts):
+    """ Turn array of 256 byte counts into dict of statistics """
+    stats = dict((name, int(counts[mask].sum())) for name, mask in _masks.items())
+    stats['length'] = int(counts[_not_newline].sum())
+    return stats
+
+
+def count_chunk(chunk):
+    """ Count bytes of sequence in chunk of whole FASTA lines.  Return list
+        of [contig name, byte counts] pieces; name is None for a piece
+        continuing the previous chunk's last contig. """
+    buf = np.frombuffer(chunk, dtype=np.uint8)
+    pieces, pos = [], 0
+    while pos < len(chunk):
+        if chunk[pos:pos+1] == b'>':
+            nl = chunk.find(b'\n', pos)
+            nl = len(chunk) if nl < 0 else nl
+            name = (chunk[pos+1:nl].split() or [b''])[0].decode()
+            pieces.append([name, np.zeros(256, dtype=np.int64)])
+            pos = nl + 1
+            continue
+        end = chunk.find(b'\n>', pos) + 1
+        end = len(chunk) if end == 0 else end
+        counts = np.bincount(buf[pos:end], minlength=256)
+        if len(pieces) > 0:
+            pieces[-1][1] += counts
+        else:
+            pieces.append([None, counts])
+        pos = end
+    return pieces
+
+
+def read_chunks(fn, hasher):
+    """ Yield chunks of whole lines from fn, updating hasher """
+    with (gzip.open(fn, 'rb') if fn.endswith('.gz') else open(fn, 'rb')) as fh:
+        while True:
+            chunk = fh.read(chunk_size)
+            if len(chunk) == 0:
+                break
+            if not chunk.endswith(b'\n'):
+                chunk += fh.readline()
+            hasher.update(chunk)
+            yield chunk
+
+
+def scan(fns, processes=1):
+    """ Return (SHA-1 of inputs, list of (contig name, stats dict)) """
+    hasher = hashlib.sha1()
+    contigs = []  # [name, counts] pairs, in order
+
+    def _chunks():
+        for fn in fns:
+            for chunk in read_chunks(fn, hasher):
+                yield chunk
+
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    results = pool.imap(count_chunk, _chunks()) if pool is not None else (count_chunk(c) for c in _chunks())
+    try:
+        for pieces in results:
+            for name, counts in pieces:
+                if name is None:
+                    if len(contigs) == 0:
+                        raise RuntimeError('Sequence before first FASTA header')
+                    contigs[-1][1] += counts
+                else:
+                    contigs.append([name, counts])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return hasher.hexdigest(), [(name, stats_from_counts(counts)) for name, counts in contigs]
+
+
+def total(contigs):
+    return dict((stat, sum(st[stat] for _, st in contigs)) for stat in stat_names)
+
+
+class StatsCache(object):
+    """ JSON cache of per-contig statistics keyed by input digest """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.cache = {'digests': {}, 'stats': {}}
+        if fn is not None and os.path.exists(fn):
+            with open(fn) as fh:
+                self.cache = json.load(fh)
+
+    @staticmethod
+    def stat_key(fns):
+        keys = []
+        for fn in fns:
+            st = os.stat(fn)
+            keys.append('%s:%d:%r:%d' % (os.path.abspath(fn), st.st_size, st.st_mtime, st.st_ino))
+        return ','.join(keys)
+
+    def get(self, fns):
+        digest = self.cache['digests'].get(self.stat_key(fns))
+        if digest is None or digest not in self.cache['stats']:
+            return None
+        return [(name, st) for name, st in self.cache['stats'][digest]]
+
+    def put(self, fns, digest, contigs):
+        self.cache['digests'][self.stat_key(fns)] = digest
+        self.cache['stats'][digest] = contigs
+        if self.fn is not None:
+            with open(self.fn + '.tmp', 'w') as fh:
+                json.dump(self.cache, fh)
+            os.rename(self.fn + '.tmp', self.fn)
+
+
+def go(args):
+    cache = StatsCache(None if args.no_cache else args.cache)
+    contigs = cache.get(args.fasta)
+    if contigs is None:
+        digest, contigs = scan(args.fasta, args.processes)
+        cache.put(args.fasta, digest, contigs)
+    else:
+        print('Using cached statistics', file=sys.stderr)
+    tot = total(contigs)
+    for stat in stat_names:
+        print('%s\t%d' % (stat, tot[stat]))
+    if args.prefix is not None:
+        for stat in stat_names[1:]:
+            with open('%s_%s.txt' % (args.prefix, stat), 'w') as fh:
+                fh.write('%d\n' % tot[stat])
+    if args.per_contig is not None:
+        with open(args.per_contig, 'w') as fh:
+            fh.write('\t'.join(['name'] + stat_names) + '\n')
+            for name, st in contigs:
+                fh.write('\t'.join([name] + [str(st[stat]) for stat in stat_names]) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Count upper/lower-case and ACGT/ACGTN bases in FASTA files')
+    parser.add_argument('fasta', metavar='path', type=str, nargs='+', help='FASTA files (may be gzipped).')
+    parser.add_argument('--prefix', metavar='name', type=str,
+                        help='Write <name>_upper.txt, _lower.txt, _acgt_length.txt and _acgtn_length.txt.')
+    parser.add_argument('--per-contig', metavar='path', type=str, help='Write per-contig statistics here.')
+    parser.add_argument('--processes', metavar='int', type=int, default=multiprocessing.cpu_count(),
+                        help='Count chunks in this many processes.')
+    parser.add_argument('--cache', metavar='path', type=str, default='.ref_stats_cache.json',
+                        help='Cache statistics here.')
+    parser.add_argument('--no-cache', action='store_const', const=True, default=False,
+                        help='Neither read nor write cache.')
+    go(parser.parse_args())
@@ -1,45 +1,200 @@
 #!/usr/bin/env python
 
+"""
+Filter FASTA, passing contigs at least --min-len bases long (default
+10000) to stdout and writing shorter ones to the optional short-contig
+file.  Reads stdin, or --input, which may be gzipped.
+
+A contig's sequence is only held in memory until it reaches --min-len;
+from then on it's known to pass, and its lines are written as they're
+read.  So memory is bounded by --min-len, however long the contigs are.
+
+With --fai, also writes a samtools-style .fai index of the output as it
+goes, saving a separate "samtools faidx" pass.  If the output turns out
+not to be indexable (lines of a contig differ in length), the index is
+not written.
+
+Prints a summary to stderr; with --verbose, also prints each contig's
+length and whether it passed.
+"""
+
 from __future__ import print_function
+import os
 import sys
+import gzip
+import argparse
 
-name = None
-length = 0
-max_len = 10000
-first = True
-buf = []
-short_fh = None
-if len(sys.argv) > 1:
-    short_fh = open(sys.argv[1], 'w')
-
-
-def handle_entry():
-    filt = length < max_len
-    print('length(%s) = %d, %s' % (name, length, 'TOO SHORT' if filt else 'pass'), file=sys.stderr)
-    if filt:
-        if short_fh is not None:
-            print('>' + name, file=short_fh)
-            print('\n'.join(buf), file=short_fh)
-    else:
-        print('>' + name)
-        print('\n'.join(buf))
-
-
-for ln in sys.stdin:
-    if ln[0] == '>':
-        if not first:
-            handle_entry()
-            buf = []
-        first = False
-        length = 0
-        name = ln[1:].rstrip()
+block_size = 4 * 1024 * 1024
+
+
+class FaiBuilder(object):
+    """ Accumulates .fai lines for contigs as they're written """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.lines = []
+        self.ok = True
+        self.name, self.offset = None, 0
+        self.length, self.linebases, self.last_short = 0, None, False
+
+    def start(self, name, offset):
+        self.name, self.offset = name, offset
+        self.length, self.linebases, self.last_short = 0, None, False
+
+    def add_line(self, nbases):
+        if self.linebases is None:
+            self.linebases = nbases
+        elif self.last_short or nbases > self.linebases:
+            self.ok = False  # only the last line of a contig may be shorter
+        self.last_short = nbases < self.linebases
+        self.length += nbases
+
+    def finish(self):
+        name = self.name.split()[0]
+        linebases = self.linebases or 0
+        self.lines.append(name + ('\t%d\t%d\t%d\t%d\n' % (self.length, self.offset, linebases, linebases + 1)).encode())
+
+    def write(self):
+        if not self.ok:
+            print('Output has contigs with uneven line lengths; not writing %s' % self.fn, file=sys.stderr)
+            if os.path.exists(self.fn):
+                os.remove(self.fn)
+            return
+        with open(self.fn, 'wb') as fh:
+            fh.writelines(self.lines)
+
+
+class ContigFilter(object):
+    """ Routes contigs to passing or short output, holding at most
+        min_len bases of the current contig """
+
+    def __init__(self, ofh, short_fh, min_len, fai=None, verbose=False):
+        self.ofh, self.short_fh = ofh, short_fh
+        self.min_len = min_len
+        self.fai = fai
+        self.verbose = verbose
+        self.nout = 0  # bytes written to ofh
+        self.npass, self.nshort, self.bp_pass, self.bp_short = 0, 0, 0, 0
+        self.shortest_pass, self.longest_short = None, None
+        self.name, self.length, self.buf, self.passed = None, 0, [], False
+
+    def _write(self, data):
+        self.ofh.write(data)
+        self.nout += len(data)
+
+    def _pass(self):
+        """ Current contig has reached min_len; write what's buffered """
+        self.passed = True
+        self._write(b'>' + self.name + b'\n')
+        if self.fai is not None:
+            self.fai.start(self.name, self.nout)
+            for ln in self.buf:
+                self.fai.add_line(len(ln))
+        self._write(b''.join(ln + b'\n' for ln in self.buf))
+        self.buf = []
+
+    def start(self, name):
+        self.name, self.length, self.buf, self.passed = name, 0, [], False
+
+    def add_lines(self, lines):
+        """ Add stripped sequence lines to current contig """
+        if self.name is None:
+            raise RuntimeError('Sequence before first FASTA header')
+        self.length += sum(map(len, lines))
+        if self.passed:
+            if self.fai is not None:
+                for ln in lines:
+                    self.fai.add_line(len(ln))
+            self._write(b''.join(ln + b'\n' for ln in lines))
+            return
+        self.buf.extend(lines)
+        if self.length >= self.min_len:
+            self._pass()
+
+    def finish(self):
+        """ Current contig has ended """
+        if self.name is None:
+            return
+        if not self.passed and self.length >= self.min_len:
+            self._pass()
+            self._write(b'\n')  # contig with no sequence lines
+        if self.passed:
+            if self.fai is not None:
+                self.fai.finish()
+            self.npass += 1
+            self.bp_pass += self.length
+            self.shortest_pass = self.length if self.shortest_pass is None else min(self.shortest_pass, self.length)
+        else:
+            if self.short_fh is not None:
+                self.short_fh.write(b'>' + self.name + b'\n' + b''.join(ln + b'\n' for ln in self.buf))
+                if len(self.buf) == 0:
+                    self.short_fh.write(b'\n')
+            self.nshort += 1
+            self.bp_short += self.length
+            self.longest_short = max(self.longest_short or 0, self.length)
+        if self.verbose:
+            print('length(%s) = %d, %s' % (self.name.decode(), self.length, 'pass' if self.passed else 'TOO SHORT'),
+                  file=sys.stderr)
+        self.name, self.buf = None, []
+
+    def summary(self):
+        return ['%d contigs, %d bp' % (self.npass + self.nshort, self.bp_pass + self.bp_short),
+                'passed (>= %d bp): %d contigs, %d bp, shortest %s' %
+                (self.min_len, self.npass, self.bp_pass, 'NA' if self.shortest_pass is None else str(self.shortest_pass)),
+                'too short: %d contigs, %d bp, longest %s' %
+                (self.nshort, self.bp_short, 'NA' if self.longest_short is None else str(self.longest_short))]
+
+
+def filter_fasta(ifh, filt):
+    """ Run FASTA from binary file object ifh through filt """
+    seq = []
+    while True:
+        lines = ifh.readlines(block_size)
+        if len(lines) == 0:
+            break
+        for ln in lines:
+            if ln[:1] == b'>':
+                if len(seq) > 0:
+                    filt.add_lines(seq)
+                    seq = []
+                filt.finish()
+                filt.start(ln[1:].rstrip())
+            else:
+                seq.append(ln.rstrip())
+        if len(seq) > 0:
+            filt.add_lines(seq)
+            seq = []
+    filt.finish()
+
+
+def go(args):
+    ofh = getattr(sys.stdout, 'buffer', sys.stdout)
+    short_fh = open(args.short, 'wb') if args.short is not None else None
+    fai = FaiBuilder(args.fai) if args.fai is not None else None
+    filt = ContigFilter(ofh, short_fh, args.min_len, fai=fai, verbose=args.verbose)
+    if args.input is None:
+        filter_fasta(getattr(sys.stdin, 'buffer', sys.stdin), filt)
+    elif args.input.endswith('.gz'):
+        with gzip.open(args.input, 'rb') as ifh:
+            filter_fasta(ifh, filt)
     else:
-        ln = ln.rstrip()
-        length += len(ln)
-        buf.append(ln)
+        with open(args.input, 'rb') as ifh:
+            filter_fasta(ifh, filt)
+    ofh.flush()
+    if short_fh is not None:
+        short_fh.close()
+    if fai is not None:
+        fai.write()
+    for ln in filt.summary():
+        print(ln, file=sys.stderr)
 
-if not first:
-    handle_entry()
 
-if short_fh is not None:
-    short_fh.close()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Remove contigs shorter than --min-len from FASTA')
+    parser.add_argument('short', metavar='path', type=str, nargs='?', help='Write too-short contigs here.')
+    parser.add_argument('--input', metavar='path', type=str, help='Read FASTA from here (may be .gz) not stdin.')
+    parser.add_argument('--min-len', metavar='int', type=int, default=10000, help='Remove contigs shorter than this.')
+    parser.add_argument('--fai', metavar='path', type=str, help='Write .fai index of output here.')
+    parser.add_argument('--verbose', action='store_const', const=True, default=False,
+                        help='Print length of every contig, not just a summary.')
+    go(parser.parse_args())
@@ -1,27 +1,29 @@
 #!/bin/bash
 
+# Downloads are kept so that ref_stats.py's cache, which is keyed on each
+# file's path, size and mtime, recognizes them next time; then nothing is
+# downloaded or counted again
+
+fetch() {
+    [ -f "$1" ] || (wget -O "$1.tmp" "$2" && mv "$1.tmp" "$1")
+}
+
 mkdir -p mm10
 cd mm10
-wget http://hgdownload.cse.ucsc.edu/goldenPath/mm10/bigZips/chromFa.tar.gz
-tar xvf chromFa.tar.gz
-cat *.fa | grep -av '^>' | tee >(tr -cd ACGTN | wc -c | tee ../mm10_upper.txt | xargs echo "mm10 upper") | \
-                                 tr -cd acgtn | wc -c | tee ../mm10_lower.txt | xargs echo "mm10 lower"
+fetch chromFa.tar.gz http://hgdownload.cse.ucsc.edu/goldenPath/mm10/bigZips/chromFa.tar.gz
+[ -f .extracted ] || (tar xvf chromFa.tar.gz && touch .extracted)
+python ../ref_stats.py --cache ../.ref_stats_cache.json --prefix ../mm10 *.fa
 cd ..
-rm -rf mm10
 
 mkdir -p hg19
 cd hg19
-wget http://hgdownload.cse.ucsc.edu/goldenPath/hg19/bigZips/chromFa.tar.gz
-tar xvf chromFa.tar.gz
-cat *.fa | grep -av '^>' | tee >(tr -cd ACGTN | wc -c | tee ../hg19_upper.txt | xargs echo "hg19 upper") | \
-                                 tr -cd acgtn | wc -c | tee ../hg19_lower.txt | xargs echo "hg19 lower"
+fetch chromFa.tar.gz http://hgdownload.cse.ucsc.edu/goldenPath/hg19/bigZips/chromFa.tar.gz
+[ -f .extracted ] || (tar xvf chromFa.tar.gz && touch .extracted)
+python ../ref_stats.py --cache ../.ref_stats_cache.json --prefix ../hg19 *.fa
 cd ..
-rm -rf hg19
 
 mkdir -p hg38
 cd hg38
-wget http://hgdownload.cse.ucsc.edu/goldenPath/hg38/bigZips/hg38.fa.gz
-gzip -dc hg38.fa.gz | grep -av '^>' | tee >(tr -cd ACGTN | wc -c | tee ../hg38_upper.txt | xargs echo "hg38 upper") | \
-                                            tr -cd acgtn | wc -c | tee ../hg38_lower.txt | xargs echo "hg38 lower"
+fetch hg38.fa.gz http://hgdownload.cse.ucsc.edu/goldenPath/hg38/bigZips/hg38.fa.gz
+python ../ref_stats.py --cache ../.ref_stats_cache.json --prefix ../hg38 hg38.fa.gz
 cd ..
-rm -rf hg38
@@ -12,6 +12,9 @@
 #  -na  --noALN    do not output ALN alignment file
 #  -rs  --rndSend  the seed for random number generator (default: system time in second)
 
+# Threads art_convert.py uses to compress its output
+CONVERT_THREADS ?= 4
+
 # Use art to generate unpaired Illumina-like reads.  Macro takes
 # parameters: (1) batch name, (2) reference genome, (3) read length in
 # batch, (4) target # reads, (5) fold coverage, (6) pseudo-random seed.
@@ -20,10 +23,9 @@ define art_ill_unp_reads
 # Generate unpaired reads
 r0_art_$1.fq.gz: $$(FA) $$(QTIP_EXPERIMENTS_HOME)/software/art/art_illumina
 	$$(QTIP_EXPERIMENTS_HOME)/software/art/art_illumina -sam -na -rs $6 -l $3 -f $5 -i $2 -o .$$@
-	python $(QTIP_EXPERIMENTS_HOME)/bin/art_convert.py --in1 .$$(@).fq --sam .$$(@).sam --out1 .$$(@).final.fq
+	python $(QTIP_EXPERIMENTS_HOME)/bin/art_convert.py --in1 .$$(@).fq --sam .$$(@).sam --out1 .part.$$@ --max-reads $4 --threads $$(CONVERT_THREADS)
+	mv .part.$$@ $$@
 	rm -f .$$(@).fq .$$(@).sam
-	head -n `python -c 'print(4 * $4)'` .$$(@).final.fq | gzip -c > $$@
-	rm -f .$$(@).final.fq
 	$$(QTIP_EXPERIMENTS_HOME)/software/art/art_illumina 2>&1 > $$@.version || true
 
 endef
@@ -37,11 +39,10 @@ define art_ill_pair_reads
 # Generate paired-end reads
 r1_art_$1.fq.gz: $(FA) $$(FA) $$(QTIP_EXPERIMENTS_HOME)/software/art/art_illumina
 	$$(QTIP_EXPERIMENTS_HOME)/software/art/art_illumina -sam -na -p -rs $8 -m $6 -s $7 -l $3 -f $5 -i $2 -o .$$@
-	python $(QTIP_EXPERIMENTS_HOME)/bin/art_convert.py --in1 .$$(@)1.fq --in2 .$$(@)2.fq --sam .$$(@).sam --out1 .$$(@).final1.fq --out2 .$$(@).final2.fq
+	python $(QTIP_EXPERIMENTS_HOME)/bin/art_convert.py --in1 .$$(@)1.fq --in2 .$$(@)2.fq --sam .$$(@).sam --out1 .part.$$@ --out2 .part.$$(@:r1_%=r2_%) --max-reads $4 --threads $$(CONVERT_THREADS)
+	mv .part.$$(@:r1_%=r2_%) $$(@:r1_%=r2_%)
+	mv .part.$$@ $$@
 	rm -f .$$(@)1.fq .$$(@)2.fq .$$(@).sam
-	head -n `python -c 'print(4 * $4)'` .$$(@).final1.fq | gzip -c > $$@
-	head -n `python -c 'print(4 * $4)'` .$$(@).final2.fq | gzip -c > $$(@:r1_%=r2_%)
-	rm -f .$$(@).final1.fq .$$(@).final2.fq
 	$$(QTIP_EXPERIMENTS_HOME)/software/art/art_illumina 2>&1 > $$@.version || true
 
 endef
@@ -0,0 +1,200 @@
+"""
+executor.py
+
+Runs Makefile targets on the local machine instead of submitting them to
+SLURM, for sweeps small enough for one big box.  Takes targets through
+the same add() interface as slurm.ArrayBatcher, with the cores and
+memory write_slurm would have requested, and runs as many at once as fit
+in a CPU and memory budget.
+
+Jobs are started in priority order (by default, longest expected running
+time first, so big jobs don't end up trailing at the end), with smaller
+jobs backfilling when the next one doesn't fit.  Failed jobs are retried
+up to a given number of times.  A job's output goes to .<target>.sh.o/.e
+in its directory, as with SLURM, so resource_model.py can learn from
+local runs too.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import heapq
+import subprocess
+import multiprocessing
+from os.path import join
+
+
+def physical_mem_gb():
+    """ Return total physical memory in GB """
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1024.0 ** 3)
+
+
+class Job(object):
+    """ A command to run in a directory, with its resource needs """
+
+    def __init__(self, name, dirname, cmd, cores, mem_gb, hours, priority):
+        self.name = name
+        self.dirname = dirname
+        self.cmd = cmd
+        self.cores = cores
+        self.mem_gb = mem_gb
+        self.hours = hours
+        self.priority = priority
+        self.attempts = 0
+        self.proc = None
+        self.start = None
+
+
+class LocalExecutor(object):
+    """ Runs jobs under a budget of cores and GB of memory """
+
+    def __init__(self, cores=None, mem_gb=None, retries=1, poll_secs=1.0, ofh=sys.stderr):
+        self.cores = cores or multiprocessing.cpu_count()
+        self.mem_gb = mem_gb or physical_mem_gb()
+        self.retries = retries
+        self.poll_secs = poll_secs
+        self.ofh = ofh
+        self.queue = []
+        self.seq = 0
+        self.running = []
+        self.ndone, self.nfailed = 0, 0
+        self.failed = []
+        self._last_report = 0
+
+    def add(self, dirname, rule, mem_gb, hours, ncores, makefile='Makefile', cmd=None, priority=None):
+        """ Queue "make -f makefile rule/DONE", or cmd if given, to run in
+            dirname.  Lower priority values run first; default is longest
+            expected running time first. """
+        if cmd is None:
+            cmd = ['make', '-f', makefile, rule + '/DONE']
+        if priority is None:
+            priority = -hours
+        self._push(Job(rule, dirname, cmd, ncores, mem_gb, hours, priority))
+
+    def _push(self, job):
+        heapq.heappush(self.queue, (job.priority, self.seq, job))
+        self.seq += 1
+
+    def __len__(self):
+        return len(self.queue) + len(self.running)
+
+    def _used(self):
+        return sum(j.cores for j in self.running), sum(j.mem_gb for j in self.running)
+
+    def _fits(self, job):
+        if len(self.running) == 0:
+            return True  # always let a job run, even if it's bigger than the whole budget
+        cores, mem_gb = self._used()
+        return cores + job.cores <= self.cores and mem_gb + job.mem_gb <= self.mem_gb
+
+    def _start_fitting(self):
+        """ Start queued jobs that fit, in priority order """
+        deferred = []
+        while len(self.queue) > 0:
+            item = heapq.heappop(self.queue)
+            job = item[2]
+            if self._fits(job):
+                self._start(job)
+            else:
+                deferred.append(item)
+        for item in deferred:
+            heapq.heappush(self.queue, item)
+
+    def _start(self, job):
+        job.attempts += 1
+        base = join(job.dirname, '.' + job.name + '.sh')
+        mode = 'w' if job.attempts == 1 else 'a'
+        with open(base + '.o', mode) as out_fh:
+            with open(base + '.e', mode) as err_fh:
+                job.proc = subprocess.Popen(job.cmd, cwd=job.dirname, stdout=out_fh, stderr=err_fh)
+        job.start = time.time()
+        self.running.append(job)
+        self._log('started %s/%s (%d cores, %dG, attempt %d)' % (job.dirname, job.name, job.cores,
+                                                                 job.mem_gb, job.attempts))
+
+    def _reap(self):
+        """ Check running jobs; requeue or record ones that finished """
+        still = []
+        for job in self.running:
+            ret = job.proc.poll()
+            if ret is None:
+                still.append(job)
+                continue
+            elapsed = time.time() - job.start
+            if ret == 0:
+                self.ndone += 1
+                self._log('finished %s/%s in %0.0fs' % (job.dirname, job.name, elapsed))
+            elif job.attempts <= self.retries:
+                self._log('%s/%s failed with status %d; retrying' % (job.dirname, job.name, ret))
+                self._push(job)
+            else:
+                self.nfailed += 1
+                self.failed.append(job)
+                self._log('%s/%s failed with status %d; giving up' % (job.dirname, job.name, ret))
+        self.running = still
+
+    def _log(self, msg):
+        if self.ofh.isatty():
+            self.ofh.write('\r\033[K')
+        self.ofh.write('[local] %s\n' % msg)
+        self._progress()
+
+    def _progress(self):
+        """ Update live status line if on a terminal, otherwise print
+            status once a minute """
+        cores, mem_gb = self._used()
+        msg = '[local] running %d (%d/%d cores, %0.0f/%0.0fG), queued %d, done %d, failed %d' % \
+              (len(self.running), cores, self.cores, mem_gb, self.mem_gb, len(self.queue), self.ndone, self.nfailed)
+        if self.ofh.isatty():
+            self.ofh.write('\r\033[K' + msg)
+        elif time.time() - self._last_report > 60:
+            self.ofh.write(msg + '\n')
+            self._last_report = time.time()
+        self.ofh.flush()
+
+    def run(self):
+        """ Run all queued jobs; return number that failed for good """
+        try:
+            while len(self.queue) > 0 or len(self.running) > 0:
+                self._reap()
+                self._start_fitting()
+                self._progress()
+                time.sleep(self.poll_secs)
+        except KeyboardInterrupt:
+            for job in self.running:
+                job.proc.terminate()
+            raise
+        self._log('all jobs finished; %d succeeded, %d failed' % (self.ndone, self.nfailed))
+        if self.ofh.isatty():
+            self.ofh.write('\n')
+        return self.nfailed
+
+    def submit(self, dry_run=True):
+        """ Print jobs in priority order and, unless dry_run, run them """
+        for _, _, job in sorted(self.queue):
+            print('cd %s && %s' % (job.dirname, ' '.join(job.cmd)))
+        if not dry_run:
+            return self.run()
+        return 0
+
+
+def add_args(parser):
+    """ Add options for the local executor to an argparse parser """
+    parser.add_argument('--local', action='store_const', const=True, default=False,
+                        help='Run jobs on this machine rather than submitting to SLURM')
+    parser.add_argument('--local-cores', metavar='int', type=int,
+                        help='Cores to use with --local (default: all)')
+    parser.add_argument('--local-mem-gb', metavar='int', type=int,
+                        help='GB of memory to use with --local (default: all physical memory)')
+    parser.add_argument('--retries', metavar='int', type=int, default=1,
+                        help='Times to retry a failed job with --local')
+
+
+def from_argv(argv):
+    """ Make a LocalExecutor from --local-cores, --local-mem-gb and
+        --retries in an argv list, for scripts that don't use argparse """
+    def _opt(name, default):
+        return int(argv[argv.index(name)+1]) if name in argv else default
+    return LocalExecutor(cores=_opt('--local-cores', None), mem_gb=_opt('--local-mem-gb', None),
+                         retries=_opt('--retries', 1))
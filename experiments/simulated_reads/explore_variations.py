@@ -6,7 +6,11 @@ import os
 import sys
 import logging
 import shutil
-from marcc_out import write_slurm
+from marcc_out import write_slurm, slurm_resources
+from resource_model import ResourceModel
+from slurm import ArrayBatcher
+import executor
+from input_store import InputStore
 
 join = os.path.join
 
@@ -23,11 +27,15 @@ def mkdir_quiet(dr):
 
 
 def handle_dir(dr, start_from, global_name, base_args, exp_names, exp_qtip_args, exp_aligner_args, targets, submit_fh,
-               use_scavenger=False, wet=False, base_mem_gb=6, base_hours=3):
+               use_scavenger=False, wet=False, base_mem_gb=6, base_hours=3, model=None, batcher=None,
+               sbatch='sbatch', link_mode='auto'):
     """
     Maybe this just creates a whole series of new Makefiles with only the SUBSAMPLING_ARGS line different?
     Then maybe the
     """
+    store = None
+    if start_from == 'inputalign' and link_mode != 'copy':
+        store = InputStore(join(dr, '.input_store'), mode=None if link_mode == 'auto' else link_mode)
     for name, ar, al_ar in zip(exp_names, exp_qtip_args, exp_aligner_args):
         nm = '.'.join([global_name, name])
         new_makefile_base = '.'.join(['Makefile', global_name, name])
@@ -60,15 +68,27 @@ def handle_dir(dr, start_from, global_name, base_args, exp_names, exp_qtip_args,
                 mkdir_quiet(dest_dir)
                 assert os.path.exists(src_dir)
                 assert os.path.exists(join(src_dir, 'input.sam'))
-                logging.info('      Copying %s to new target dir' % (join(src_dir, 'input.sam')))
-                shutil.copy(join(src_dir, 'input.sam'), dest_dir)
+                if store is not None:
+                    used = store.link(join(src_dir, 'input.sam'), join(dest_dir, 'input.sam'))
+                    logging.info('      Linked %s into new target dir (%s)' % (join(src_dir, 'input.sam'), used))
+                else:
+                    logging.info('      Copying %s to new target dir' % (join(src_dir, 'input.sam')))
+                    if os.path.lexists(join(dest_dir, 'input.sam')):
+                        # don't write through a link into a stored input
+                        os.remove(join(dest_dir, 'input.sam'))
+                    shutil.copy(join(src_dir, 'input.sam'), dest_dir)
                 assert os.path.exists(join(dest_dir, 'input.sam'))
+            if batcher is not None:
+                my_mem_gb, my_hours = slurm_resources(rule, dr, base_mem_gb, base_hours,
+                                                      makefile=new_makefile_base, model=model)
+                batcher.add(dr, rule, my_mem_gb, my_hours, 1, makefile=new_makefile_base)
+                continue
             fn = '.' + rule + '.sh'
             write_slurm(rule, fn, dr, base_mem_gb, base_hours,
                         makefile=new_makefile_base,
                         use_scavenger=use_scavenger,
-                        ncores=1)
-            cmd = 'pushd %s && sbatch %s && popd' % (dr, fn)
+                        ncores=1, model=model)
+            cmd = 'pushd %s && %s %s && popd' % (dr, sbatch, fn)
             submit_fh.write(cmd + '\n')
             if wet:
                 os.system(cmd)
@@ -90,6 +110,16 @@ def go(args, global_qtip_args, exp_names, exp_qtip_args, exp_aligner_args, targe
 
     logging.info('Target dirs: ' + str(list(target_dirs)))
 
+    model = None
+    if args.resource_model is not None:
+        model = ResourceModel.load(args.resource_model)
+
+    batcher = None
+    if args.local:
+        batcher = executor.LocalExecutor(cores=args.local_cores, mem_gb=args.local_mem_gb, retries=args.retries)
+    elif args.array:
+        batcher = ArrayBatcher(args.name, use_scavenger=args.use_scavenger, sbatch=args.sbatch)
+
     with open(args.name + '_submit.sh', 'w') as submit_fh:
         # Descend into subdirectories looking for Makefiles
         for dirname, dirs, files in os.walk('.'):
@@ -100,7 +130,14 @@ def go(args, global_qtip_args, exp_names, exp_qtip_args, exp_aligner_args, targe
                 handle_dir(dirname, args.start_from, args.name, global_qtip_args, exp_names,
                            exp_qtip_args, exp_aligner_args, targets, submit_fh,
                            use_scavenger=args.use_scavenger, wet=args.wet,
-                           base_mem_gb=args.base_mem_gb, base_hours=args.base_hours)
+                           base_mem_gb=args.base_mem_gb, base_hours=args.base_hours, model=model,
+                           batcher=batcher, sbatch=args.sbatch, link_mode=args.link_mode)
+        if isinstance(batcher, ArrayBatcher):
+            batcher.write()
+            for cmd in batcher.submit_commands():
+                submit_fh.write(cmd + '\n')
+        if batcher is not None:
+            batcher.submit(dry_run=not args.wet)
 
 
 def add_args(parser):
@@ -116,6 +153,16 @@ def add_args(parser):
                         help='Set base number of gigabytes to ask slurm for')
     parser.add_argument('--base-hours', metavar='int', type=int, default=4,
                         help='Set base number of hours to ask slurm for')
+    parser.add_argument('--resource-model', metavar='path', type=str,
+                        help='Size jobs using model fit by resource_model.py, instead of base mem/hours')
+    parser.add_argument('--array', action='store_const', const=True, default=False,
+                        help='Submit targets as SLURM job arrays, one per distinct resource request')
+    parser.add_argument('--sbatch', metavar='cmd', type=str, default='sbatch',
+                        help='Command for submitting jobs, e.g. "python mock_sbatch.py" to test offline')
+    parser.add_argument('--link-mode', metavar='str', type=str, default='auto',
+                        help='How to give variants the original input.sam with --start-from inputalign: '
+                             '"reflink", "hardlink", "symlink", "copy", or "auto" (first of these that works)')
+    executor.add_args(parser)
 
 
 def parse_qtip_parameters_from_argv(argv):
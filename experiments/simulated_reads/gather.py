@@ -17,19 +17,57 @@ Outputs:
          - Subdirectories for training/test, each with:
            + roc.csv -- ROC table
            + summary.csv -- summarizes data, model fit
+
+With --incremental, rows parsed from each target directory are cached
+in .gather_cache.json (or .gather_cache.<experiment>.json), keyed on the
+mtime of the target's DONE file and the names and sizes of all the
+files under it that could be parsed, so new trials and feature files
+are noticed.  Targets whose key hasn't changed are not re-parsed, and
+targets no longer found are dropped from the cache.
+
+With --jobs N, target directories are parsed by a pool of N threads,
+which helps hide metadata latency on network filesystems.  Rows are
+still written in the order targets are found.
+
+With --columnar FMT (FMT = csv, parquet or feather), the summary
+directory also gets three tables that don't pack ROCs and feature
+importances into long strings:
+  + overall.summary.FMT -- one row per trial, scalar columns only
+  + overall.roc.FMT -- one row per ROC row
+  + overall.feat.FMT -- one row per feature importance
+Keyed by combined_name, variant, mapq_included, trial_no and training.
+parquet and feather need pandas (and pyarrow); without it we fall
+back to csv.
+
+--archive controls how outputs are compressed:
+  + tgz (default) -- outputs are written uncompressed, then the summary
+                     directory is tarred into summary.tar.gz in a second
+                     pass (a tar member needs its size up front, so rows
+                     can't be streamed into it)
+  + gz -- each output file is gzipped as it's written, so the summary
+          directory never holds uncompressed data; no tarball.  Readers
+          of summary/overall.csv, like ../qtip_paper.Rmd, must then read
+          overall.csv.gz instead
+  + none -- no compression
+With --compress-threads N > 1, compression is done by pigz if it's on
+the PATH, otherwise by the gzip module.
 """
 
 from __future__ import print_function
 import sys
 import os
 import re
+import json
+import gzip
+import tarfile
 import logging
+import subprocess
 from os.path import join
-
-# We identify the experiments by fishing through the Makefiles for output
-# targets.  When this regex matches a line of a Makefile, we know the
-# following lines are giving us the names of targets.
-target_re = re.compile('^outs_[_a-zA-Z01-9]*:.*')
+from target_index import TargetIndex
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
 
 
 def parse_aligner_local(target):
@@ -141,11 +179,16 @@ def feat_files_to_string(fns):
     return ';'.join(ret)
 
 
-def compile_line(ofh, combined_target_name, variant, mapq_incl, tt, trial,
-                 params_fn, summ_fn, roc_round_fn, roc_orig_fn, feat_fns,
-                 first):
-    """ Put together one line of output and write to ofh (overall.csv)
-        """
+def write_row(ofh, headers, values, first):
+    """ Write one line of overall.csv, preceded by header if first """
+    if first:
+        ofh.write(','.join(map(str, headers)) + '\n')
+    ofh.write(','.join(map(str, values)) + '\n')
+
+
+def compile_row(combined_target_name, variant, mapq_incl, tt, trial,
+                params_fn, summ_fn, roc_round_fn, roc_orig_fn, feat_fns):
+    """ Put together headers and values for one line of output """
     name, target = parse_name_and_target(combined_target_name)
     aligner, local = parse_aligner_local(target)
     paired = parse_paired(target)
@@ -174,9 +217,113 @@ def compile_line(ofh, combined_target_name, variant, mapq_incl, tt, trial,
     headers.append('feat')
     values.append(feat_files_to_string(feat_fns))
 
-    if first:
-        ofh.write(','.join(map(str, headers)) + '\n')
-    ofh.write(','.join(map(str, values)) + '\n')
+    return headers, values
+
+
+class CompressedOutput(object):
+    """ Writable file that gzip-compresses to fn, using pigz with the
+        given number of threads if possible, otherwise the gzip module.
+        Accepts either str or bytes. """
+
+    def __init__(self, fn, threads=1):
+        self.proc, self.ofh = None, None
+        if threads > 1 and which('pigz') is not None:
+            self.ofh = open(fn, 'wb')
+            self.proc = subprocess.Popen(['pigz', '-p', str(threads), '-c'],
+                                         stdin=subprocess.PIPE, stdout=self.ofh)
+            self.fh = self.proc.stdin
+        else:
+            self.fh = gzip.GzipFile(fn, 'wb', compresslevel=6)
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode()
+        self.fh.write(data)
+
+    def close(self):
+        self.fh.close()
+        if self.proc is not None:
+            if self.proc.wait() != 0:
+                raise RuntimeError('pigz exited with status %d' % self.proc.returncode)
+            self.ofh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_output(fn, compress=False, threads=1):
+    """ Open output file for writing; if compress, write fn.gz instead """
+    if compress:
+        return CompressedOutput(fn + '.gz', threads=threads)
+    return open(fn, 'w')
+
+
+def archive_dir(dirname, threads=1):
+    """ Tar and gzip directory into dirname.tar.gz, streaming the tar
+        through the compressor """
+    with CompressedOutput(dirname + '.tar.gz', threads=threads) as ofh:
+        tar = tarfile.open(fileobj=ofh, mode='w|')
+        for root, _, files in os.walk(dirname):
+            for fn in sorted(files):
+                logging.info('Archiving %s' % join(root, fn))
+                tar.add(join(root, fn))
+        tar.close()
+
+
+class ColumnarWriter(object):
+    """ Writes rows of overall.csv as a scalar summary table plus
+        long-format ROC and feature-importance tables.  Tables are
+        streamed to csv; close() converts them to parquet or feather. """
+
+    key_cols = ['combined_name', 'variant', 'mapq_included', 'trial_no', 'training']
+    string_cols = ['roc_round', 'roc_orig', 'feat']
+
+    def __init__(self, prefix, fmt='csv', compress=False, threads=1):
+        self.prefix = prefix
+        self.fmt = fmt
+        self.fns = dict((tab, '%s.%s.csv' % (prefix, tab)) for tab in ['summary', 'roc', 'feat'])
+        self.fhs = dict((tab, open_output(fn, compress=compress and fmt == 'csv', threads=threads))
+                        for tab, fn in self.fns.items())
+        self.first = True
+
+    def add(self, headers, values):
+        row = dict(zip(headers, values))
+        keys = [row[k] for k in self.key_cols]
+        if self.first:
+            self.fhs['summary'].write(','.join(h for h in headers if h not in self.string_cols) + '\n')
+            self.fhs['roc'].write(','.join(self.key_cols + ['roc', 'mapq', 'cor', 'incor']) + '\n')
+            self.fhs['feat'].write(','.join(self.key_cols + ['model', 'feature', 'importance']) + '\n')
+            self.first = False
+        self.fhs['summary'].write(','.join(v for h, v in zip(headers, values) if h not in self.string_cols) + '\n')
+        for roc in ['round', 'orig']:
+            for fields in row['roc_' + roc].split(';'):
+                if len(fields) > 0:
+                    self.fhs['roc'].write(','.join(keys + [roc] + fields.split(':')) + '\n')
+        for fields in row['feat'].split(';'):
+            if len(fields) > 0:
+                self.fhs['feat'].write(','.join(keys + fields.split(':')) + '\n')
+
+    def close(self):
+        for fh in self.fhs.values():
+            fh.close()
+        if self.fmt == 'csv':
+            return
+        try:
+            import pandas
+        except ImportError:
+            logging.warning('pandas not available; leaving columnar tables as csv')
+            return
+        for tab, fn in self.fns.items():
+            df = pandas.read_csv(fn)
+            out_fn = '%s.%s.%s' % (self.prefix, tab, self.fmt)
+            if self.fmt == 'parquet':
+                df.to_parquet(out_fn)
+            else:
+                df.to_feather(out_fn)
+            os.remove(fn)
 
 
 def get_immediate_subdirectories(a_dir):
@@ -185,31 +332,20 @@ def get_immediate_subdirectories(a_dir):
             if os.path.isdir(os.path.join(a_dir, name))]
 
 
-def targets_from_makefile(dirname, fn):
-    name = os.path.basename(dirname)
-    if os.path.exists(join(name, 'IGNORE')):
-        return
-    with open(join(dirname, fn)) as fh:
-        in_target = False
-        for ln in fh:
-            if target_re.match(ln):
-                in_target = True
-            elif in_target:
-                if len(ln.rstrip()) == 0:
-                    in_target = False
-                else:
-                    # Parsing a target from the list of targets in the Makefile
-                    target = ln.split()[0]
-                    if target.endswith('/DONE'):
-                        target = target[:-5]
-                    target_full = join(dirname, target)
-                    if has_done(target_full):
-                        yield target, target_full
-                    else:
-                        print("%s does not have DONE file" % target_full, file=sys.stderr)
-
-
-def handle_dir(dirname, combined_target_name, variant, dest_dirname, ofh, first):
+def targets_from_makefile(dirname, fn, index=None):
+    if index is None:
+        index = TargetIndex()
+    for targ in index.targets(dirname, 'outs', makefile=fn):
+        if targ.done:
+            yield targ.name, targ.path
+        else:
+            print("%s does not have DONE file" % targ.path, file=sys.stderr)
+
+
+def dir_rows(dirname, combined_target_name, variant):
+    """ Parse all trials under a target directory.  Returns list of
+        (headers, values) rows. """
+    rows = []
 
     for dir_samp in get_immediate_subdirectories(dirname):
 
@@ -265,11 +401,110 @@ def handle_dir(dirname, combined_target_name, variant, dest_dirname, ofh, first)
                     roc_round_fn = join(target_full_smtt, 'roc_round.csv')
                     roc_orig_fn = join(target_full_smtt, 'roc_orig.csv')
 
-                    compile_line(ofh, combined_target_name, variant,
-                                 mapq_included, tt, trial, params_fn,
-                                 summ_fn, roc_round_fn, roc_orig_fn,
-                                 feat_fns, first)
-                    first = False
+                    rows.append(compile_row(combined_target_name, variant,
+                                            mapq_included, tt, trial, params_fn,
+                                            summ_fn, roc_round_fn, roc_orig_fn,
+                                            feat_fns))
+
+    return rows
+
+
+_input_re = re.compile('^(params|summary|roc_round|roc_orig|featimport_[bcdu])\.csv$')
+
+
+def list_inputs(dirname):
+    """ Return sorted list of files under target directory that dir_rows
+        might parse """
+    fns = []
+    for root, _, files in os.walk(dirname):
+        fns.extend(join(root, fn) for fn in files if _input_re.match(fn))
+    return sorted(fns)
+
+
+def cache_key(dirname):
+    """ Key for cached rows: mtime of DONE plus names and sizes of the
+        files that might be parsed """
+    done_fn = join(dirname, 'DONE')
+    done_mtime = os.stat(done_fn).st_mtime if os.path.exists(done_fn) else None
+    return {'done_mtime': done_mtime,
+            'sizes': dict((fn, os.path.getsize(fn)) for fn in list_inputs(dirname))}
+
+
+def cached_rows(cache, dirname):
+    """ Return cached rows for target directory if still valid, else None """
+    ent = cache.get(dirname)
+    if ent is None or cache_key(dirname) != ent['key']:
+        return None
+    return ent['rows']
+
+
+def load_cache(cache_fn):
+    if not os.path.exists(cache_fn):
+        return {}
+    with open(cache_fn) as fh:
+        return json.load(fh)
+
+
+def save_cache(cache_fn, cache):
+    with open(cache_fn + '.tmp', 'w') as fh:
+        json.dump(cache, fh)
+    os.rename(cache_fn + '.tmp', cache_fn)
+
+
+def _parse_target(job):
+    """ Return (cache key or None, rows) for a target; the key is taken
+        before parsing, so files changing meanwhile get parsed next time """
+    target, want_key = job
+    key = cache_key(target[0]) if want_key else None
+    return key, dir_rows(*target)
+
+
+def target_rows(targets, cache=None, jobs=1):
+    """ Given list of (dirname, combined_target_name, variant) targets,
+        yield list of rows for each, in order.  Rows come from cache
+        where possible; the rest are parsed by a pool of jobs threads. """
+    rows = [None] * len(targets)
+    if cache is not None:
+        listed = set(target[0] for target in targets)
+        for dirname in [dirname for dirname in cache if dirname not in listed]:
+            logging.info('    Dropping cached rows for %s' % dirname)
+            del cache[dirname]
+        for i, target in enumerate(targets):
+            rows[i] = cached_rows(cache, target[0])
+            if rows[i] is not None:
+                logging.info('    Using cached rows for %s' % target[0])
+    todo = [(target, cache is not None) for target, rw in zip(targets, rows) if rw is None]
+    pool = None
+    if jobs > 1 and len(todo) > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(jobs)
+        parsed = pool.imap(_parse_target, todo)
+    else:
+        parsed = iter(map(_parse_target, todo))
+    try:
+        for target, rw in zip(targets, rows):
+            if rw is None:
+                key, rw = next(parsed)
+                if cache is not None:
+                    cache[target[0]] = {'key': key, 'rows': rw}
+            yield rw
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def handle_dirs(targets, ofh, first, cache=None, jobs=1, columnar=None):
+    """ Write overall.csv rows for all trials under the given target
+        directories, and to columnar writer if given.  Returns updated
+        first flag. """
+    for rows in target_rows(targets, cache=cache, jobs=jobs):
+        for headers, values in rows:
+            write_row(ofh, headers, values, first)
+            if columnar is not None:
+                columnar.add(headers, values)
+            first = False
+    return first
 
 
 def go():
@@ -285,46 +520,81 @@ def go():
     summary_fn = 'summary'
     exp_name = None
 
+    cache_fn = '.gather_cache.json'
+    incremental = '--incremental' in sys.argv
+    archive = 'tgz'
+    if '--archive' in sys.argv:
+        archive = sys.argv[sys.argv.index('--archive')+1]
+        if archive not in ['tgz', 'gz', 'none']:
+            raise RuntimeError('Bad --archive mode "%s"; must be tgz, gz or none' % archive)
+    compress_threads = 1
+    if '--compress-threads' in sys.argv:
+        compress_threads = int(sys.argv[sys.argv.index('--compress-threads')+1])
+    jobs = 1
+    if '--jobs' in sys.argv:
+        jobs = int(sys.argv[sys.argv.index('--jobs')+1])
+    columnar_fmt = None
+    if '--columnar' in sys.argv:
+        columnar_fmt = sys.argv[sys.argv.index('--columnar')+1]
+        if columnar_fmt not in ['csv', 'parquet', 'feather']:
+            raise RuntimeError('Bad --columnar format "%s"; must be csv, parquet or feather' % columnar_fmt)
+
     if '--experiment' in sys.argv:
         exp_name = sys.argv[sys.argv.index('--experiment')+1]
         makefile_fn = 'Makefile.' + exp_name
         out_fn = 'overall.' + exp_name + '.csv'
         summary_fn = 'summary_%s' % exp_name
+        cache_fn = '.gather_cache.%s.json' % exp_name
 
     # Set up output directory
-    if os.path.exists(summary_fn):
+    if os.path.exists(summary_fn) and not incremental:
         raise RuntimeError('%s directory exists' % summary_fn)
     mkdir_quiet(summary_fn)
 
-    with open(join(summary_fn, out_fn), 'w') as fh:
-        if '--experiment' in sys.argv:
-            # Descend into subdirectories looking for Makefiles
-            for dirname, dirs, files in os.walk('.'):
-                for dr in dirs:
-                    ma = re.match('^.*\.%s\.([^.]*)\.out$' % exp_name, dr)
-                    if ma is not None:
-                        variant = ma.group(1)
-                        target_dir = join(dirname, dr)
-                        combined_target_name = os.path.basename(dirname) + '_' + dr[:dr.index('.')]
-                        logging.info('Found target dir: %s (variant=%s)' % (target_dir, variant))
-                        handle_dir(target_dir, combined_target_name, variant, summary_fn, fh, first)
-                        first = False
+    cache = load_cache(cache_fn) if incremental else None
 
-        else:
-            # Descend into subdirectories looking for Makefiles
-            for dirname, dirs, files in os.walk('.'):
-                name = os.path.basename(dirname)
-                for fn in files:
-                    if fn == makefile_fn:
-                        logging.info('Found a Makefile: %s' % join(dirname, fn))
-                        for target, target_full in targets_from_makefile(dirname, makefile_fn):
-                            combined_target_name = name + '_' + target[:-4]
-                            logging.info('  Found target dir: %s (normal)' % join(dirname, target))
-                            handle_dir(join(dirname, target), combined_target_name, 'normal', summary_fn, fh, first)
-                            first = False
+    targets = []
+    if '--experiment' in sys.argv:
+        # Descend into subdirectories looking for Makefiles
+        for dirname, dirs, files in os.walk('.'):
+            for dr in dirs:
+                ma = re.match('^.*\.%s\.([^.]*)\.out$' % exp_name, dr)
+                if ma is not None:
+                    variant = ma.group(1)
+                    target_dir = join(dirname, dr)
+                    combined_target_name = os.path.basename(dirname) + '_' + dr[:dr.index('.')]
+                    logging.info('Found target dir: %s (variant=%s)' % (target_dir, variant))
+                    targets.append((target_dir, combined_target_name, variant))
+
+    else:
+        # Find Makefiles and their targets
+        index = TargetIndex()
+        for dirname in index.makefile_dirs(makefile_fn):
+            name = os.path.basename(dirname)
+            logging.info('Found a Makefile: %s' % join(dirname, makefile_fn))
+            for target, target_full in targets_from_makefile(dirname, makefile_fn, index=index):
+                combined_target_name = name + '_' + target[:-4]
+                logging.info('  Found target dir: %s (normal)' % join(dirname, target))
+                targets.append((join(dirname, target), combined_target_name, 'normal'))
+        index.save()
+
+    columnar = None
+    if columnar_fmt is not None:
+        columnar = ColumnarWriter(join(summary_fn, out_fn[:-4]), fmt=columnar_fmt,
+                                  compress=archive == 'gz', threads=compress_threads)
+
+    with open_output(join(summary_fn, out_fn), compress=archive == 'gz', threads=compress_threads) as fh:
+        first = handle_dirs(targets, fh, first, cache=cache, jobs=jobs, columnar=columnar)
+
+    if columnar is not None:
+        columnar.close()
+
+    if cache is not None:
+        save_cache(cache_fn, cache)
 
     # Compress the output directory, which is large because of the CID and CSE curves
-    os.system('tar -cvzf %s.tar.gz %s' % (summary_fn, summary_fn))
+    if archive == 'tgz':
+        archive_dir(summary_fn, threads=compress_threads)
 
 if '--slurm' in sys.argv:
     script_fn = '.gather.sh'
@@ -333,6 +603,15 @@ if '--slurm' in sys.argv:
         exp_name = sys.argv[sys.argv.index('--experiment')+1]
         script_fn = '.gather_%s.sh' % exp_name
         gather_args = '--experiment ' + exp_name
+    if '--incremental' in sys.argv:
+        gather_args += ' --incremental'
+    if '--jobs' in sys.argv:
+        gather_args += ' --jobs ' + sys.argv[sys.argv.index('--jobs')+1]
+    for opt in ['--archive', '--compress-threads']:
+        if opt in sys.argv:
+            gather_args += ' %s %s' % (opt, sys.argv[sys.argv.index(opt)+1])
+    if '--columnar' in sys.argv:
+        gather_args += ' --columnar ' + sys.argv[sys.argv.index('--columnar')+1]
     my_hours = 4
     with open(script_fn, 'w') as ofh:
         print("#!/bin/bash -l", file=ofh)
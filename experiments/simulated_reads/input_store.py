@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+"""
+input_store.py
+
+Content-addressed store for input alignments (input.sam), so that
+explore_variations.py --start-from inputalign can give every variant's
+target directory the same input without copying it.  Each distinct
+input is stored once, under its SHA-1, and linked into target
+directories by (in order of preference) reflink, hardlink or symlink.
+Store objects are themselves reflinks or copies of the source, never
+hardlinks, so regenerating the source in place can't change them, and
+they are made read-only.  Reflinks are copy-on-write, so nothing a job
+does to its input.sam can affect the others; hardlinks and symlinks
+share the read-only object, so they rely on jobs only reading it.
+
+Digests are cached by (path, size, mtime, inode), so an input is only
+read once however many variants link to it.  The store records which
+paths link to each object, and how; gc() drops links that have since been removed
+or replaced and deletes objects nothing links to anymore.  The index is
+locked while being updated, so concurrent runs can share a store.
+
+python input_store.py gc [store dir]
+
+remove store objects that are no longer linked anywhere
+"""
+
+import os
+import sys
+import json
+import stat
+import errno
+import fcntl
+import shutil
+import hashlib
+import subprocess
+from os.path import join
+
+link_modes = ['reflink', 'hardlink', 'symlink', 'copy']
+
+
+def file_digest(fn, bufsz=8 * 1024 * 1024):
+    h = hashlib.sha1()
+    with open(fn, 'rb') as fh:
+        while True:
+            buf = fh.read(bufsz)
+            if len(buf) == 0:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+
+def _stat_key(fn):
+    st = os.stat(fn)
+    return '%s:%d:%r:%d' % (os.path.abspath(fn), st.st_size, st.st_mtime, st.st_ino)
+
+
+def _reflink(src, dst):
+    with open(os.devnull, 'w') as devnull:
+        if subprocess.call(['cp', '--reflink=always', src, dst], stderr=devnull) != 0:
+            if os.path.lexists(dst):
+                os.remove(dst)  # cp leaves an empty file behind
+            raise OSError(errno.EOPNOTSUPP, 'reflink not supported')
+
+
+def _place(src, dst, mode):
+    """ Make dst refer to src using given link mode """
+    if mode == 'reflink':
+        _reflink(src, dst)
+    elif mode == 'hardlink':
+        os.link(src, dst)
+    elif mode == 'symlink':
+        os.symlink(os.path.abspath(src), dst)
+    else:
+        shutil.copyfile(src, dst)
+
+
+def _refers_to(path, obj, mode):
+    """ Return true iff path is still a link to store object obj made
+        with the given mode """
+    if not os.path.lexists(path) or not os.path.exists(obj):
+        return False
+    if mode == 'symlink':
+        return os.path.islink(path) and os.path.realpath(path) == os.path.realpath(obj)
+    if os.path.islink(path):
+        return False
+    st, st_obj = os.stat(path), os.stat(obj)
+    if mode == 'hardlink':
+        return st.st_ino == st_obj.st_ino
+    # can't cheaply tell a reflink from a same-sized copy; err on keeping it
+    return st.st_ino != st_obj.st_ino and st.st_size == st_obj.st_size
+
+
+class InputStore(object):
+    """ A directory of content-addressed files plus an index of digests
+        and references """
+
+    def __init__(self, root='.input_store', mode=None):
+        self.root = root
+        self.modes = link_modes if mode is None else [mode]
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self.index_fn = join(root, 'index.json')
+        self.lock_fn = join(root, 'index.lock')
+
+    def _locked(self, fn):
+        """ Run fn(index) with index loaded and locked; save afterwards """
+        with open(self.lock_fn, 'w') as lock_fh:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            index = {'digests': {}, 'refs': {}}
+            if os.path.exists(self.index_fn):
+                with open(self.index_fn) as fh:
+                    index = json.load(fh)
+            ret = fn(index)
+            with open(self.index_fn + '.tmp', 'w') as fh:
+                json.dump(index, fh, indent=1)
+            os.rename(self.index_fn + '.tmp', self.index_fn)
+            return ret
+
+    def object_fn(self, digest):
+        return join(self.root, digest + '.sam')
+
+    def ingest(self, src):
+        """ Add file to store if not already there; return its digest """
+        key = _stat_key(src)
+
+        def _lookup(index):
+            return index['digests'].get(key)
+        digest = self._locked(_lookup)
+        if digest is None:
+            digest = file_digest(src)
+
+            def _record(index):
+                index['digests'][key] = digest
+            self._locked(_record)
+        obj = self.object_fn(digest)
+        if not os.path.exists(obj):
+            tmp = obj + '.tmp.%d' % os.getpid()
+            # a reflink costs no space; never hardlink, which would tie the
+            # object to the source's inode
+            try:
+                _place(src, tmp, 'reflink')
+            except OSError:
+                _place(src, tmp, 'copy')
+            os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.rename(tmp, obj)
+        return digest
+
+    def link(self, src, dst):
+        """ Make dst refer to the stored copy of src; return link mode used """
+        digest = self.ingest(src)
+        obj = self.object_fn(digest)
+        if os.path.lexists(dst):
+            ref_mode = self._locked(lambda index: index['refs'].get(digest, {}).get(os.path.abspath(dst)))
+            if ref_mode is not None and _refers_to(dst, obj, ref_mode):
+                return 'existing'
+            os.remove(dst)
+        used = None
+        for mode in self.modes:
+            try:
+                _place(obj, dst, mode)
+                used = mode
+                break
+            except OSError:
+                continue
+        if used is None:
+            raise RuntimeError('Could not link %s to %s' % (obj, dst))
+        if used in ['reflink', 'copy']:
+            os.chmod(dst, os.stat(dst).st_mode | stat.S_IWUSR)  # private copy; needn't be read-only
+        self._locked(lambda index: self._add_ref(index, digest, dst, used))
+        return used
+
+    @staticmethod
+    def _add_ref(index, digest, dst, mode):
+        index['refs'].setdefault(digest, {})[os.path.abspath(dst)] = mode
+
+    def gc(self):
+        """ Forget references that no longer point at the store and delete
+            objects with no references left; return (# objects removed,
+            bytes freed).  Objects with other hardlinks free nothing. """
+        def _gc(index):
+            nremoved, nfreed = 0, 0
+            for digest in list(index['refs'].keys()):
+                obj = self.object_fn(digest)
+                refs = dict((ref, mode) for ref, mode in index['refs'][digest].items()
+                            if _refers_to(ref, obj, mode))
+                if len(refs) > 0:
+                    index['refs'][digest] = refs
+                    continue
+                del index['refs'][digest]
+                if os.path.exists(obj):
+                    st = os.stat(obj)
+                    if st.st_nlink == 1:
+                        nfreed += st.st_size
+                    os.remove(obj)
+                    nremoved += 1
+            live = set(index['refs'].keys())
+            index['digests'] = dict((k, v) for k, v in index['digests'].items() if v in live)
+            return nremoved, nfreed
+        return self._locked(_gc)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'gc':
+        print('usage: python input_store.py gc [store dir]', file=sys.stderr)
+        sys.exit(1)
+    _nremoved, _nfreed = InputStore(sys.argv[2] if len(sys.argv) > 2 else '.input_store').gc()
+    print('Removed %d objects, freed %d bytes' % (_nremoved, _nfreed))
@@ -9,15 +9,37 @@ for dry run: write scripts but doesn't sbatch them
 python marcc_out.py wet
 
 for normal run: write scripts and also sbatch them
+
+Add --model <file> to size jobs using a model fit by resource_model.py
+
+Add --array to submit targets as SLURM job arrays, one per distinct
+resource request, rather than one job per target (see slurm.py)
+
+Add --sbatch <cmd> to submit with something other than sbatch, e.g.
+"python mock_sbatch.py" to test offline
+
+Add --local to run targets on this machine instead (see executor.py),
+optionally with --local-cores <int>, --local-mem-gb <int> and
+--retries <int>
 """
 
 import os
 import sys
 import time
-import re
+from target_index import TargetIndex
+from resource_model import ResourceModel
+from slurm import slurm_header, ArrayBatcher
+import executor
 
 
-def write_slurm(rule, fn, dirname, mem_gb, hours, ncores=8, use_scavenger=False, makefile='Makefile'):
+def slurm_resources(rule, dirname, mem_gb, hours, makefile='Makefile', model=None):
+    """ Return (memory GB, hours) to request for target.  Uses the
+        resource model if given and it has data for this kind of target,
+        otherwise scales base mem_gb and hours by rules of thumb. """
+    if model is not None:
+        pred = model.predict(rule, dirname, makefile=makefile)
+        if pred is not None:
+            return pred
     my_mem_gb, my_hours = mem_gb, hours
     if 'r12' in rule:
         my_mem_gb = int(round(1.5*my_mem_gb))
@@ -40,71 +62,66 @@ def write_slurm(rule, fn, dirname, mem_gb, hours, ncores=8, use_scavenger=False,
         my_hours *= 2
     if 'ts_50m_' in rule:
         my_hours *= 4
-    pbs_lns = list()
-    pbs_lns.append('#!/bin/bash -l')
-    pbs_lns.append('#SBATCH')
-    pbs_lns.append('#SBATCH --nodes=1')
-    pbs_lns.append('#SBATCH --mem=%dG' % my_mem_gb)
-    if use_scavenger:
-        pbs_lns.append('#SBATCH --partition=scavenger')
-        pbs_lns.append('#SBATCH --qos=scavenger')
-    else:
-        pbs_lns.append('#SBATCH --partition=shared')
-    pbs_lns.append('#SBATCH --cpus-per-task=%d' % ncores)
-    pbs_lns.append('#SBATCH --time=%d:00:00' % my_hours)
-    pbs_lns.append('#SBATCH --output=' + fn + '.o')
-    pbs_lns.append('#SBATCH --error=' + fn + '.e')
-    pbs_lns.append('export QTIP_EXPERIMENTS_HOME=%s' % os.environ['QTIP_EXPERIMENTS_HOME'])
+    return my_mem_gb, my_hours
+
+
+def write_slurm(rule, fn, dirname, mem_gb, hours, ncores=8, use_scavenger=False, makefile='Makefile', model=None):
+    my_mem_gb, my_hours = slurm_resources(rule, dirname, mem_gb, hours, makefile=makefile, model=model)
+    pbs_lns = slurm_header(fn, my_mem_gb, my_hours, ncores=ncores, use_scavenger=use_scavenger)
     pbs_lns.append('cd %s' % os.path.abspath(dirname))
     pbs_lns.append('make -f %s %s/DONE' % (makefile, rule))
     with open(os.path.join(dirname, fn), 'w') as ofh:
         ofh.write('\n'.join(pbs_lns) + '\n')
 
 
-def handle_dir(dirname, re_out, mem_gb, hours, dry_run=True, use_scavenger=False):
-    ncores = 8
-    with open(os.path.join(dirname, 'Makefile')) as fh:
-        in_out = False
-        for ln in fh:
-            if ln[0] == '#':
-                continue
-            if ln.startswith('NCORES='):
-                ncores = int(ln.split('=')[1])
-                assert ncores > 0
-            if re_out.match(ln):
-                in_out = True
-            elif in_out:
-                if len(ln.rstrip()) == 0:
-                    in_out = False
-                else:
-                    target = ln.split()[0].split('/')[0]
-                    print('  Found a .out target: %s, w/ %d cores' % (target, ncores), file=sys.stderr)
-                    target_full = os.path.join(dirname, target)
-                    if os.path.exists(os.path.join(target_full, 'DONE')):
-                        print('  Skipping target %s because of DONE' % target, file=sys.stderr)
-                        continue
-                    elif os.path.exists(target_full):
-                        # delete it???
-                        pass
-                    fn = '.' + target + '.sh'
-                    write_slurm(target, fn, dirname, mem_gb, hours, use_scavenger=use_scavenger, ncores=ncores)
-                    print('pushd %s && sbatch %s && popd' % (dirname, fn))
-                    if not dry_run:
-                        os.system('cd %s && sbatch %s' % (dirname, fn))
-                        time.sleep(0.5)
+def handle_dir(dirname, index, mem_gb, hours, dry_run=True, use_scavenger=False, model=None, batcher=None,
+               sbatch='sbatch'):
+    for targ in index.targets(dirname, 'outs'):
+        target, ncores = targ.name, targ.ncores
+        print('  Found a .out target: %s, w/ %d cores' % (target, ncores), file=sys.stderr)
+        if targ.done:
+            print('  Skipping target %s because of DONE' % target, file=sys.stderr)
+            continue
+        if batcher is not None:
+            my_mem_gb, my_hours = slurm_resources(target, dirname, mem_gb, hours, model=model)
+            batcher.add(dirname, target, my_mem_gb, my_hours, ncores)
+            continue
+        fn = '.' + target + '.sh'
+        write_slurm(target, fn, dirname, mem_gb, hours, use_scavenger=use_scavenger, ncores=ncores, model=model)
+        print('pushd %s && %s %s && popd' % (dirname, sbatch, fn))
+        if not dry_run:
+            os.system('cd %s && %s %s' % (dirname, sbatch, fn))
+            time.sleep(0.5)
 
 
 def go():
-    re_out = re.compile('^outs_[_a-zA-Z01-9]*:.*')
+    index = TargetIndex()
     mem_gb = 8
     hours = 12
     if 'QTIP_EXPERIMENTS_HOME' not in os.environ:
         raise RuntimeError('Must have QTIP_EXPERIMENTS_HOME set')
-    for dirname, dirs, files in os.walk('.'):
-        if 'Makefile' in files and 'IGNORE' not in files:
-            print('Found a Makefile: %s' % (os.path.join(dirname, 'Makefile')), file=sys.stderr)
-            handle_dir(dirname, re_out, mem_gb, hours, dry_run=(sys.argv[1] == 'dry' or sys.argv[1] == '--dry'),
-                       use_scavenger=len(sys.argv) > 2 and sys.argv[2] == 'scavenger')
+    model = None
+    if '--model' in sys.argv:
+        model = ResourceModel.load(sys.argv[sys.argv.index('--model')+1])
+    sbatch = 'sbatch'
+    if '--sbatch' in sys.argv:
+        sbatch = sys.argv[sys.argv.index('--sbatch')+1]
+    dry_run = sys.argv[1] == 'dry' or sys.argv[1] == '--dry'
+    use_scavenger = len(sys.argv) > 2 and sys.argv[2] == 'scavenger'
+    batcher = None
+    if '--local' in sys.argv:
+        batcher = executor.from_argv(sys.argv)
+    elif '--array' in sys.argv:
+        batcher = ArrayBatcher('outs', use_scavenger=use_scavenger, sbatch=sbatch)
+    for dirname in index.makefile_dirs():
+        print('Found a Makefile: %s' % (os.path.join(dirname, 'Makefile')), file=sys.stderr)
+        handle_dir(dirname, index, mem_gb, hours, dry_run=dry_run, use_scavenger=use_scavenger, model=model,
+                   batcher=batcher, sbatch=sbatch)
+    index.save()
+    if isinstance(batcher, ArrayBatcher):
+        batcher.write()
+    if batcher is not None:
+        batcher.submit(dry_run=dry_run)
 
 if __name__ == '__main__':
     if len(sys.argv) == 1:
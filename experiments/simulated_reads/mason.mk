@@ -16,6 +16,9 @@
 # -nm  Read length mean
 # -ne  Read length error (stddev for normal, interval for uniform)
 
+# Threads mason_convert.py uses to compress its output
+CONVERT_THREADS ?= 4
+
 # Use Mason to generate unpaired Illumina-like reads.  Macro takes
 # parameters: (1) batch name, (2) reference genome, (3) read length in
 # batch, (4) # reads in batch, (5) pseudo-random seed.
@@ -25,9 +28,9 @@ define mason_ill_unp_reads
 r0_mason_$1.fq.gz: $$(FA) $$(QTIP_EXPERIMENTS_HOME)/software/mason/mason
 	$$(QTIP_EXPERIMENTS_HOME)/software/mason/mason illumina -hn 2 -i -s $5 -sq -n $3 -N $4 -o .$$@.fq $2
 	rm -f .$$@.fq.sam
-	python $$(QTIP_EXPERIMENTS_HOME)/bin/mason_convert.py --in1 .$$@.fq --out1 $$(@:%.fq.gz=%.fq)
+	python $$(QTIP_EXPERIMENTS_HOME)/bin/mason_convert.py --in1 .$$@.fq --out1 .part.$$@ --threads $$(CONVERT_THREADS)
+	mv .part.$$@ $$@
 	rm -f .$$@.fq
-	gzip $$(@:%.fq.gz=%.fq)
 	$$(QTIP_EXPERIMENTS_HOME)/software/mason/mason illumina --version > $$@.version || true
 
 endef
@@ -42,12 +45,10 @@ define mason_ill_pair_reads
 r1_mason_$1.fq.gz: $(FA) $$(QTIP_EXPERIMENTS_HOME)/software/mason/mason
 	$$(QTIP_EXPERIMENTS_HOME)/software/mason/mason illumina -hn 2 -i -s $7 -sq -mp -rn 2 -ll $5 -le $6 -n $3 -N $4 -o .$$@.fq $2
 	rm -f .$$@.fq.sam
-	python $$(QTIP_EXPERIMENTS_HOME)/bin/mason_convert.py --in1 .$$(@)_1.fq --in2 .$$(@)_2.fq --out1 .$$(@)_final_1.fq --out2 .$$(@)_final_2.fq
+	python $$(QTIP_EXPERIMENTS_HOME)/bin/mason_convert.py --in1 .$$(@)_1.fq --in2 .$$(@)_2.fq --out1 .part.$$@ --out2 .part.$$(@:r1_%=r2_%) --threads $$(CONVERT_THREADS)
+	mv .part.$$(@:r1_%=r2_%) $$(@:r1_%=r2_%)
+	mv .part.$$@ $$@
 	rm -f .$$(@)_1.fq .$$(@)_2.fq
-	gzip -c .$$(@)_final_1.fq > $$@
-	rm -f .$$(@)_final_1.fq
-	gzip -c .$$(@)_final_2.fq > $$(@:r1_%=r2_%)
-	rm -f .$$(@)_final_2.fq
 	$$(QTIP_EXPERIMENTS_HOME)/software/mason/mason illumina --version > $$@.version || true
 
 endef
@@ -62,9 +63,9 @@ define mason_fff_unp_reads
 r0_mason_$1.fq.gz: $$(FA) $$(QTIP_EXPERIMENTS_HOME)/software/mason/mason
 	$$(QTIP_EXPERIMENTS_HOME)/software/mason/mason 454 -hn 2 -i -s $6 -sq -N $5 -nm $3 -ne $4 -nu -o .$$@.fq $2
 	rm -f .$$@.fq.sam
-	python $$(QTIP_EXPERIMENTS_HOME)/bin/mason_convert.py --in1 .$$@.fq --out1 $$(@:%.fq.gz=%.fq)
+	python $$(QTIP_EXPERIMENTS_HOME)/bin/mason_convert.py --in1 .$$@.fq --out1 .part.$$@ --threads $$(CONVERT_THREADS)
+	mv .part.$$@ $$@
 	rm -f .$$@.fq
-	gzip $$(@:%.fq.gz=%.fq)
 	$$(QTIP_EXPERIMENTS_HOME)/software/mason/mason 454 --version > $$@.version || true
 
 endef
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+"""
+Stand-in for sbatch, for testing job submission offline.  Reads the
+#SBATCH directives of the given script, logs the submission to
+.mock_sbatch.log and prints "Submitted batch job N" like sbatch does.
+With --run, also runs the script locally, once per array task, with
+SLURM_JOB_ID, SLURM_ARRAY_JOB_ID and SLURM_ARRAY_TASK_ID set.
+
+python mock_sbatch.py [--run] <script>
+"""
+
+import os
+import sys
+import subprocess
+
+
+def parse_directives(script_fn):
+    """ Return dict of long-form #SBATCH options in script """
+    opts = {}
+    with open(script_fn) as fh:
+        for ln in fh:
+            if ln.startswith('#SBATCH --'):
+                opt = ln[len('#SBATCH --'):].strip()
+                key, _, val = opt.partition('=')
+                opts[key] = val
+    return opts
+
+
+def array_task_ids(spec):
+    """ Parse --array spec like 0-9, 1,3,5 or 0-99%10 into list of ids """
+    ids = []
+    for part in spec.split('%')[0].split(','):
+        if '-' in part:
+            lo, hi = part.split('-')
+            ids.extend(range(int(lo), int(hi) + 1))
+        else:
+            ids.append(int(part))
+    return ids
+
+
+def next_job_id(log_fn):
+    if not os.path.exists(log_fn):
+        return 1
+    with open(log_fn) as fh:
+        return sum(1 for _ in fh) + 1
+
+
+def go(script_fn, run=False, log_fn='.mock_sbatch.log'):
+    opts = parse_directives(script_fn)
+    job_id = next_job_id(log_fn)
+    tasks = array_task_ids(opts['array']) if 'array' in opts else None
+    with open(log_fn, 'a') as ofh:
+        ofh.write('%d\t%s\t%s\t%s\n' % (job_id, os.path.abspath(script_fn),
+                                        opts.get('array', ''), ' '.join('--%s=%s' % kv for kv in sorted(opts.items()))))
+    print('Submitted batch job %d' % job_id)
+    if run:
+        for task in (tasks or [None]):
+            env = dict(os.environ, SLURM_JOB_ID=str(job_id))
+            if task is not None:
+                env['SLURM_ARRAY_JOB_ID'] = str(job_id)
+                env['SLURM_ARRAY_TASK_ID'] = str(task)
+            ret = subprocess.call(['bash', script_fn], env=env)
+            if ret != 0:
+                print('Job %d task %s exited with status %d' % (job_id, str(task), ret), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    _args = sys.argv[1:]
+    _run = '--run' in _args
+    _args = [a for a in _args if a != '--run']
+    if len(_args) != 1:
+        print('usage: python mock_sbatch.py [--run] <script>', file=sys.stderr)
+        sys.exit(1)
+    go(_args[0], run=_run)
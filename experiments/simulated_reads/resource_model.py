@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+"""
+resource_model.py
+
+Model of the memory and time a simulated_reads target needs, for sizing
+the SLURM requests made by marcc_out.write_slurm.  Fit from the SLURM
+.o files of completed runs, using the same "INFO:Overall" and "Peak
+memory usage" lines that real_data/perf_tabulate.py parses.
+
+Targets are described by aligner, pairedness, read length and number of
+reads.  For each (aligner, paired) group, peak memory and running time
+are fit as linear functions of the number of simulated bases (reads x
+read length).  Predictions are multiplied by a safety margin and rounded
+up.  Groups with no completed runs get no prediction, and write_slurm
+falls back on its rules of thumb.
+
+python resource_model.py fit [--model FN] [--margin X]
+
+fit model from the .<target>.sh.o files under the current directory
+and save it to FN (default .resource_model.json)
+
+python resource_model.py report [--model FN]
+
+dry run: print a table of predicted vs. actual memory and hours for
+each .o file with a completed run
+"""
+
+import os
+import re
+import sys
+import json
+import math
+from os.path import join
+
+default_nreads = 4000000
+nreads_re = re.compile('^([0-9]+)[mM]$')
+readlen_re = re.compile('^([0-9]+to)?([0-9]+)$')
+
+
+def makefile_nreads(dirname, makefile='Makefile'):
+    """ Return NREADS= setting from Makefile, or None """
+    fn = join(dirname, makefile)
+    if os.path.exists(fn):
+        with open(fn) as fh:
+            for ln in fh:
+                if ln.startswith('NREADS='):
+                    return int(ln.split('=')[1])
+    return None
+
+
+def target_features(rule, dirname='.', makefile='Makefile'):
+    """ Based on Makefile target name, return (aligner, paired, read
+        length, # reads) """
+    toks = rule.split('.')[0].split('_')
+    paired = toks[0] == 'r12'
+    aligner = 'bt2'
+    if 'bwamem' in toks[1]:
+        aligner = 'bwamem'
+    elif 'snap' in toks[1]:
+        aligner = 'snap'
+    readlen, nreads = 0, None
+    for tok in reversed(toks):
+        if nreads is None and nreads_re.match(tok):
+            nreads = int(nreads_re.match(tok).group(1)) * 1000000
+        elif readlen_re.match(tok):
+            readlen = int(readlen_re.match(tok).group(2))
+            break
+    if nreads is None:
+        nreads = makefile_nreads(dirname, makefile) or default_nreads
+    return aligner, paired, readlen, nreads
+
+
+def parse_slurm_output(fn):
+    """ Return (peak memory in GB, overall seconds) from a SLURM .o file
+        of a completed qtip run, or None if run didn't complete """
+    wrappeak, childpeak, t_overall = 0.0, 0.0, None
+    with open(fn) as fh:
+        for ln in fh:
+            ln = ln.rstrip()
+            if 'INFO:Overall' in ln:
+                t_overall = float(ln.split()[-1])
+            if 'INFO:Peak memory usage (RSS) of Python wrapper' in ln:
+                assert ln.endswith('GB')
+                wrappeak = float(ln.split()[-1][:-2])
+            if 'INFO:Peak memory usage (RSS) of children' in ln:
+                assert ln.endswith('GB')
+                childpeak = float(ln.split()[-1][:-2])
+    if t_overall is None:
+        return None
+    # wrapper and children can be resident at the same time
+    return wrappeak + childpeak, t_overall
+
+
+def completed_runs(root='.'):
+    """ Yield (dirname, rule, peak GB, hours) for each completed run with
+        a .<rule>.sh.o file under root """
+    for dirname, dirs, files in os.walk(root):
+        dirs[:] = [dr for dr in dirs if not dr.endswith('.out')]
+        for fn in sorted(files):
+            if fn.startswith('.') and fn.endswith('.sh.o'):
+                res = parse_slurm_output(join(dirname, fn))
+                if res is not None:
+                    yield dirname, fn[1:-5], res[0], res[1] / 3600.0
+
+
+def _fit_line(xs, ys):
+    """ Least-squares fit of y = a + b*x; through the origin if there's
+        only one distinct x """
+    n = float(len(xs))
+    mx, my = sum(xs) / n, sum(ys) / n
+    sxx = sum((x - mx) ** 2 for x in xs)
+    if sxx == 0:
+        return 0.0, my / mx if mx > 0 else 0.0
+    b = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx
+    return my - b * mx, b
+
+
+class ResourceModel(object):
+    """ Predicts (memory GB, hours) for a target """
+
+    def __init__(self, coefs=None, margin=1.5, min_mem_gb=2, min_hours=1):
+        self.coefs = coefs or {}
+        self.margin = margin
+        self.min_mem_gb = min_mem_gb
+        self.min_hours = min_hours
+
+    @staticmethod
+    def _group(aligner, paired):
+        return '%s,%s' % (aligner, 'T' if paired else 'F')
+
+    def fit(self, runs):
+        """ Fit from iterable of (dirname, rule, peak GB, hours) """
+        obs = {}
+        for dirname, rule, mem_gb, hours in runs:
+            aligner, paired, readlen, nreads = target_features(rule, dirname)
+            obs.setdefault(self._group(aligner, paired), []).append((nreads * readlen / 1e9, mem_gb, hours))
+        for group, ob in obs.items():
+            xs = [o[0] for o in ob]
+            self.coefs[group] = {'mem': _fit_line(xs, [o[1] for o in ob]),
+                                 'hours': _fit_line(xs, [o[2] for o in ob]),
+                                 'n': len(ob)}
+        return self
+
+    def predict_raw(self, rule, dirname='.', makefile='Makefile'):
+        """ Return unpadded (memory GB, hours) prediction, or None """
+        aligner, paired, readlen, nreads = target_features(rule, dirname, makefile)
+        coef = self.coefs.get(self._group(aligner, paired))
+        if coef is None:
+            return None
+        x = nreads * readlen / 1e9
+        return tuple(coef[k][0] + coef[k][1] * x for k in ['mem', 'hours'])
+
+    def predict(self, rule, dirname='.', makefile='Makefile'):
+        """ Return (memory GB, hours) to request, including safety
+            margin, or None if there's no data for this kind of target """
+        raw = self.predict_raw(rule, dirname, makefile)
+        if raw is None:
+            return None
+        mem_gb, hours = raw
+        return (max(self.min_mem_gb, int(math.ceil(mem_gb * self.margin))),
+                max(self.min_hours, int(math.ceil(hours * self.margin))))
+
+    def save(self, fn):
+        with open(fn, 'w') as fh:
+            json.dump({'coefs': self.coefs, 'margin': self.margin,
+                       'min_mem_gb': self.min_mem_gb, 'min_hours': self.min_hours}, fh, indent=2)
+
+    @classmethod
+    def load(cls, fn):
+        with open(fn) as fh:
+            js = json.load(fh)
+        return cls(coefs=js['coefs'], margin=js['margin'],
+                   min_mem_gb=js['min_mem_gb'], min_hours=js['min_hours'])
+
+
+def report(model, runs, ofh=sys.stdout):
+    """ Print CSV comparing predicted requests with actual usage """
+    print('dir,target,aligner,paired,readlen,nreads,pred_mem_gb,actual_mem_gb,pred_hours,actual_hours,fits', file=ofh)
+    for dirname, rule, mem_gb, hours in runs:
+        aligner, paired, readlen, nreads = target_features(rule, dirname)
+        pred = model.predict(rule, dirname)
+        pmem, phours = ('NA', 'NA') if pred is None else pred
+        fits = 'NA' if pred is None else ('T' if mem_gb <= pmem and hours <= phours else 'F')
+        print('%s,%s,%s,%s,%d,%d,%s,%0.2f,%s,%0.2f,%s' % (dirname, rule, aligner, 'T' if paired else 'F', readlen,
+                                                         nreads, pmem, mem_gb, phours, hours, fits), file=ofh)
+
+
+def go():
+    model_fn = '.resource_model.json'
+    if '--model' in sys.argv:
+        model_fn = sys.argv[sys.argv.index('--model')+1]
+    if sys.argv[1] == 'fit':
+        margin = 1.5
+        if '--margin' in sys.argv:
+            margin = float(sys.argv[sys.argv.index('--margin')+1])
+        model = ResourceModel(margin=margin).fit(completed_runs())
+        for group, coef in sorted(model.coefs.items()):
+            print('%s: %d runs' % (group, coef['n']), file=sys.stderr)
+        model.save(model_fn)
+    elif sys.argv[1] == 'report':
+        report(ResourceModel.load(model_fn), completed_runs())
+    else:
+        raise RuntimeError('Unknown command "%s"; must be fit or report' % sys.argv[1])
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1:
+        print("pass argument 'fit' to fit model, or 'report' for predicted vs. actual")
+    else:
+        go()
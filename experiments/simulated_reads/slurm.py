@@ -0,0 +1,99 @@
+"""
+slurm.py
+
+Helpers for writing and submitting SLURM scripts, shared by marcc_out.py
+and explore_variations.py.
+
+ArrayBatcher groups targets that need the same resources (memory, hours,
+cores, partition) into SLURM job arrays, so thousands of targets take a
+handful of sbatch calls instead of one each.  Each array gets a manifest
+with one tab-separated (directory, makefile, target) line per task; task
+$SLURM_ARRAY_TASK_ID runs the target on line $SLURM_ARRAY_TASK_ID+1.
+Each task's output goes to .<target>.sh.o/.e in the target's directory,
+as for one-job-per-target scripts.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+from collections import OrderedDict
+
+def slurm_header(fn, mem_gb, hours, ncores=8, use_scavenger=False):
+    """ Return list of lines starting a SLURM script, up to and including
+        setting QTIP_EXPERIMENTS_HOME """
+    pbs_lns = list()
+    pbs_lns.append('#!/bin/bash -l')
+    pbs_lns.append('#SBATCH')
+    pbs_lns.append('#SBATCH --nodes=1')
+    pbs_lns.append('#SBATCH --mem=%dG' % mem_gb)
+    if use_scavenger:
+        pbs_lns.append('#SBATCH --partition=scavenger')
+        pbs_lns.append('#SBATCH --qos=scavenger')
+    else:
+        pbs_lns.append('#SBATCH --partition=shared')
+    pbs_lns.append('#SBATCH --cpus-per-task=%d' % ncores)
+    pbs_lns.append('#SBATCH --time=%d:00:00' % hours)
+    pbs_lns.append('#SBATCH --output=' + fn + '.o')
+    pbs_lns.append('#SBATCH --error=' + fn + '.e')
+    pbs_lns.append('export QTIP_EXPERIMENTS_HOME=%s' % os.environ['QTIP_EXPERIMENTS_HOME'])
+    return pbs_lns
+
+
+class ArrayBatcher(object):
+    """ Collects targets, then writes and submits one job array per group
+        of targets with identical resource requests """
+
+    def __init__(self, name, dirname='.', use_scavenger=False, sbatch='sbatch', max_array_size=1000):
+        self.name = name
+        self.dirname = dirname
+        self.use_scavenger = use_scavenger
+        self.sbatch = sbatch
+        self.max_array_size = max_array_size
+        self.groups = OrderedDict()
+        self.scripts = []
+
+    def add(self, dirname, rule, mem_gb, hours, ncores, makefile='Makefile'):
+        key = (int(mem_gb), int(hours), ncores)
+        self.groups.setdefault(key, []).append((os.path.abspath(dirname), makefile, rule))
+
+    def __len__(self):
+        return sum(len(tasks) for tasks in self.groups.values())
+
+    def write(self):
+        """ Write a manifest and script for each array; return list of
+            script file names, relative to self.dirname """
+        for (mem_gb, hours, ncores), tasks in self.groups.items():
+            for i in range(0, len(tasks), self.max_array_size):
+                chunk = tasks[i:i+self.max_array_size]
+                base = '.array_%s_%dG_%dh_%dc_%d' % (self.name, mem_gb, hours, ncores, i // self.max_array_size)
+                manifest_fn = os.path.abspath(os.path.join(self.dirname, base + '.manifest'))
+                with open(manifest_fn, 'w') as ofh:
+                    for task in chunk:
+                        ofh.write('\t'.join(task) + '\n')
+                fn = base + '.sh'
+                pbs_lns = slurm_header(fn + '.%a', mem_gb, hours, ncores=ncores, use_scavenger=self.use_scavenger)
+                pbs_lns.insert(2, '#SBATCH --array=0-%d' % (len(chunk) - 1))
+                pbs_lns.append("IFS=$'\\t' read -r TASK_DIR TASK_MAKEFILE TASK_RULE "
+                               '< <(sed -n "$((SLURM_ARRAY_TASK_ID+1))p" %s)' % manifest_fn)
+                pbs_lns.append('cd "$TASK_DIR"')
+                pbs_lns.append('exec > ".$TASK_RULE.sh.o" 2> ".$TASK_RULE.sh.e"')
+                pbs_lns.append('make -f "$TASK_MAKEFILE" "$TASK_RULE/DONE"')
+                with open(os.path.join(self.dirname, fn), 'w') as ofh:
+                    ofh.write('\n'.join(pbs_lns) + '\n')
+                self.scripts.append(fn)
+                print('  Array %s: %d targets, %dG, %dh, %d cores' % (fn, len(chunk), mem_gb, hours, ncores),
+                      file=sys.stderr)
+        return self.scripts
+
+    def submit_commands(self):
+        return ['pushd %s && %s %s && popd' % (self.dirname, self.sbatch, fn) for fn in self.scripts]
+
+    def submit(self, dry_run=True):
+        """ Print, and unless dry_run also run, sbatch command for each
+            script written """
+        for fn, cmd in zip(self.scripts, self.submit_commands()):
+            print(cmd)
+            if not dry_run:
+                os.system('cd %s && %s %s' % (self.dirname, self.sbatch, fn))
+                time.sleep(0.5)
@@ -0,0 +1,121 @@
+"""
+target_index.py
+
+Index of the Makefile targets under simulated_reads, shared by
+gather.py, marcc_out.py and marcc_reads.py.  Targets come from two kinds
+of Makefile sections:
+  + outs_*: -- lists of <target>.out/DONE qtip runs
+  + reads: -- lists of simulated read files
+Each target is recorded along with the NCORES= setting in effect where
+it's listed.
+
+Parsed Makefiles are cached in .target_index.json under the root
+directory; an entry is re-parsed only when its Makefile's mtime changes.
+Whether a target is done is always checked fresh.  Directories with an
+IGNORE file are skipped, and the walk doesn't descend into .out
+directories, which hold nothing but qtip output.
+"""
+
+import os
+import re
+import json
+from collections import namedtuple
+from os.path import join
+
+outs_re = re.compile('^outs_[_a-zA-Z01-9]*:.*')
+reads_re = re.compile('^reads:.*')
+default_ncores = 8
+
+
+class Target(namedtuple('Target', ['dirname', 'makefile', 'section', 'name', 'ncores'])):
+    """ A target from a Makefile section; name has any /DONE stripped """
+
+    @property
+    def path(self):
+        return join(self.dirname, self.name)
+
+    @property
+    def done(self):
+        """ .out targets are done when they have a DONE file, reads
+            targets when they exist """
+        if self.section == 'reads':
+            return os.path.exists(self.path)
+        return os.path.exists(join(self.path, 'DONE'))
+
+
+def parse_makefile(fn):
+    """ Return list of (section, target name, ncores) for all targets
+        listed in outs_* and reads sections of Makefile """
+    ret = []
+    ncores = default_ncores
+    section = None
+    with open(fn) as fh:
+        for ln in fh:
+            if ln[0] == '#':
+                continue
+            if ln.startswith('NCORES='):
+                ncores = int(ln.split('=')[1])
+                assert ncores > 0
+            if outs_re.match(ln):
+                section = 'outs'
+            elif reads_re.match(ln):
+                section = 'reads'
+            elif section is not None:
+                if len(ln.rstrip()) == 0:
+                    section = None
+                else:
+                    ret.append((section, ln.split()[0].split('/')[0], ncores))
+    return ret
+
+
+class TargetIndex(object):
+    """ Finds Makefiles under root and the targets they list, using and
+        maintaining the on-disk cache.  Call save() to write the cache
+        back. """
+
+    def __init__(self, root='.', cache_fn=None):
+        self.root = root
+        self.cache_fn = cache_fn or join(root, '.target_index.json')
+        self.cache = {}
+        self.dirty = False
+        if os.path.exists(self.cache_fn):
+            try:
+                with open(self.cache_fn) as fh:
+                    self.cache = json.load(fh)
+            except ValueError:
+                self.cache = {}
+        self._walk = None
+
+    def _walk_dirs(self):
+        if self._walk is None:
+            self._walk = []
+            for dirname, dirs, files in os.walk(self.root):
+                dirs[:] = [dr for dr in dirs if not dr.endswith('.out')]
+                self._walk.append((dirname, set(files)))
+        return self._walk
+
+    def makefile_dirs(self, makefile='Makefile'):
+        """ Return directories containing given Makefile and no IGNORE
+            file, in os.walk order """
+        return [dirname for dirname, files in self._walk_dirs()
+                if makefile in files and 'IGNORE' not in files]
+
+    def targets(self, dirname, section='outs', makefile='Makefile'):
+        """ Return list of Targets from given section of dirname's
+            Makefile, in the order listed """
+        fn = join(dirname, makefile)
+        mtime = os.stat(fn).st_mtime
+        ent = self.cache.get(fn)
+        if ent is None or ent['mtime'] != mtime:
+            ent = {'mtime': mtime, 'targets': parse_makefile(fn)}
+            self.cache[fn] = ent
+            self.dirty = True
+        return [Target(dirname, makefile, sec, name, ncores)
+                for sec, name, ncores in ent['targets'] if sec == section]
+
+    def save(self):
+        if self.dirty:
+            with open(self.cache_fn + '.tmp', 'w') as fh:
+                json.dump(self.cache, fh)
+            os.rename(self.cache_fn + '.tmp', self.cache_fn)
+            self.dirty = False
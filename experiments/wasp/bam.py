@@ -0,0 +1,183 @@
+"""
+bam.py
+
+Minimal BAM reader for postprocess.py, so we don't need to fork
+samtools and re-parse its text output.  BGZF blocks are inflated with
+zlib, optionally in a pool of threads (zlib releases the GIL), and
+records are decoded only as far as needed: QNAME, FLAG, RNAME, POS,
+MAPQ and the value of one auxiliary tag.
+
+Spec: https://samtools.github.io/hts-specs/SAMv1.pdf
+"""
+
+import struct
+import zlib
+from itertools import islice
+
+_bgzf_header = struct.Struct('<4BI2BH')  # ID1 ID2 CM FLG MTIME XFL OS XLEN
+_int32 = struct.Struct('<i')
+# block_size refID pos l_read_name mapq bin n_cigar_op flag l_seq
+_record_core = struct.Struct('<iiiBBHHHi')
+_aux_sizes = {'A': 1, 'c': 1, 'C': 1, 's': 2, 'S': 2, 'i': 4, 'I': 4, 'f': 4}
+_aux_int = {'c': '<b', 'C': '<B', 's': '<h', 'S': '<H', 'i': '<i', 'I': '<I'}
+
+if str is bytes:
+    def _str(b):
+        return b
+else:
+    def _str(b):
+        return b.decode('ascii')
+
+
+def _read_raw_block(fh):
+    """ Return compressed payload of next BGZF block, or None at EOF """
+    hdr = fh.read(_bgzf_header.size)
+    if len(hdr) == 0:
+        return None
+    if len(hdr) < _bgzf_header.size:
+        raise RuntimeError('Truncated BGZF block header')
+    id1, id2, _, flg, _, _, _, xlen = _bgzf_header.unpack(hdr)
+    if id1 != 31 or id2 != 139 or not (flg & 4):
+        raise RuntimeError('Not a BGZF file')
+    extra = fh.read(xlen)
+    bsize, off = None, 0
+    while off < xlen:
+        si1, si2 = extra[off:off+1], extra[off+1:off+2]
+        slen = struct.unpack('<H', extra[off+2:off+4])[0]
+        if si1 == b'B' and si2 == b'C':
+            bsize = struct.unpack('<H', extra[off+4:off+6])[0]
+        off += 4 + slen
+    if bsize is None:
+        raise RuntimeError('BGZF block lacks BC subfield')
+    # remaining = total block size - header - extra; last 8 bytes are CRC32 and ISIZE
+    rest = fh.read(bsize + 1 - _bgzf_header.size - xlen)
+    return rest[:-8]
+
+
+def _inflate(cdata):
+    return zlib.decompress(cdata, -15)
+
+
+def bgzf_blocks(fn, threads=1, batch=64):
+    """ Yield decompressed BGZF blocks, in order """
+    pool = None
+    if threads > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(threads)
+    try:
+        with open(fn, 'rb') as fh:
+            while True:
+                raw = []
+                for _ in range(batch * max(threads, 1)):
+                    cdata = _read_raw_block(fh)
+                    if cdata is None:
+                        break
+                    raw.append(cdata)
+                if len(raw) == 0:
+                    break
+                for data in (pool.map(_inflate, raw) if pool is not None else map(_inflate, raw)):
+                    yield data
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def _aux_value(data, off, end, tag):
+    """ Walk aux fields in data[off:end] and return value of tag, or None """
+    while off + 3 <= end:
+        t, typ = data[off:off+2], _str(data[off+2:off+3])
+        off += 3
+        if typ == 'Z' or typ == 'H':
+            zend = data.index(b'\0', off)
+            if t == tag:
+                return _str(data[off:zend])
+            off = zend + 1
+        elif typ == 'B':
+            subtyp = _str(data[off:off+1])
+            count = _int32.unpack_from(data, off+1)[0]
+            off += 5 + count * _aux_sizes[subtyp]
+        else:
+            if t == tag:
+                if typ in _aux_int:
+                    return struct.unpack_from(_aux_int[typ], data, off)[0]
+                return struct.unpack_from('<f' if typ == 'f' else '<c', data, off)[0]
+            off += _aux_sizes[typ]
+    return None
+
+
+class BamReader(object):
+    """ Iterate over records of a BAM file without samtools.  Header text
+        and reference names are available once constructed. """
+
+    def __init__(self, fn, threads=1):
+        self._blocks = bgzf_blocks(fn, threads=threads)
+        self._buf = b''
+        self._off = 0
+        if self._take(4) != b'BAM\1':
+            raise RuntimeError('"%s" is not a BAM file' % fn)
+        l_text = _int32.unpack(self._take(4))[0]
+        self.header_text = _str(self._take(l_text)).rstrip('\0')
+        self.references = []
+        for _ in range(_int32.unpack(self._take(4))[0]):
+            l_name = _int32.unpack(self._take(4))[0]
+            self.references.append(_str(self._take(l_name)[:-1]))
+            self._take(4)  # l_ref
+
+    def _fill(self, n):
+        """ Make sure at least n unconsumed bytes are buffered; return
+            False if we hit EOF first """
+        while len(self._buf) - self._off < n:
+            try:
+                block = next(self._blocks)
+            except StopIteration:
+                return False
+            self._buf = self._buf[self._off:] + block
+            self._off = 0
+        return True
+
+    def _take(self, n):
+        if not self._fill(n):
+            raise RuntimeError('Truncated BAM file')
+        ret = self._buf[self._off:self._off+n]
+        self._off += n
+        return ret
+
+    def header_lines(self):
+        return [ln for ln in self.header_text.split('\n') if len(ln) > 0]
+
+    def _raw_records(self):
+        """ Yield (qname, record bytes, offset of record in them) """
+        while self._fill(4):
+            block_size = _int32.unpack_from(self._buf, self._off)[0]
+            if not self._fill(4 + block_size):
+                raise RuntimeError('Truncated BAM record')
+            data, off = self._buf, self._off
+            self._off += 4 + block_size
+            l_read_name = _record_core.unpack_from(data, off)[3]
+            yield _str(data[off + 36:off + 35 + l_read_name]), data, off
+
+    def _decode(self, qname, data, off, tag):
+        block_size, ref_id, pos, l_read_name, mapq, _, n_cigar_op, flag, l_seq = \
+            _record_core.unpack_from(data, off)
+        aux_off = off + 36 + l_read_name + 4 * n_cigar_op + ((l_seq + 1) >> 1) + l_seq
+        rname = '*' if ref_id < 0 else self.references[ref_id]
+        return qname, flag, rname, pos + 1, mapq, _aux_value(data, aux_off, off + 4 + block_size, tag)
+
+    def records(self, names=None, tag=b'Zm', batch=65536):
+        """ Yield (qname, flag, rname, pos, mapq, tag value) tuples.  pos
+            is 1-based, as in SAM.  If names (a RemapHist) is given,
+            records whose QNAME isn't in it are skipped before decoding
+            anything else; names are looked up a batch at a time. """
+        raw = self._raw_records()
+        if names is None:
+            for rec in raw:
+                yield self._decode(rec[0], rec[1], rec[2], tag)
+            return
+        while True:
+            recs = list(islice(raw, batch))
+            if len(recs) == 0:
+                break
+            rows = names.lookup([rec[0] for rec in recs])
+            for i in (rows >= 0).nonzero()[0]:
+                yield self._decode(recs[i][0], recs[i][1], recs[i][2], tag)
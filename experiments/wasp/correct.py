@@ -24,6 +24,27 @@ def pos_from_extended_wgsim(name, mate2=False):
         return refid, fragen1 - (ln-1), False
 
 
+def fast_pos_from_extended_wgsim(name, mate2=False):
+    """ Same as pos_from_extended_wgsim but using split instead of the
+        regex; returns None if name doesn't look right """
+    toks = name.rsplit('_', 8)
+    if len(toks) != 9 or not toks[0] or not toks[1] or not toks[2] or \
+            not toks[5] or not toks[6] or not toks[7] or toks[8][:1] in ('', '/'):
+        return None
+    for err in toks[3:5]:
+        err = err.split(':', 2)
+        if len(err) != 3 or not err[0] or not err[1] or not err[2]:
+            return None
+    fragst1, fragen1 = int(toks[1])-1, int(toks[2])-1
+    len1, len2 = int(toks[5]), int(toks[6])
+    flip = toks[7] == '1'
+    ln = len2 if mate2 else len1
+    if flip == mate2:
+        return toks[0], fragst1, True
+    else:
+        return toks[0], fragen1 - (ln-1), False
+
+
 """
 Example: qsim!:GL000229.1:+:6005:100:u
 pretty sure offset is 0-based
@@ -40,6 +61,21 @@ def pos_from_qsim(name):
     return res.group(1), int(res.group(3)), res.group(2) == '+'
 
 
+def _maybe_wgsim(name):
+    """ False if name certainly isn't an extended wgsim name, which
+        takes precedence over the other schemes """
+    return name.count('_') >= 8 and name.count(':') >= 4
+
+
+def fast_pos_from_qsim(name, mate2=False):
+    if not name.startswith('qsim!:') or _maybe_wgsim(name):
+        return None
+    toks = name.split(':', 4)
+    if len(toks) != 5 or not toks[1] or toks[2] not in ('+', '-') or not toks[3]:
+        return None
+    return toks[1], int(toks[3]), toks[2] == '+'
+
+
 """
 Example: !h!chr9!118085975!+!50!0
 offset is 0-based
@@ -56,6 +92,16 @@ def pos_from_hint(name):
     return res.group(1), int(res.group(2)), res.group(3) == '+'
 
 
+def fast_pos_from_hint(name, mate2=False):
+    if not name.startswith('!h!') or _maybe_wgsim(name) or ' contig=' in name:
+        return None
+    toks = name[3:].split('!', 4)
+    if len(toks) != 5 or not toks[0] or not toks[1].isdigit() or toks[2] not in ('+', '-') or \
+            not toks[3].isdigit() or not toks[4][:1].isdigit():
+        return None
+    return toks[0], int(toks[1]), toks[2] == '+'
+
+
 """
 Example:
 hg38_50nt_mason1_unp.fastq.000999999 contig=chr9 haplotype=1 length=50 orig_begin=118085976 orig_end=118086026 snps=0 indels=0 haplotype_infix=ATGACTCTTGAAGCTGGGCGCAGTGGCTCATGCCTGTAATCCTAGCACTT edit_string=MMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMM strand=forward
@@ -68,10 +114,25 @@ def name_is_mason1(name):
 
 
 def pos_from_mason1(name):
-    res = _hint_re.match(name)
+    res = _mason_re.match(name)
     return res.group(1), int(res.group(2)), res.group(3) == 'f'
 
 
+def fast_pos_from_mason1(name, mate2=False):
+    if name.startswith('qsim!:') or _maybe_wgsim(name):
+        return None
+    toks = name.split(' ')
+    if len(toks) < 6 or not toks[0] or not toks[1].startswith('contig=') or len(toks[1]) == 7:
+        return None
+    begins = [i for i, tok in enumerate(toks) if tok.startswith('orig_begin=')]
+    strands = [i for i, tok in enumerate(toks) if tok.startswith('strand=')]
+    # with more than one of either, leave it to the regex to pick
+    if len(begins) != 1 or len(strands) != 1 or begins[0] < 3 or strands[0] < begins[0] + 2 or \
+            len(toks[begins[0]]) == 11 or toks[strands[0]][7:8] not in ('f', 'r'):
+        return None
+    return toks[1][7:], int(toks[begins[0]][11:]), toks[strands[0]][7] == 'f'
+
+
 def same_pos(pos1, pos2, wiggle=30):
     """ Returns true when the two positions are basically the same """
     refid1, pos1, strand1 = pos1
@@ -81,20 +142,175 @@ def same_pos(pos1, pos2, wiggle=30):
     return abs(pos1 - pos2) < wiggle
 
 
-def is_correct(toks, wiggle=30):
+def name_scheme(name):
+    """ Return which naming scheme name uses, trying each in order """
+    if name_is_extended_wgsim(name):
+        return 'wgsim'
+    elif name_is_qsim(name):
+        return 'qsim'
+    elif name_is_mason1(name):
+        return 'mason1'
+    elif name_is_hint(name):
+        return 'hint'
+    raise RuntimeError('Name was not formatted as expected: "%s"' % name)
+
+
+_pos_from = {'wgsim': pos_from_extended_wgsim,
+             'qsim': lambda name, mate2: pos_from_qsim(name),
+             'mason1': lambda name, mate2: pos_from_mason1(name),
+             'hint': lambda name, mate2: pos_from_hint(name)}
+
+_fast_pos_from = {'wgsim': fast_pos_from_extended_wgsim,
+                  'qsim': fast_pos_from_qsim,
+                  'mason1': fast_pos_from_mason1,
+                  'hint': fast_pos_from_hint}
+
+
+def true_pos_regex(name, mate2=False):
+    """ Parse true position from name by trying each scheme's regex """
+    return _pos_from[name_scheme(name)](name, mate2)
+
+
+class NameParser(object):
+    """ Parses true positions out of read names.  Classifies the first
+        nsniff names with the regexes; if they all use the same scheme,
+        locks onto that scheme's split-based parser, falling back to the
+        regexes for any name it rejects. """
+
+    def __init__(self, nsniff=1000):
+        self.nsniff = nsniff
+        self.nseen = 0
+        self.nfallback = 0
+        self.scheme = None
+        self.locked = False
+        self._fast = None
+
+    def true_pos(self, name, mate2=False):
+        if self._fast is not None:
+            pos = self._fast(name, mate2)
+            if pos is not None:
+                return pos
+            self.nfallback += 1
+            return true_pos_regex(name, mate2)
+        scheme = name_scheme(name)
+        if self.nseen == 0:
+            self.scheme = scheme
+        elif scheme != self.scheme:
+            self.scheme = None
+        self.nseen += 1
+        if self.nseen >= self.nsniff and not self.locked:
+            self.locked = True  # stop sniffing either way
+            if self.scheme is not None:
+                self._fast = _fast_pos_from[self.scheme]
+        return _pos_from[scheme](name, mate2)
+
+
+_parser = NameParser()
+
+
+def is_correct(toks, wiggle=30, parser=None):
     """ Checks whether alignment, tokenized in toks, is correct """
     flags = int(toks[1])
     aligned_pos = (toks[2], int(toks[3])-1, (flags & 16) == 0)
     paired = (flags & 1) != 0
     mate2 = paired and (flags & 128) != 0
-    if name_is_extended_wgsim(toks[0]):
-        true_pos = pos_from_extended_wgsim(toks[0], mate2)
-    elif name_is_qsim(toks[0]):
-        true_pos = pos_from_qsim(toks[0])
-    elif name_is_mason1(toks[0]):
-        true_pos = pos_from_mason1(toks[0])
-    elif name_is_hint(toks[0]):
-        true_pos = pos_from_hint(toks[0])
-    else:
-        raise RuntimeError('Name was not formatted as expected: "%s"' % toks[0])
+    true_pos = (parser or _parser).true_pos(toks[0], mate2)
     return same_pos(true_pos, aligned_pos, wiggle=wiggle)
+
+
+def _int_fields(buf, st, en, maxlen=18):
+    """ Parse decimal integers buf[st[i]:en[i]] for all i at once.
+        Returns values and mask of which were nonempty and all digits. """
+    import numpy as np
+    ln = en - st
+    width = int(min(max(ln.max(), 1), maxlen))
+    cols = np.arange(width)
+    valid = cols < ln[:, None]
+    digits = buf[np.minimum(st[:, None] + cols, len(buf) - 1)].astype(np.int64) - 48
+    ok = (ln >= 1) & (ln <= maxlen) & np.all(~valid | ((digits >= 0) & (digits <= 9)), axis=1)
+    place = 10 ** np.maximum(ln[:, None] - 1 - cols, 0)
+    return (np.where(valid, digits, 0) * place).sum(axis=1), ok
+
+
+def _lines_buffer(strs):
+    """ Join strings into a numpy byte buffer, one per line, and return
+        it along with each string's start and end offsets """
+    import numpy as np
+    text = '\n'.join(strs) + '\n'
+    if not isinstance(text, bytes):
+        text = text.encode()
+    buf = np.frombuffer(text, dtype=np.uint8)
+    ends = np.flatnonzero(buf == 10)
+    return buf, np.concatenate(([0], ends[:-1] + 1)), ends
+
+
+def _fields_equal(buf1, st1, en1, buf2, st2, en2):
+    """ Vectorized buf1[st1[i]:en1[i]] == buf2[st2[i]:en2[i]] """
+    import numpy as np
+    ln = en1 - st1
+    eq = ln == en2 - st2
+    cols = np.arange(max(int(ln.max()), 1))
+    valid = cols < ln[:, None]
+    b1 = buf1[np.minimum(st1[:, None] + cols, len(buf1) - 1)]
+    b2 = buf2[np.minimum(st2[:, None] + cols, len(buf2) - 1)]
+    return eq & np.all(~valid | (b1 == b2), axis=1)
+
+
+def parse_extended_wgsim_batch(names):
+    """ Vectorized fast_pos_from_extended_wgsim field extraction.  Works on
+        the names' bytes as a numpy array, finding each name's last 8
+        underscores.  Returns mask of names parsed, the byte buffer and
+        offsets of each refid within it, plus arrays for the fragment
+        start/end, mate lengths and flip bit.  Only accepts the 0:0:0
+        error fields our converters write; other names are left for the
+        caller to parse one at a time. """
+    import numpy as np
+    n = len(names)
+    buf, starts, ends = _lines_buffer(names)
+    unders = np.flatnonzero(buf == 95)
+    if len(unders) < 8:
+        return (np.zeros(n, dtype=bool), buf, starts, starts) + (np.zeros(n, dtype=np.int64),) * 5
+    nbefore = np.searchsorted(unders, ends)
+    ok = nbefore - np.concatenate(([0], nbefore[:-1])) >= 8
+    u = unders[np.clip(nbefore[:, None] - 8 + np.arange(8), 0, len(unders) - 1)]
+    fst = [starts] + [u[:, i] + 1 for i in range(8)]
+    fen = [u[:, i] for i in range(8)] + [ends]
+    ok &= (fen[0] > fst[0]) & (fen[8] > fst[8]) & (buf[np.minimum(fst[8], len(buf) - 1)] != ord('/'))
+    for f in (3, 4):
+        ok &= fen[f] - fst[f] == 5
+        for k, c in enumerate(bytearray(b'0:0:0')):
+            ok &= buf[np.minimum(fst[f] + k, len(buf) - 1)] == c
+    fragst, fragst_ok = _int_fields(buf, fst[1], fen[1])
+    fragen, fragen_ok = _int_fields(buf, fst[2], fen[2])
+    len1, len1_ok = _int_fields(buf, fst[5], fen[5])
+    len2, len2_ok = _int_fields(buf, fst[6], fen[6])
+    ok &= fragst_ok & fragen_ok & len1_ok & len2_ok & (fen[7] > fst[7])
+    flip = (fen[7] - fst[7] == 1) & (buf[np.minimum(fst[7], len(buf) - 1)] == ord('1'))
+    return ok, buf, fst[0], fen[0], fragst, fragen, len1, len2, flip
+
+
+def is_correct_batch(names, flags, rnames, pos, wiggle=30, parser=None):
+    """ Vectorized is_correct.  Takes columns for a batch of alignments:
+        read names, FLAG, RNAME and 1-based POS (lists or numpy arrays).
+        Returns boolean numpy array saying which are correct. """
+    import numpy as np
+    names, rnames = list(names), list(rnames)
+    n = len(names)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+    flags = np.asarray(flags, dtype=np.int64)
+    mate2 = ((flags & 1) != 0) & ((flags & 128) != 0)
+    ok, buf, ref_st, ref_en, fragst, fragen, len1, len2, flip = parse_extended_wgsim_batch(names)
+    true_fw = flip == mate2
+    ln = np.where(mate2, len2, len1)
+    true_off = np.where(true_fw, fragst - 1, (fragen - 1) - (ln - 1))
+    rbuf, rst, ren = _lines_buffer(rnames)
+    same_ref = _fields_equal(buf, ref_st, ref_en, rbuf, rst, ren)
+    # Names that aren't simple extended wgsim names; parse one at a time
+    parser = parser or _parser
+    for i in np.flatnonzero(~ok):
+        refid, true_off[i], true_fw[i] = parser.true_pos(names[i], bool(mate2[i]))
+        same_ref[i] = refid == rnames[i]
+    aligned_off = np.asarray(pos, dtype=np.int64) - 1
+    aligned_fw = (flags & 16) == 0
+    return same_ref & (true_fw == aligned_fw) & (np.abs(true_off - aligned_off) < wiggle)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+correct_bench.py
+
+Microbenchmark comparing the regex-based read-name parsing in correct.py
+with the NameParser fast path.  For each naming scheme, generates
+simulated read names, checks both approaches give identical true
+positions, and prints records per second for each.  With --batch, also
+compares per-record is_correct with is_correct_batch.
+
+Usage: python correct_bench.py [--reads N] [--batch]
+"""
+
+from __future__ import print_function
+import sys
+import random
+import time
+
+import correct
+
+
+def make_names(scheme, n, seed=77):
+    rnd = random.Random(seed)
+    names = []
+    for i in range(n):
+        chrom = 'chr%d' % rnd.randint(1, 22)
+        off = rnd.randint(1, 200000000)
+        rdlen = rnd.choice([50, 100, 150, 250])
+        if scheme == 'wgsim':
+            nm = '%s_%d_%d_0:0:0_0:0:0_%d_%d_%d_%d/%d' % (chrom, off, off + 400, rdlen, rdlen,
+                                                        rnd.randint(0, 1), i, rnd.randint(1, 2))
+        elif scheme == 'qsim':
+            nm = 'qsim!:%s:%s:%d:%d:u' % (chrom, rnd.choice('+-'), off, rdlen)
+        elif scheme == 'mason1':
+            nm = 'hg38_%dnt_mason1_unp.fastq.%09d contig=%s haplotype=1 length=%d orig_begin=%d ' \
+                 'orig_end=%d snps=0 indels=0 haplotype_infix=%s edit_string=%s strand=%s' % \
+                 (rdlen, i, chrom, rdlen, off, off + rdlen, 'A' * rdlen, 'M' * rdlen,
+                  rnd.choice(['forward', 'reverse']))
+        else:
+            nm = '!h!%s!%d!%s!%d!0' % (chrom, off, rnd.choice('+-'), rdlen)
+        names.append((nm, rnd.random() < 0.5))
+    return names
+
+
+def bench(fn, names):
+    t0 = time.time()
+    res = [fn(nm, mate2) for nm, mate2 in names]
+    return res, len(names) / max(time.time() - t0, 1e-9)
+
+
+def go(nreads, batch=False):
+    print('scheme,regex_recs_per_sec,fast_recs_per_sec,speedup')
+    for scheme in ['wgsim', 'qsim', 'mason1', 'hint']:
+        names = make_names(scheme, nreads)
+        parser = correct.NameParser()
+        res_regex, rate_regex = bench(correct.true_pos_regex, names)
+        res_fast, rate_fast = bench(parser.true_pos, names)
+        if res_regex != res_fast:
+            raise RuntimeError('Fast path disagrees with regexes for scheme %s' % scheme)
+        print('%s,%0.0f,%0.0f,%0.2f' % (scheme, rate_regex, rate_fast, rate_fast / rate_regex))
+        print('  %s: locked=%s, fallbacks=%d' % (scheme, str(parser.scheme), parser.nfallback), file=sys.stderr)
+    if batch:
+        # is_correct per record vs. is_correct_batch on columns
+        names = [nm for nm, _ in make_names('wgsim', nreads)]
+        flags = [0] * nreads
+        rnames = ['chr1'] * nreads
+        pos = [1000] * nreads
+        t0 = time.time()
+        res_rec = [correct.is_correct([nm, fl, rn, p]) for nm, fl, rn, p in zip(names, flags, rnames, pos)]
+        rate_rec = nreads / max(time.time() - t0, 1e-9)
+        t0 = time.time()
+        res_batch = correct.is_correct_batch(names, flags, rnames, pos)
+        rate_batch = nreads / max(time.time() - t0, 1e-9)
+        if list(res_batch) != res_rec:
+            raise RuntimeError('Batch API disagrees with is_correct')
+        print('wgsim_batch,%0.0f,%0.0f,%0.2f' % (rate_rec, rate_batch, rate_batch / rate_rec))
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    _parser = argparse.ArgumentParser(description='Benchmark read-name parsing in correct.py')
+    _parser.add_argument('--reads', metavar='N', type=int, default=200000,
+                         help='Number of names to generate per scheme')
+    _parser.add_argument('--batch', action='store_const', const=True, default=False,
+                         help='Also compare is_correct with is_correct_batch (needs numpy)')
+    _args = _parser.parse_args(sys.argv[1:])
+
+    go(_args.reads, batch=_args.batch)
@@ -9,7 +9,7 @@ with fields giving (a) the original MAPQ, (b) the Qtip-predicted MAPQs
 (c) the number of remapped reads that aligned correctly, (d) same, but
 incorrectly.
 
-Assumes samtools is in the PATH.
+Assumes samtools is in the PATH, unless --native-bam is specified.
 """
 
 from __future__ import print_function
@@ -17,13 +17,28 @@ import sys
 import os
 import re
 import subprocess
+import resource
 from collections import defaultdict
+from itertools import islice
+
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
 
 # qtip imports
+import bam
 import correct
+from remap_hist import RemapHist
 
 join = os.path.join
 
+# records per batch of read-name lookups in the remap histogram
+lookup_batch = 65536
+
+# peak RSS (kilobytes) of each --scan-workers process, by pid
+_worker_peaks = {}
+
 if 'QTIP_EXPERIMENTS_HOME' not in os.environ:
     raise RuntimeError('QTIP_EXPERIMENTS_HOME must be set')
 
@@ -38,11 +53,20 @@ def is_exe(fp):
     return os.path.isfile(fp) and os.access(fp, os.X_OK)
 
 
-def args_from_bam(bam_fn):
+def args_from_bam(bam_fn, native=False):
     if not os.path.exists(bam_fn):
         raise RuntimeError('No such BAM as "%s"' % bam_fn)
+    if native:
+        return args_from_header(bam.BamReader(bam_fn).header_lines())
     proc = subprocess.Popen(['samtools', 'view', '-h', bam_fn], stdout=subprocess.PIPE)
-    for ln in proc.stdout:
+    try:
+        return args_from_header(proc.stdout)
+    finally:
+        proc.terminate()
+
+
+def args_from_header(lines):
+    for ln in lines:
         if ln[0] != '@':
             raise RuntimeError('Could not parse command line arguments from input bam')
         cmd, myid = None, None
@@ -62,7 +86,6 @@ def args_from_bam(bam_fn):
                 if cmd[0] == '--wrapper':
                     cmd = cmd[2:]
             if cmd is not None and myid is not None:
-                proc.terminate()
                 return myid, cmd
     raise RuntimeError('should not be here')
 
@@ -74,38 +97,44 @@ def remove_args(bt2_args, exclude, num_to_remove=1):
     return bt2_args
 
 
-def align_fastq_bwa(fastq1_fn, fastq2_fn, bwa_args, threads, ofn):
+def run_aligner(cmd, name, ofn, stream=False):
+    """ Run aligner command.  If stream is true, the command writes SAM
+        to stdout and we return the running process for the caller to
+        read from; otherwise wait for it and return the SAM filename. """
+    print('  %s command: %s' % (name, cmd), file=sys.stderr)
+    if stream:
+        return subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, universal_newlines=True)
+    ret = os.system(cmd)
+    if ret != 0:
+        raise RuntimeError('%s process returned %d' % (name, ret))
+    return ofn
+
+
+def align_fastq_bwa(fastq1_fn, fastq2_fn, bwa_args, threads, ofn, stream=False):
     while bwa_args[-1].endswith('.fastq') or bwa_args[-1].endswith('.fq') or \
             bwa_args[-1].endswith('.fastq.gz') or bwa_args[-1].endswith('.fq.gz'):
         bwa_args = bwa_args[:-1]
     cmd = [bwa_exe] + remove_args(bwa_args, ['-t']) + ['-t', str(threads), fastq1_fn]
     if fastq2_fn is not None:
         cmd.append(fastq2_fn)
-    cmd.extend(['>', ofn])
-    cmd = ' '.join(cmd)
-    print('  BWA command: ' + cmd, file=sys.stderr)
-    ret = os.system(cmd)
-    if ret != 0:
-        raise RuntimeError('BWA process returned %d' % ret)
-    return ofn
+    if not stream:
+        cmd.extend(['>', ofn])
+    return run_aligner(' '.join(cmd), 'BWA', ofn, stream=stream)
 
 
-def align_fastq_bowtie2(fastq1_fn, fastq2_fn, bt2_args, threads, ofn):
+def align_fastq_bowtie2(fastq1_fn, fastq2_fn, bt2_args, threads, ofn, stream=False):
     cmd = [bowtie2_exe] + remove_args(bt2_args, ['-U', '-1', '-2', '-S', '-p'])
     if fastq2_fn is None:
         cmd.extend(['-U', fastq1_fn])
     else:
         cmd.extend(['-1', fastq1_fn, '-2', fastq2_fn])
-    cmd.extend(['-S', ofn, '-p', str(threads)])
-    cmd = ' '.join(cmd)
-    print('  Bowtie2 command: ' + cmd, file=sys.stderr)
-    ret = os.system(cmd)
-    if ret != 0:
-        raise RuntimeError('Bowite2 process returned %d' % ret)
-    return ofn
+    if not stream:
+        cmd.extend(['-S', ofn])
+    cmd.extend(['-p', str(threads)])
+    return run_aligner(' '.join(cmd), 'Bowtie2', ofn, stream=stream)
 
 
-def align_fastq_snap(fastq1_fn, fastq2_fn, snap_args, threads, ofn):
+def align_fastq_snap(fastq1_fn, fastq2_fn, snap_args, threads, ofn, stream=False):
     assert '-o' in snap_args
     cmd = [snap_exe] + remove_args(remove_args(snap_args, ['-sam', '-t']), ['-fastq', '-compressedFastq'], 1 if fastq2_fn is None else 2)
     assert '-o' in snap_args
@@ -115,15 +144,10 @@ def align_fastq_snap(fastq1_fn, fastq2_fn, snap_args, threads, ofn):
     else:
         cmd = cmd[0:3] + [format_arg, fastq1_fn, fastq2_fn] + cmd[3:]
     oidx = cmd.index('-o')
-    cmd = cmd[0:oidx+1] + ['-sam', ofn] + cmd[oidx+1:]
+    cmd = cmd[0:oidx+1] + ['-sam', '-' if stream else ofn] + cmd[oidx+1:]
     cmd.extend(['-t', str(threads)])
     cmd.extend(['-xf', '4.0'])
-    cmd = ' '.join(cmd)
-    print('  SNAP command: ' + cmd, file=sys.stderr)
-    ret = os.system(cmd)
-    if ret != 0:
-        raise RuntimeError('SNAP process returned %d' % ret)
-    return ofn
+    return run_aligner(' '.join(cmd), 'SNAP', ofn, stream=stream)
 
 
 def print_update(nsecondary, nnot_proper_pair, ncor, nincor, nleft, nright):
@@ -136,119 +160,275 @@ def print_update(nsecondary, nnot_proper_pair, ncor, nincor, nleft, nright):
         print('  # correct: %d (%0.2f%%), # incorrect: %d' % (ncor, pct, nincor), file=sys.stderr)
 
 
-# Scan the resulting BAM together with the original BAM
-def scan_remapped_bam(remapped_sam_fn, keep=False):
-    hist = defaultdict(lambda: [0, 0])  # read name -> [# correct, # incorrect]
+def print_peak_memory():
+    # ru_maxrss is in kilobytes on Linux
+    gb = 1024.0 * 1024.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('Peak memory usage (RSS): parent: %0.3fGB' % (peak / gb), file=sys.stderr)
+    if len(_worker_peaks) > 0:
+        # workers run at once, so their peaks add up; pages shared with
+        # the parent are counted in each, so the sum is an upper bound
+        workers = sum(_worker_peaks.values())
+        print('  scan workers (%d): %0.3fGB total, %0.3fGB largest; parent + workers: %0.3fGB' %
+              (len(_worker_peaks), workers / gb, max(_worker_peaks.values()) / gb, (peak + workers) / gb),
+              file=sys.stderr)
+
+
+def scan_remapped_lines(lines, hist, progress=False):
+    """ Parse remapped SAM lines, adding to hist.  Returns counters. """
     n, nsecondary, nnot_proper_pair, nleft, nright = 0, 0, 0, 0, 0
     ncor, nincor = 0, 0
     nival = 10
     nival_fact = 1.25
-    with open(remapped_sam_fn) as fh:
-        for ln in fh:
-            n += 1
-            if n == nival:
-                print_update(nsecondary, nnot_proper_pair, ncor, nincor, nleft, nright)
-                nival = int(nival * nival_fact + 0.5)
-
-            if ln[0] == '@':
-                continue
-            toks = ln.split('\t')
-            words = toks[0].split(".")
-
-            # ********************************************************
-            # The following code is borrowed and adapted from WASP.
-            # WASP is by Bryce van de Geijn, Graham McVicker, Yoav
-            # Gilad, & Jonathan Pritchard and is available here:
-            # https://github.com/bmvdgeijn/WASP
-            # ********************************************************
-
-            if len(words) < 4:
-                raise ValueError("expected read names to be formatted "
-                                 "like <orig_name>.<coordinate>."
-                                 "<read_number>.<total_read_number> but got "
-                                 "%s" % toks[0])
-
-            # token separator '.' can potentially occur in
-            # original read name, so if more than 4 tokens,
-            # assume first tokens make up original read name
-            coord_str, num_str, total_str = words[-3:]
-            orig_name = ".".join(words[0:-3])
-            flags, pos = int(toks[1]), int(toks[3])
-            if flags >= 2048:
-                nsecondary += 1
-                continue
-            next_reference_start = int(toks[7])
-
-            if '-' in coord_str:
-                # paired end read, coordinate gives expected positions for each end
-                c1, c2 = coord_str.split("-")
-
-                if (flags & 3) != 3:
-                    nnot_proper_pair += 1
-                    continue  # not paired or not proper pair
-
-                pos1, pos2 = int(c1), int(c2)
-
-                # only use left end of reads, but check that right end is in
-                # correct location
-                if pos < next_reference_start:
-                    correct_map = (pos1 == pos and pos2 == next_reference_start)
-                    #print('%s: pos1 (%d) == pos (%d) + 1 and pos2 (%d) == next_reference_start (%d) + 1' % ('Correct' if correct_map else 'INCORRECT', pos1, pos, pos2, next_reference_start))
-                    nleft += 1
-                else:
-                    nright += 1
-                    continue  # this is right end of read
-            else:
-                correct_map = int(coord_str) == pos
+    for ln in lines:
+        n += 1
+        if progress and n == nival:
+            print_update(nsecondary, nnot_proper_pair, ncor, nincor, nleft, nright)
+            nival = int(nival * nival_fact + 0.5)
+
+        if ln[0] == '@':
+            continue
+        toks = ln.split('\t')
+        words = toks[0].split(".")
+
+        # ********************************************************
+        # The following code is borrowed and adapted from WASP.
+        # WASP is by Bryce van de Geijn, Graham McVicker, Yoav
+        # Gilad, & Jonathan Pritchard and is available here:
+        # https://github.com/bmvdgeijn/WASP
+        # ********************************************************
+
+        if len(words) < 4:
+            raise ValueError("expected read names to be formatted "
+                             "like <orig_name>.<coordinate>."
+                             "<read_number>.<total_read_number> but got "
+                             "%s" % toks[0])
+
+        # token separator '.' can potentially occur in
+        # original read name, so if more than 4 tokens,
+        # assume first tokens make up original read name
+        coord_str, num_str, total_str = words[-3:]
+        orig_name = ".".join(words[0:-3])
+        flags, pos = int(toks[1]), int(toks[3])
+        if flags >= 2048:
+            nsecondary += 1
+            continue
+        next_reference_start = int(toks[7])
 
-            hist[orig_name][0 if correct_map else 1] += 1
-            if correct_map:
-                ncor += 1
+        if '-' in coord_str:
+            # paired end read, coordinate gives expected positions for each end
+            c1, c2 = coord_str.split("-")
+
+            if (flags & 3) != 3:
+                nnot_proper_pair += 1
+                continue  # not paired or not proper pair
+
+            pos1, pos2 = int(c1), int(c2)
+
+            # only use left end of reads, but check that right end is in
+            # correct location
+            if pos < next_reference_start:
+                correct_map = (pos1 == pos and pos2 == next_reference_start)
+                #print('%s: pos1 (%d) == pos (%d) + 1 and pos2 (%d) == next_reference_start (%d) + 1' % ('Correct' if correct_map else 'INCORRECT', pos1, pos, pos2, next_reference_start))
+                nleft += 1
             else:
-                nincor += 1
+                nright += 1
+                continue  # this is right end of read
+        else:
+            correct_map = int(coord_str) == pos
+
+        hist.add(orig_name, correct_map)
+        if correct_map:
+            ncor += 1
+        else:
+            nincor += 1
+
+    return nsecondary, nnot_proper_pair, ncor, nincor, nleft, nright
+
+
+def sam_shards(sam_fn, nshards):
+    """ Split file into byte ranges that start and end on line boundaries """
+    size = os.path.getsize(sam_fn)
+    offsets = [0]
+    with open(sam_fn, 'rb') as fh:
+        for i in range(1, nshards):
+            off = max(size * i // nshards, offsets[-1])
+            if off > 0:
+                fh.seek(off - 1)
+                fh.readline()  # advance to start of next line
+                off = fh.tell()
+            offsets.append(min(off, size))
+    offsets.append(size)
+    return [(st, en) for st, en in zip(offsets, offsets[1:]) if en > st]
+
+
+def _file_range_lines(fh, start, end):
+    """ Yield lines, as str, of binary file fh from byte offset start up
+        to end; fh stays binary so that offsets from sam_shards hold """
+    fh.seek(start)
+    pos = start
+    while pos < end:
+        ln = fh.readline()
+        if len(ln) == 0:
+            break
+        pos += len(ln)
+        yield ln if isinstance(ln, str) else ln.decode()
+
+
+def _scan_shard(shard):
+    """ Process pool worker: scan one byte range of the remapped SAM """
+    sam_fn, start, end, names_fn = shard
+    hist = RemapHist(names_fn=names_fn)
+    with open(sam_fn, 'rb') as fh:
+        counts = scan_remapped_lines(_file_range_lines(fh, start, end), hist)
+    hist.close()
+    return hist, counts, (os.getpid(), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+# Scan the resulting BAM together with the original BAM
+def scan_remapped_bam(remapped_sam_fn, keep=False, names_fn=None, workers=1):
+    if workers > 1:
+        import multiprocessing
+        hist = RemapHist()  # read name -> (# correct, # incorrect)
+        shards = sam_shards(remapped_sam_fn, workers)
+        print('  Scanning %d shards with %d workers' % (len(shards), workers), file=sys.stderr)
+        shard_args = [(remapped_sam_fn, st, en, None if names_fn is None else '%s.%d' % (names_fn, i))
+                      for i, (st, en) in enumerate(shards)]
+        pool = multiprocessing.Pool(workers)
+        results = pool.map(_scan_shard, shard_args)
+        pool.close()
+        pool.join()
+        counts = [0] * 6
+        for shard_hist, shard_counts, (pid, peak) in results:
+            _worker_peaks[pid] = max(peak, _worker_peaks.get(pid, 0))
+            hist.merge(shard_hist)
+            counts = [x + y for x, y in zip(counts, shard_counts)]
+        if names_fn is not None:
+            with open(names_fn, 'w') as ofh:
+                for _, _, _, shard_names_fn in shard_args:
+                    with open(shard_names_fn) as fh:
+                        for ln in fh:
+                            ofh.write(ln)
+                    os.remove(shard_names_fn)
+        nsecondary, nnot_proper_pair, ncor, nincor, nleft, nright = counts
+    else:
+        hist = RemapHist(names_fn=names_fn)
+        with open(remapped_sam_fn) as fh:
+            nsecondary, nnot_proper_pair, ncor, nincor, nleft, nright = \
+                scan_remapped_lines(fh, hist, progress=True)
 
     if not keep:
         os.remove(remapped_sam_fn)
 
+    hist.finalize()
     return hist, nsecondary, nnot_proper_pair, ncor, nincor, nleft, nright
 
 
+def _tee_lines(lines, fh):
+    for ln in lines:
+        fh.write(ln)
+        yield ln
+
+
+def scan_remapped_stream(proc, tee_fn=None, names_fn=None):
+    """ Like scan_remapped_bam, but parse SAM from a running aligner's
+        stdout as it's produced.  If tee_fn is set, also save the SAM. """
+    hist = RemapHist(names_fn=names_fn)
+    lines = proc.stdout
+    tee_fh = None
+    if tee_fn is not None:
+        tee_fh = open(tee_fn, 'w')
+        lines = _tee_lines(lines, tee_fh)
+    try:
+        counts = scan_remapped_lines(lines, hist, progress=True)
+        ret = proc.wait()
+    finally:
+        if proc.returncode is None:  # scan failed; don't leave aligner running
+            proc.stdout.close()
+            proc.kill()
+            proc.wait()
+        if tee_fh is not None:
+            tee_fh.close()
+    if ret != 0:
+        raise RuntimeError('Aligner process returned %d' % ret)
+    hist.finalize()
+    return (hist,) + counts
+
+
 # Output a file with one line per input alignment:
 # - Original MAPQ
 # - Predicted MAPQ
 # - # derived reads that aligned correctly
 # - # derived reads that aligned incorrectly
-def tabulate(bam_fn, out_fn, hist, has_correctness, wiggle=30):
+def tabulate(bam_fn, out_fn, hist, has_correctness, wiggle=30, names_fn=None, native=False, threads=1):
+    if native:
+        tab = tabulate_native(bam_fn, hist, has_correctness, wiggle=wiggle, threads=threads)
+    else:
+        tab = tabulate_samtools(bam_fn, hist, has_correctness, wiggle=wiggle, names_fn=names_fn)
+    with open(out_fn, 'w') as ofh:
+        for k, v in tab.items():
+            mapq, orig_mapq, remap_correct, remap_incorrect, cor = k
+            print(','.join(map(str, [mapq, orig_mapq, remap_correct, remap_incorrect, cor, v])), file=ofh)
+
+
+def tabulate_samtools(bam_fn, hist, has_correctness, wiggle=30, names_fn=None):
     mapq_re = re.compile('Zm:[iZ]:([0-9]+)')
     tab = defaultdict(int)
-    proc = subprocess.Popen(['samtools', 'view', '-h', bam_fn], stdout=subprocess.PIPE)
-    for ln in proc.stdout:
-        if ln[0] == '@':
-            continue
-        toks = ln.split('\t')
-        qname = toks[0]
-        flags = int(toks[1])
-        if flags >= 2048:
-            continue
-        if qname in hist:
+    cmd = ['samtools', 'view', '-h', bam_fn]
+    if names_fn is not None:
+        # let samtools drop records for reads that weren't remapped
+        cmd = ['samtools', 'view', '-N', names_fn, bam_fn]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+    while True:
+        lines = list(islice(proc.stdout, lookup_batch))
+        if len(lines) == 0:
+            break
+        lines = [ln for ln in lines if ln[0] != '@']
+        # look names up before splitting; most reads weren't remapped
+        rows = hist.lookup([ln[:ln.find('\t')] for ln in lines])
+        for i in (rows >= 0).nonzero()[0]:
+            ln = lines[i]
+            toks = ln.split('\t')
+            flags = int(toks[1])
+            if flags >= 2048:
+                continue
             cor = 'NA'
             if has_correctness:
                 cor = correct.is_correct(toks, wiggle=wiggle)
                 cor = '1' if cor else '0'
             mapq = int(toks[4])
-            remap_correct, remap_incorrect = hist[qname]
+            remap_correct, remap_incorrect = hist.counts[rows[i]]
             orig_mapq = mapq_re.search(ln)
             if orig_mapq is None:
                 raise RuntimeError('Could not parse original mapq from this line: ' + ln)
             orig_mapq = int(orig_mapq.group(1))
-            tab[(mapq, orig_mapq, remap_correct, remap_incorrect, cor)] += 1
+            tab[(mapq, orig_mapq, int(remap_correct), int(remap_incorrect), cor)] += 1
     ret = proc.wait()
     if ret != 0:
         raise RuntimeError('samtools returned %d' % ret)
-    with open(out_fn, 'wb') as ofh:
-        for k, v in tab.items():
-            mapq, orig_mapq, remap_correct, remap_incorrect, cor = k
-            print(','.join(map(str, [mapq, orig_mapq, remap_correct, remap_incorrect, cor, v])), file=ofh)
+    return tab
+
+
+def tabulate_native(bam_fn, hist, has_correctness, wiggle=30, threads=1):
+    tab = defaultdict(int)
+    recs = bam.BamReader(bam_fn, threads=threads).records(names=hist)
+    while True:
+        batch = list(islice(recs, lookup_batch))
+        if len(batch) == 0:
+            break
+        rows = hist.lookup([rec[0] for rec in batch])
+        for (qname, flags, rname, pos, mapq, orig_mapq), row in zip(batch, rows):
+            if flags >= 2048:
+                continue
+            cor = 'NA'
+            if has_correctness:
+                cor = correct.is_correct([qname, flags, rname, pos], wiggle=wiggle)
+                cor = '1' if cor else '0'
+            remap_correct, remap_incorrect = hist.counts[row]
+            if orig_mapq is None:
+                raise RuntimeError('Could not parse original mapq from record for read "%s"' % qname)
+            tab[(mapq, int(orig_mapq), int(remap_correct), int(remap_incorrect), cor)] += 1
+    return tab
 
 
 def add_args(parser):
@@ -270,12 +450,29 @@ def add_args(parser):
                         help='Skip over alignment')
     parser.add_argument('--keep', action='store_const', const=True, default=False,
                         help='Keep SAM file')
+    parser.add_argument('--stream', action='store_const', const=True, default=False,
+                        help='Parse aligner output as it runs rather than via a SAM file; '
+                             'with --keep, SAM is also written')
+    parser.add_argument('--native-bam', action='store_const', const=True, default=False,
+                        help='Read the BAM directly rather than through samtools (default if samtools '
+                             'is not in the PATH); decompresses with --threads threads')
+    parser.add_argument('--scan-workers', metavar='N', type=int, default=1,
+                        help='Parse remapped SAM in N parallel shards')
+    parser.add_argument('--name-filter', action='store_const', const=True, default=False,
+                        help='Have samtools filter original BAM down to remapped read names (needs samtools >= 1.12)')
 
 
 def go(args):
+    native = args.native_bam or which('samtools') is None
+    if native and args.name_filter:
+        print('Ignoring --name-filter when reading BAM natively', file=sys.stderr)
+        args.name_filter = False
+    if args.stream and not args.skip and args.scan_workers > 1:
+        print('Ignoring --scan-workers when streaming from the aligner', file=sys.stderr)
+        args.scan_workers = 1
     if not args.skip:
         print('Getting arguments from BAM', file=sys.stderr)
-        aligner, aligner_args = args_from_bam(args.bam)
+        aligner, aligner_args = args_from_bam(args.bam, native=native)
         print('  Aligner arguments: ' + str(aligner_args), file=sys.stderr)
         print('Aligning overlap FASTQ', file=sys.stderr)
         ofn = args.output
@@ -290,13 +487,16 @@ def go(args):
         if aligner == 'SNAP':
             if not is_exe(snap_exe):
                 raise RuntimeError('No snap exe at: "%s"' % snap_exe)
-            remap_sam_fn = align_fastq_snap(fastq1_fn, fastq2_fn, aligner_args, args.threads, ofn)
+            remap_sam_fn = align_fastq_snap(fastq1_fn, fastq2_fn, aligner_args, args.threads, ofn,
+                                            stream=args.stream)
         elif aligner == 'bowtie2':
             if not is_exe(bowtie2_exe):
                 raise RuntimeError('No bowtie2 exe at: "%s"' % bowtie2_exe)
-            remap_sam_fn = align_fastq_bowtie2(fastq1_fn, fastq2_fn, aligner_args, args.threads, ofn)
+            remap_sam_fn = align_fastq_bowtie2(fastq1_fn, fastq2_fn, aligner_args, args.threads, ofn,
+                                               stream=args.stream)
         elif aligner == 'bwa':
-            remap_sam_fn = align_fastq_bwa(fastq1_fn, fastq2_fn, aligner_args, args.threads, ofn)
+            remap_sam_fn = align_fastq_bwa(fastq1_fn, fastq2_fn, aligner_args, args.threads, ofn,
+                                           stream=args.stream)
         else:
             if not is_exe(bwa_exe):
                 raise RuntimeError('No bwa exe at: "%s"' % bwa_exe)
@@ -304,12 +504,29 @@ def go(args):
         print('Scanning alignments', file=sys.stderr)
     else:
         remap_sam_fn = args.bam
+    names_fn = None
+    if args.name_filter:
+        names_fn = join(os.path.dirname(args.output), '.' + os.path.basename(args.output) + '.names')
+        print('Writing remapped read names to "%s"' % names_fn, file=sys.stderr)
     print('Remapping and populating remapping histogram', file=sys.stderr)
-    hist, nsecondary, nnot_proper_pair, ncor, nincor, nleft, nright = \
-        scan_remapped_bam(remap_sam_fn, keep=args.keep or args.skip)
+    if args.stream and not args.skip:
+        # remap_sam_fn is actually the running aligner process
+        hist, nsecondary, nnot_proper_pair, ncor, nincor, nleft, nright = \
+            scan_remapped_stream(remap_sam_fn, tee_fn=ofn if args.keep else None, names_fn=names_fn)
+    else:
+        hist, nsecondary, nnot_proper_pair, ncor, nincor, nleft, nright = \
+            scan_remapped_bam(remap_sam_fn, keep=args.keep or args.skip, names_fn=names_fn,
+                              workers=args.scan_workers)
     print_update(nsecondary, nnot_proper_pair, ncor, nincor, nleft, nright)
+    print('  # distinct remapped reads: %d (%0.2fMB histogram)' % (len(hist), hist.nbytes() / (1024.0 * 1024.0)),
+          file=sys.stderr)
+    print_peak_memory()
     print('Re-scanning BAM and creating output table', file=sys.stderr)
-    tabulate(args.bam, args.output, hist, args.correctness, args.wiggle)
+    tabulate(args.bam, args.output, hist, args.correctness, args.wiggle, names_fn=names_fn,
+             native=native, threads=args.threads)
+    if names_fn is not None and not args.keep:
+        os.remove(names_fn)
+    print_peak_memory()
 
 
 def go_profile(args):
@@ -0,0 +1,146 @@
+"""
+remap_hist.py
+
+Compact histogram of WASP remapping outcomes, keyed by original read
+name.  A dict of [# correct, # incorrect] lists costs hundreds of bytes
+per read, which adds up with tens of millions of remap reads.  Here each
+remapped alignment costs 9 bytes while scanning (a 64-bit key derived
+from the read name plus a correctness byte); finalize() then collapses
+those into sorted, unique keys and a packed array of counts.
+
+Keys are 64-bit FNV-1a hashes of the names, so they're stable across
+processes and runs.  Names are hashed in batches, with numpy working on
+one byte column of the whole batch at a time, and looked up with one
+binary search of the sorted keys per batch.  Hashing and searching one
+name at a time from Python costs more than a dict lookup, so scanners of
+whole BAMs should collect names and call lookup() on the batch rather
+than use "in" per record.
+"""
+
+from array import array
+
+import numpy as np
+
+_fnv_offset = np.uint64(0xcbf29ce484222325)
+_fnv_prime = np.uint64(0x100000001b3)
+
+# names hashed at once by add()
+hash_batch = 65536
+
+
+def name_keys(names):
+    """ Return array of 64-bit integer keys for a list of read names """
+    names = np.array([nm if isinstance(nm, bytes) else nm.encode() for nm in names], dtype=bytes)
+    width = names.dtype.itemsize
+    chars = names.view(np.uint8).reshape(len(names), width)
+    keys = np.full(len(names), _fnv_offset, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for j in range(width):
+            c = chars[:, j]
+            # names are NUL-padded to the longest; padding isn't hashed
+            keys = np.where(c != 0, (keys ^ c) * _fnv_prime, keys)
+    return keys.view(np.int64)
+
+
+def name_key(name):
+    """ Return 64-bit integer key for a read name; same as name_keys """
+    key = int(_fnv_offset)
+    for c in bytearray(name if isinstance(name, bytes) else name.encode()):
+        key = ((key ^ c) * int(_fnv_prime)) & 0xffffffffffffffff
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+class RemapHist(object):
+    """ Maps original read name -> (# correct, # incorrect) remappings.
+        Call add() while scanning, then finalize() before looking
+        anything up. """
+
+    def __init__(self, names_fn=None):
+        self._key_chunks = []  # keys of hashed names, in order added
+        self._pending = []  # names not hashed yet
+        self._cor = array('b')
+        self._names_fh = None
+        self._last_name = None
+        if names_fn is not None:
+            self._names_fh = open(names_fn, 'w')
+        self.keys = None
+        self.counts = None
+
+    def add(self, name, correct_map):
+        """ Record one remapped alignment derived from read "name" """
+        self._pending.append(name)
+        self._cor.append(1 if correct_map else 0)
+        if len(self._pending) >= hash_batch:
+            self._hash_pending()
+        # WASP emits all remap reads for an original read together, so
+        # this catches nearly all duplicates; samtools tolerates the rest
+        if self._names_fh is not None and name != self._last_name:
+            self._names_fh.write(name + '\n')
+            self._last_name = name
+
+    def _hash_pending(self):
+        if len(self._pending) > 0:
+            self._key_chunks.append(name_keys(self._pending))
+            self._pending = []
+
+    def merge(self, other):
+        """ Add remapped alignments recorded by another, unfinalized,
+            histogram, e.g. from a parallel scan of a different shard """
+        self._hash_pending()
+        other._hash_pending()
+        self._key_chunks.extend(other._key_chunks)
+        self._cor.extend(other._cor)
+
+    def close(self):
+        """ Close names file, if any, and hash pending names; needed
+            before pickling """
+        self._hash_pending()
+        if self._names_fh is not None:
+            self._names_fh.close()
+            self._names_fh = None
+
+    def finalize(self):
+        """ Collapse keys into sorted unique keys with packed counts """
+        self.close()
+        keys = np.concatenate(self._key_chunks) if self._key_chunks else np.zeros(0, dtype=np.int64)
+        cor = np.frombuffer(self._cor, dtype=np.int8).astype(bool)
+        self._key_chunks = []
+        self.keys, inv = np.unique(keys, return_inverse=True)
+        self.counts = np.zeros((len(self.keys), 2), dtype=np.uint32)
+        self.counts[:, 0] = np.bincount(inv[cor], minlength=len(self.keys))
+        self.counts[:, 1] = np.bincount(inv[~cor], minlength=len(self.keys))
+        del keys, cor, inv
+        self._cor = array('b')
+        return self
+
+    def nbytes(self):
+        """ Bytes used by the finalized key and count arrays """
+        return self.keys.nbytes + self.counts.nbytes
+
+    def lookup(self, names):
+        """ Return array with, for each name in list names, its row in
+            counts, or -1 if it has no remapped alignments """
+        if len(self.keys) == 0:
+            return np.full(len(names), -1, dtype=np.int64)
+        keys = name_keys(names)
+        rows = np.minimum(self.keys.searchsorted(keys), len(self.keys) - 1)
+        return np.where(self.keys[rows] == keys, rows, -1)
+
+    def _index(self, name):
+        key = name_key(name)
+        i = self.keys.searchsorted(key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return -1
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, name):
+        return self._index(name) >= 0
+
+    def __getitem__(self, name):
+        i = self._index(name)
+        if i < 0:
+            raise KeyError(name)
+        return int(self.counts[i, 0]), int(self.counts[i, 1])
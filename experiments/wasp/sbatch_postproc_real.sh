@@ -45,6 +45,7 @@ python postprocess.py \
     --bam ${P}.sorted.bam \
     \${FASTQ1} \${FASTQ2} \
     --threads ${NTHREADS} \
+    --scan-workers ${NTHREADS} \
     --output ${P}.csv
 EOF
 echo "sbatch .${P}.postproc.sh"
@@ -43,6 +43,7 @@ python postprocess.py \
     --correctness \
     \${FASTQ1} \${FASTQ2} \
     --threads ${NTHREADS} \
+    --scan-workers ${NTHREADS} \
     --output ${P}.csv
 fi
 EOF
@@ -72,6 +73,7 @@ python postprocess.py \
     --correctness \
     \${FASTQ1} \${FASTQ2} \
     --threads ${NTHREADS} \
+    --scan-workers ${NTHREADS} \
     --output ${P}.csv
 fi
 EOF